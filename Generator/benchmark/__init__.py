@@ -0,0 +1 @@
+# ベンチマーク（Generatorフォルダで python -m benchmark として実行する）
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Generatorフォルダ以外から実行された場合もpstg_*モジュールを読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.bench import main
+
+if __name__ == "__main__":
+    sys.exit(main())
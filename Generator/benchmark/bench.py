@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+import configparser
+from datetime import datetime
+
+import pstg_extract
+import pstg_loader
+import pstg_pose
+import pstg_scale
+import pstg_util
+from benchmark import synth
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 比較に使う基準の結果
+# 中央値の絶対値を比較するため、基準は計測するマシンで作り直す（--update-baseline、ばらつく場合は--repeatを増やす）
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# 結果の保存先（--outputを指定しない場合）
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+# (モジュール数, 設定数)の組み合わせ
+DEFAULT_SIZES = ((100, 20), (1000, 100), (5000, 500))
+
+DEFAULT_REPEAT = 5
+
+# 基準の中央値に対してこの倍率を超えたら性能低下とみなす
+DEFAULT_THRESHOLD = 1.25
+
+# 差がこの時間（秒）未満の場合は誤差とみなす
+MIN_DELTA = 0.002
+
+# 計測する処理（結果の表示順）
+BENCHMARKS = ('process_data', 'load_pose_scale_settings', 'generate_pose_toml', 'generate_scale_toml', 'save_file_with_timestamp')
+
+
+def setup_quiet_logging():
+    """ログ出力が無効な場合のアプリと同じ状態にする"""
+    pstg_util.setup_logging(show_debug=False, output_log=False)
+
+def parse_sizes(text):
+    """'1000x100,5000x500' 形式のサイズ指定を[(モジュール数, 設定数), ...]にする"""
+    sizes = []
+    for part in text.split(','):
+        modules, _, rules = part.strip().lower().partition('x')
+        sizes.append((int(modules), int(rules or 0)))
+    return sizes
+
+def size_key(modules, rules):
+    return f"{modules}x{rules}"
+
+def time_call(func, repeat):
+    """funcをrepeat回実行し、所要時間（秒）の最小値と中央値を返す"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return {'min': min(durations), 'median': statistics.median(durations)}
+
+def _make_app_config(settings_dir):
+    """load_pose_scale_settingsに渡す設定（プロファイルなしでPoseScaleData.iniのみを読み込む）"""
+    return {
+        'ConfigParser': configparser.ConfigParser(),
+        'ProfileConfig': configparser.ConfigParser(),
+        'UseModuleNameContains': False,
+        'UseSettingsCache': False, # 毎回INIを解析する時間を計測する
+        'SettingsDir': settings_dir,
+    }
+
+def run_case(module_count, rule_count, repeat, seed=0):
+    """1つのサイズの組み合わせを計測する"""
+    map_chara = pstg_util.load_chara_mapping()
+    with tempfile.TemporaryDirectory(prefix='pstg_bench_') as work_dir, pstg_util.temp_workspace('system'):
+        # FarcPackを使わずに、解凍済みのBINとINIを生成して読み込む
+        sources = synth.write_module_table(work_dir, synth.make_modules(module_count, seed))
+        bin_bytes = sum(os.path.getsize(path) for _, path in sources)
+        settings_dir = os.path.join(work_dir, 'Settings')
+        synth.write_pose_scale_ini(os.path.join(settings_dir, 'PoseScaleData', 'PoseScaleData.ini'), synth.make_rules(rule_count, seed))
+        app_config = _make_app_config(settings_dir)
+
+        module_data = pstg_extract.process_data(sources)
+        pose_settings = pstg_loader.load_pose_scale_settings(module_data, app_config)
+        pose_entries = pstg_pose.generate_pose_toml(module_data, pose_settings, map_chara)
+        scale_entries = pstg_scale.generate_scale_toml(module_data, pose_settings, map_chara)
+        pose_text = '\n'.join(pose_entries)
+        save_path = os.path.join(work_dir, 'output', 'pose.toml')
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+        timings = {
+            'process_data': time_call(lambda: pstg_extract.process_data(sources), repeat),
+            'load_pose_scale_settings': time_call(lambda: pstg_loader.load_pose_scale_settings(module_data, app_config), repeat),
+            'generate_pose_toml': time_call(lambda: pstg_pose.generate_pose_toml(module_data, pose_settings, map_chara), repeat),
+            'generate_scale_toml': time_call(lambda: pstg_scale.generate_scale_toml(module_data, pose_settings, map_chara), repeat),
+            'save_file_with_timestamp': time_call(lambda: pstg_util.save_file_with_timestamp(save_path, pose_text, overwrite=True), repeat),
+        }
+
+    return {
+        'modules': len(module_data),
+        'rules': len(pose_settings),
+        'bin_bytes': bin_bytes,
+        'pose_entries': len(pose_entries),
+        'scale_entries': len(scale_entries),
+        'timings': timings,
+    }
+
+def run_benchmarks(sizes, repeat=DEFAULT_REPEAT, seed=0):
+    """全てのサイズの組み合わせを計測し、結果の辞書を返す"""
+    cases = {}
+    for module_count, rule_count in sizes:
+        key = size_key(module_count, rule_count)
+        print(f"Running {key} ...", flush=True)
+        cases[key] = run_case(module_count, rule_count, repeat, seed)
+    pstg_util.wait_for_temp_cleanup()
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'seed': seed,
+        'cases': cases,
+    }
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, min_delta=MIN_DELTA):
+    """
+    基準と中央値を比較し、性能低下した計測のリストを返す（両方にあるサイズ・処理のみ比較する）
+    戻り値: [(サイズ, 処理, 基準の秒数, 今回の秒数, 倍率), ...]
+    """
+    regressions = []
+    for key, case in results['cases'].items():
+        base_case = baseline.get('cases', {}).get(key)
+        if not base_case:
+            continue
+        for name, timing in case['timings'].items():
+            base_timing = base_case['timings'].get(name)
+            if not base_timing:
+                continue
+            current, base = timing['median'], base_timing['median']
+            ratio = current / base if base else float('inf')
+            if ratio > threshold and current - base >= min_delta:
+                regressions.append((key, name, base, current, ratio))
+    return regressions
+
+def print_results(results, baseline=None):
+    """計測結果を表で表示する（基準がある場合は倍率も表示する）"""
+    for key, case in results['cases'].items():
+        print(f"\n{key}: modules={case['modules']} rules={case['rules']} pose={case['pose_entries']} scale={case['scale_entries']}")
+        base_case = (baseline or {}).get('cases', {}).get(key, {})
+        for name in BENCHMARKS:
+            timing = case['timings'][name]
+            line = f"  {name:<26} median {timing['median'] * 1000:9.2f}ms  min {timing['min'] * 1000:9.2f}ms"
+            base_timing = base_case.get('timings', {}).get(name)
+            if base_timing and base_timing['median']:
+                line += f"  x{timing['median'] / base_timing['median']:.2f} vs baseline"
+            print(line)
+
+def _load_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+def _save_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as json_file:
+        json.dump(data, json_file, ensure_ascii=False, indent=2)
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Benchmark module table parsing, settings loading and TOML generation.')
+    parser.add_argument('--sizes', type=parse_sizes, default=list(DEFAULT_SIZES), help='comma separated MODULESxRULES sizes (default: 100x20,1000x100,5000x500)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs per measurement (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthesized data')
+    parser.add_argument('--output', help='results JSON (default: benchmark/results/bench_<time>.json)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='fail when a median is slower than baseline by this factor (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the new baseline')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """ベンチマークを実行し、基準より遅くなった計測がある場合は1を返す"""
+    args = parse_arguments(sys.argv[1:] if argv is None else argv)
+    setup_quiet_logging()
+
+    results = run_benchmarks(args.sizes, args.repeat, args.seed)
+    output_path = args.output or os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    _save_json(output_path, results)
+
+    baseline = None if args.update_baseline else _load_json(args.baseline)
+    print_results(results, baseline)
+    print(f"\nResults: {output_path}")
+
+    if args.update_baseline:
+        _save_json(args.baseline, results)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline found at {args.baseline} (use --update-baseline to create one)")
+        return 0
+
+    # 別の環境で作った基準との比較は、マシンの差を性能低下とみなしてしまう
+    if (baseline.get('python'), baseline.get('platform')) != (results['python'], results['platform']):
+        print(f"Warning: the baseline was recorded on {baseline.get('platform')} (Python {baseline.get('python')}); "
+              "re-create it on this machine with --update-baseline for a meaningful comparison")
+
+    regressions = compare(results, baseline, args.threshold)
+    for key, name, base, current, ratio in regressions:
+        print(f"REGRESSION {key} {name}: {base * 1000:.2f}ms -> {current * 1000:.2f}ms (x{ratio:.2f})")
+    if regressions:
+        return 1
+    print(f"No regressions (threshold x{args.threshold:.2f})")
+    return 0
@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+import configparser
+
+if __name__ == "__main__":
+    # Generatorフォルダ以外から実行された場合もpstg_*モジュールを読み込めるようにする
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pstg_diff
+import pstg_match
+import pstg_pose
+import pstg_scale
+import pstg_util
+from benchmark.bench import setup_quiet_logging
+
+# ランダムに生成するケース数
+DEFAULT_CASES = 500
+
+# モジュール名・キーワードの部品（部分一致・重複・空白・文字化け・旧除外指定が起きやすいよう少数にする）
+TOKENS = ["Miku", "Mik", "Swim", "Swimsuit", "suit", "水着", "ミク", "A", "�", "|Swim", ""]
+
+# モジュールテーブルのキャラクター（マッピングにないものを含む）
+MODULE_CHARAS = ["MIKU", "RIN", "LUKA", "TETO", "EXTRA"]
+
+# 設定のChara（マッピング後の表記。一致しないもの・未指定を含む）
+RULE_CHARAS = ["MIK", "RIN", "LUK", "TET", "EXTRA", "MIKU", None]
+
+# 設定の値（PoseID / Scale）。空文字・空白のみ・未指定は出力されない
+VALUES = [None, "", " ", "0", "12", "1.05"]
+
+# 差分での設定の決定に使うアーカイブのパス（キャッシュのキーにのみ使う）
+TABLE_PATH = os.path.join("mods", "ModA", "rom", "mod_gm_module_tbl.farc")
+
+
+def reference_pose_toml(module_data, pose_settings, map_chara):
+    """
+    Pose TOMLデータを生成する（最適化前の実装。比較の基準）
+    設定を前から順に走査し、ModuleNameContains指定ありの設定を先に、なければ指定なしの設定を使う
+    """
+    pose_toml_entries = []
+    for module_value in module_data:
+        module_chara = map_chara(module_value["chara"], "module_to_setting")
+
+        # First pass: Specific matches (ModuleNameContains is set)
+        matched = False
+        for setting in pose_settings:
+            match_str = setting["ModuleNameContains"]
+            if match_str:
+                if module_chara == setting["Chara"]:
+                    if pstg_util.is_match(module_value["name"], match_str, setting.get("ModuleExclude")):
+                        if setting["PoseID"] is not None and str(setting["PoseID"]).strip():
+                            pose_toml_entries.append(f'{module_value["id"]} = {setting["PoseID"]}')
+                        matched = True
+                        break
+
+        # Second pass: Fallback matches (ModuleNameContains is empty)
+        if not matched:
+            for setting in pose_settings:
+                match_str = setting["ModuleNameContains"]
+                if not match_str:
+                    if module_chara == setting["Chara"]:
+                        # Check excludes manually
+                        exclude_str = setting.get("ModuleExclude")
+                        is_excluded = False
+                        if exclude_str:
+                            excludes = [word.strip() for word in exclude_str.split(',') if word.strip()]
+                            if any(exc in module_value["name"] for exc in excludes):
+                                is_excluded = True
+
+                        if not is_excluded:
+                            if setting["PoseID"] is not None and str(setting["PoseID"]).strip():
+                                pose_toml_entries.append(f'{module_value["id"]} = {setting["PoseID"]}')
+                            matched = True
+                            break
+
+    return pose_toml_entries
+
+def reference_scale_toml(module_data, scale_settings, map_chara):
+    """Scale TOMLデータを生成する（最適化前の実装。比較の基準）"""
+    scale_toml_entries = []
+    for module_value in module_data:
+        module_chara = map_chara(module_value["chara"], "module_to_setting")
+
+        # First pass: Specific matches (ModuleNameContains is set)
+        matched = False
+        for setting in scale_settings:
+            match_str = setting["ModuleNameContains"]
+            if match_str:
+                if module_chara == setting["Chara"]:
+                    if pstg_util.is_match(module_value["name"], match_str, setting.get("ModuleExclude")):
+                        if setting["Scale"] is not None and str(setting["Scale"]).strip():
+                            chara_value = map_chara(module_value["chara"], "module_to_cos_scale")
+                            cos_value = int(module_value["cos"].replace("COS_", "")) - 1
+                            scale_value = setting["Scale"]
+                            entry = f'[[cos_scale]]\nchara = {chara_value}\ncos = {cos_value}\nscale = {scale_value}\n'
+                            scale_toml_entries.append(entry)
+                        matched = True
+                        break
+
+        # Second pass: Fallback matches (ModuleNameContains is empty)
+        if not matched:
+            for setting in scale_settings:
+                match_str = setting["ModuleNameContains"]
+                if not match_str:
+                    if module_chara == setting["Chara"]:
+                        # Check excludes manually since is_match returns False for empty match_str
+                        exclude_str = setting.get("ModuleExclude")
+                        is_excluded = False
+                        if exclude_str:
+                            excludes = [word.strip() for word in exclude_str.split(',') if word.strip()]
+                            if any(exc in module_value["name"] for exc in excludes):
+                                is_excluded = True
+
+                        if not is_excluded:
+                            if setting["Scale"] is not None and str(setting["Scale"]).strip():
+                                chara_value = map_chara(module_value["chara"], "module_to_cos_scale")
+                                cos_value = int(module_value["cos"].replace("COS_", "")) - 1
+                                scale_value = setting["Scale"]
+                                entry = f'[[cos_scale]]\nchara = {chara_value}\ncos = {cos_value}\nscale = {scale_value}\n'
+                                scale_toml_entries.append(entry)
+                            matched = True
+                            break
+
+    return scale_toml_entries
+
+def reference_select_profiles(module_data, config_profile):
+    """TomlProfile_セクションのうち、モジュールデータと一致するプロファイルを選択する（最適化前の実装。比較の基準）"""
+    matched_profiles = []
+    for section in config_profile.sections():
+        if section.startswith('TomlProfile_'):
+            match_str = config_profile.get(section, 'ModuleMatch', fallback='')
+            exclude_str = config_profile.get(section, 'ModuleExclude', fallback='')
+            if any(pstg_util.is_match(module.get('name', ''), match_str, exclude_str) for module in module_data):
+                matched_profiles.append(section)
+    return matched_profiles
+
+def reference_resolve(previous_modules, previous_rules, modules, rules, map_chara):
+    """今回のモジュールテーブルの全てのモジュールの設定を決定する（前回の状態を使わない。比較の基準）"""
+    return pstg_match.resolve_modules(modules, pstg_match.RuleMatcher(rules), map_chara)
+
+
+class MemoryTableCache:
+    """DirectoryCacheと同じく値を複製して保存するモジュールテーブルのキャッシュ（ファイルには書き込まない）"""
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key):
+        data = self._values.get(key)
+        return pickle.loads(data) if data is not None else None
+
+    def put(self, key, value):
+        self._values[key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+def incremental_resolve(previous_modules, previous_rules, modules, rules, map_chara):
+    """前回のモジュールテーブル・設定で処理した状態から、今回のモジュールテーブルの設定を差分で決定する"""
+    table_cache = MemoryTableCache()
+    pstg_diff.resolve_modules_incremental(table_cache, TABLE_PATH, previous_modules, previous_rules, lambda: pstg_match.RuleMatcher(previous_rules), map_chara)
+    assignments, _ = pstg_diff.resolve_modules_incremental(table_cache, TABLE_PATH, modules, rules, lambda: pstg_match.RuleMatcher(rules), map_chara)
+    return assignments
+
+def reference_outputs(modules, rules, map_chara):
+    return reference_pose_toml(modules, rules, map_chara), reference_scale_toml(modules, rules, map_chara)
+
+def rule_matcher_outputs(modules, rules, map_chara):
+    return pstg_pose.generate_pose_toml(modules, rules, map_chara), pstg_scale.generate_scale_toml(modules, rules, map_chara)
+
+def _profile_config(profiles):
+    """プロファイルのリストからTomlProfile.iniと同じ形式の設定を作る（TomlProfile_以外のセクションを含む）"""
+    config_profile = configparser.ConfigParser()
+    config_profile['GeneralSettings'] = {'ModuleMatch': 'Miku'}
+    for index, profile in enumerate(profiles):
+        config_profile[f'TomlProfile_{index}'] = profile
+    return config_profile
+
+def reference_profiles(modules, profiles, map_chara):
+    return reference_select_profiles(modules, _profile_config(profiles))
+
+def automaton_profiles(modules, profiles, map_chara):
+    return pstg_match.select_profiles(modules, _profile_config(profiles))
+
+
+def _random_keywords(rng, max_words=3):
+    """カンマ区切りのキーワード文字列（空白・空要素を含む）、空文字、Noneのいずれかを返す"""
+    roll = rng.random()
+    if roll < 0.15:
+        return None
+    if roll < 0.2:
+        return rng.choice(["", " ", ",", " , "])
+    words = [rng.choice(TOKENS) for _ in range(rng.randint(1, max_words))]
+    return ",".join(rng.choice(["", " "]) + word + rng.choice(["", " "]) for word in words)
+
+def _random_modules(rng, max_modules=12):
+    modules = []
+    for num in range(rng.randint(0, max_modules)):
+        modules.append({
+            "module_num": str(num),
+            "chara": rng.choice(MODULE_CHARAS),
+            "cos": f"COS_{rng.randint(1, 999):03d}",
+            "id": str(rng.randint(0, 40)), # 重複するIDも生成する
+            "name": "".join(rng.choice(TOKENS) + rng.choice(["", " ", "_"]) for _ in range(rng.randint(0, 4))),
+        })
+    return modules
+
+def _random_rules(rng, max_rules=10):
+    rules = []
+    for _ in range(rng.randint(0, max_rules)):
+        rules.append({
+            "Chara": rng.choice(RULE_CHARAS),
+            "ModuleNameContains": _random_keywords(rng),
+            "ModuleExclude": _random_keywords(rng, 2),
+            "PoseID": rng.choice(VALUES),
+            "Scale": rng.choice(VALUES),
+        })
+    return rules
+
+def make_case(rng):
+    """ランダムなモジュールテーブルとPoseScale設定を生成する"""
+    return _random_modules(rng), _random_rules(rng)
+
+def make_incremental_case(rng):
+    """
+    前回と今回のモジュールテーブル・PoseScale設定を生成する
+    前回のテーブルは今回のモジュールの一部を削除・名前変更し、別のモジュールを加えたもの。設定は多くの場合前回と同じ
+    """
+    modules, rules = make_case(rng)
+    previous_modules = []
+    for module in modules:
+        roll = rng.random()
+        if roll < 0.2:
+            continue # 今回追加されたモジュール
+        if roll < 0.4:
+            module = dict(module, name=module["name"] + rng.choice(TOKENS)) # 今回変更されたモジュール
+        previous_modules.append(module)
+    previous_modules += _random_modules(rng, 3) # 今回削除されたモジュール
+    previous_rules = list(rules) if rng.random() < 0.7 else _random_rules(rng)
+    return previous_modules, previous_rules, modules, rules
+
+def make_profile_case(rng):
+    """ランダムなモジュールテーブルとTomlProfileのModuleMatch / ModuleExcludeを生成する（未指定のキーを含む）"""
+    profiles = []
+    for _ in range(rng.randint(0, 6)):
+        profile = {'PoseFileName': 'pose'}
+        for key, max_words in (('ModuleMatch', 3), ('ModuleExclude', 2)):
+            keywords = _random_keywords(rng, max_words)
+            if keywords is not None:
+                profile[key] = keywords
+        profiles.append(profile)
+    return _random_modules(rng), profiles
+
+# 比較するエンジン（名前 -> (ケースの生成関数, 基準の実装, 新しい実装)）。新しい実装はここに追加する
+# ケースはリストのタプルで、実装には(*ケース, map_chara)を渡す
+ENGINES = {
+    'rule_matcher': (make_case, reference_outputs, rule_matcher_outputs),
+    'incremental_resolve': (make_incremental_case, reference_resolve, incremental_resolve),
+    'profile_select': (make_profile_case, reference_profiles, automaton_profiles),
+}
+
+
+def find_difference(engine, case, map_chara):
+    """基準の実装とエンジンの出力を比較し、異なる場合はその内容を返す（同じ場合はNone）"""
+    _, reference_func, engine_func = engine
+    expected = reference_func(*case, map_chara)
+    actual = engine_func(*case, map_chara)
+    if expected == actual:
+        return None
+    return {'expected': expected, 'actual': actual}
+
+def shrink_case(engine, case, map_chara):
+    """出力が異なるケースから、差が出なくなるまでケースの各リストの要素を1件ずつ取り除き、最小のケースを返す"""
+    case = list(case)
+    changed = True
+    while changed:
+        changed = False
+        for position, items in enumerate(case):
+            for index in range(len(items) - 1, -1, -1):
+                candidate = case[:position] + [items[:index] + items[index + 1:]] + case[position + 1:]
+                if find_difference(engine, candidate, map_chara) is not None:
+                    case = candidate
+                    items = case[position]
+                    changed = True
+            if changed:
+                break
+    return tuple(case)
+
+def check_engine(name, engine, cases=DEFAULT_CASES, seed=0):
+    """
+    ランダムなケースで基準の実装とエンジンの出力を比較し、両方の所要時間を記録する
+    戻り値: {'engine', 'cases', 'seed', 'reference_seconds', 'engine_seconds', 'failure'}
+    failureは最初に見つかった差（最小化したケースと出力）で、差がなければNone
+    """
+    make_case_func, reference_func, engine_func = engine
+    rng = random.Random(seed)
+    map_chara = pstg_util.load_chara_mapping()
+    timings = {'reference': 0.0, 'engine': 0.0}
+    failure = None
+    for case_index in range(cases):
+        case = make_case_func(rng)
+
+        start = time.perf_counter()
+        expected = reference_func(*case, map_chara)
+        timings['reference'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = engine_func(*case, map_chara)
+        timings['engine'] += time.perf_counter() - start
+
+        if expected != actual:
+            case = shrink_case(engine, case, map_chara)
+            failure = {'case': case_index, 'inputs': case}
+            failure.update(find_difference(engine, case, map_chara))
+            break
+
+    return {
+        'engine': name,
+        'cases': case_index + 1 if cases else 0,
+        'seed': seed,
+        'reference_seconds': timings['reference'],
+        'engine_seconds': timings['engine'],
+        'failure': failure,
+    }
+
+def main(argv=None):
+    """全てのエンジン（または指定したエンジン）を検証し、出力が異なるものがあれば1を返す"""
+    parser = argparse.ArgumentParser(prog='python -m benchmark.equivalence', description='Compare TOML generation, incremental resolving and profile selection with the reference implementations on random module tables and rules.')
+    parser.add_argument('--engine', choices=sorted(ENGINES), action='append', help='engine to check (default: all)')
+    parser.add_argument('--cases', type=int, default=DEFAULT_CASES, help='random cases per engine (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=None, help='random seed (default: random, printed for reproduction)')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    setup_quiet_logging()
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    reports = []
+    for name in args.engine or sorted(ENGINES):
+        report = check_engine(name, ENGINES[name], args.cases, seed)
+        reports.append(report)
+        speedup = report['reference_seconds'] / report['engine_seconds'] if report['engine_seconds'] else 0
+        status = 'FAIL' if report['failure'] else 'OK'
+        print(f"[{status}] {name}: {report['cases']} cases (seed {seed}), reference {report['reference_seconds'] * 1000:.1f}ms, "
+              f"engine {report['engine_seconds'] * 1000:.1f}ms (x{speedup:.2f})")
+        if report['failure']:
+            print(json.dumps(report['failure'], ensure_ascii=False, indent=2, default=str))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as json_file:
+            json.dump(reports, json_file, ensure_ascii=False, indent=2, default=str)
+    return 1 if any(report['failure'] for report in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+import random
+
+# キャラクター（モジュールテーブルの表記, 設定ファイルの表記）
+CHARAS = [
+    ("MIKU", "MIK"), ("RIN", "RIN"), ("LEN", "LEN"), ("LUKA", "LUK"), ("NERU", "NER"),
+    ("HAKU", "HAK"), ("KAITO", "KAI"), ("MEIKO", "MEI"), ("SAKINE", "SAK"), ("TETO", "TET"),
+]
+
+# モジュール名の語彙（先頭ほど出現しやすい）
+NAME_WORDS = [
+    "ミク", "リン", "レン", "ルカ", "水着", "スク水", "制服", "浴衣", "ドレス", "ナース",
+    "メイド", "チャイナ", "サンタ", "ゴシック", "パンク", "アイドル", "Append", "Type2020",
+    "Swimwear", "Uniform", "Casual", "Winter", "Summer", "Stage", "Future", "Classic",
+    "Cyber", "Magical", "Sakura", "Snow", "Star", "Night", "Retro", "Pop", "Rock", "Jazz",
+]
+
+# モジュールテーブルに含まれるchara / cos / id / name以外のキー（実際のBINと同程度の行数にするため）
+EXTRA_KEYS = ("attr", "ng", "shop_ed_day", "shop_ed_month", "shop_ed_year", "shop_price",
+              "shop_st_day", "shop_st_month", "shop_st_year", "sort_index")
+
+# Zipf分布に近い重み（一部の語が多くのモジュール名・設定に使われる）
+_WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(NAME_WORDS))]
+
+
+def _pick_words(rng, count):
+    """語彙から重複なしでcount個の語を選ぶ"""
+    words = []
+    while len(words) < count:
+        word = rng.choices(NAME_WORDS, weights=_WORD_WEIGHTS)[0]
+        if word not in words:
+            words.append(word)
+    return words
+
+def make_modules(count, seed=0):
+    """モジュールデータ（process_dataの戻り値と同じ形式）をcount件生成する"""
+    rng = random.Random(seed)
+    modules = []
+    for num in range(count):
+        chara, _ = rng.choice(CHARAS)
+        modules.append({
+            "module_num": str(num),
+            "chara": chara,
+            "cos": f"COS_{rng.randint(1, 600):03d}",
+            "id": str(num + 1000),
+            "name": " ".join(_pick_words(rng, rng.randint(1, 3))),
+        })
+    return modules
+
+def make_rules(count, seed=0):
+    """
+    PoseScale設定（load_pose_scale_settingsの戻り値と同じ形式）をcount件生成する
+    大半はキーワード指定の設定で、末尾にキーワードなしの設定（Fallback）をキャラクターごとに最大1件含む
+    """
+    rng = random.Random(seed)
+    fallback_count = min(len(CHARAS), max(1, count // 10))
+    rules = []
+    for index in range(count):
+        _, chara = rng.choice(CHARAS)
+        fallback = index >= count - fallback_count # 末尾の設定はFallbackにする
+        rules.append({
+            "Chara": CHARAS[count - 1 - index][1] if fallback else chara,
+            "ModuleNameContains": None if fallback else ", ".join(_pick_words(rng, rng.randint(1, 3))),
+            "ModuleExclude": ", ".join(_pick_words(rng, rng.randint(1, 2))) if rng.random() < 0.3 else None,
+            "PoseID": str(rng.randint(0, 300)) if rng.random() < 0.8 else None,
+            "Scale": f"{rng.uniform(0.9, 1.1):.3f}" if rng.random() < 0.6 else None,
+        })
+    return rules
+
+def module_table_text(modules):
+    """モジュールデータをgm_module_tblのBINと同じ module.N.key=value 形式（キー順）のテキストにする"""
+    lines = []
+    for module in modules:
+        values = {key: module[key] for key in ("chara", "cos", "id", "name")}
+        values.update((key, "0") for key in EXTRA_KEYS)
+        lines.extend(f"module.{module['module_num']}.{key}={values[key]}" for key in sorted(values))
+    lines.append(f"module.data_list.length={len(modules)}")
+    return "\n".join(lines) + "\n"
+
+def write_module_table(directory, modules, files=1):
+    """
+    モジュールテーブルのBINファイルをgm_module_tblフォルダに書き出す（files個に分割）
+    戻り値: process_dataに渡す(ファイル名, パス)のリスト
+    """
+    table_dir = os.path.join(directory, "gm_module_tbl")
+    os.makedirs(table_dir, exist_ok=True)
+    sources = []
+    per_file = max(1, -(-len(modules) // files))
+    for part in range(files):
+        chunk = modules[part * per_file:(part + 1) * per_file]
+        if not chunk and part:
+            break
+        file_name = f"gm_module_tbl{'_' + str(part) if part else ''}.bin"
+        path = os.path.join(table_dir, file_name)
+        with open(path, "w", encoding="utf-8", newline="\n") as bin_file:
+            bin_file.write(module_table_text(chunk))
+        sources.append((file_name, path))
+    return sources
+
+def write_pose_scale_ini(path, rules):
+    """PoseScale設定をPoseScaleDataのINIファイルとして書き出す"""
+    lines = []
+    for index, rule in enumerate(rules):
+        lines.append(f"[PoseScaleSetting_{index + 1}]")
+        for key in ("Chara", "ModuleNameContains", "ModuleExclude", "PoseID", "Scale"):
+            if rule[key] is not None:
+                lines.append(f"{key} = {rule[key]}")
+        lines.append("")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as ini_file:
+        ini_file.write("\n".join(lines))
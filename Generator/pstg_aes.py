@@ -0,0 +1,124 @@
+"""AES-128 復号（暗号化FARC用の最小実装・標準ライブラリのみ）"""
+
+# S-Box（暗号化用）
+_SBOX = [
+    0x63, 0x7c, 0x77, 0x7b, 0xf2, 0x6b, 0x6f, 0xc5, 0x30, 0x01, 0x67, 0x2b, 0xfe, 0xd7, 0xab, 0x76,
+    0xca, 0x82, 0xc9, 0x7d, 0xfa, 0x59, 0x47, 0xf0, 0xad, 0xd4, 0xa2, 0xaf, 0x9c, 0xa4, 0x72, 0xc0,
+    0xb7, 0xfd, 0x93, 0x26, 0x36, 0x3f, 0xf7, 0xcc, 0x34, 0xa5, 0xe5, 0xf1, 0x71, 0xd8, 0x31, 0x15,
+    0x04, 0xc7, 0x23, 0xc3, 0x18, 0x96, 0x05, 0x9a, 0x07, 0x12, 0x80, 0xe2, 0xeb, 0x27, 0xb2, 0x75,
+    0x09, 0x83, 0x2c, 0x1a, 0x1b, 0x6e, 0x5a, 0xa0, 0x52, 0x3b, 0xd6, 0xb3, 0x29, 0xe3, 0x2f, 0x84,
+    0x53, 0xd1, 0x00, 0xed, 0x20, 0xfc, 0xb1, 0x5b, 0x6a, 0xcb, 0xbe, 0x39, 0x4a, 0x4c, 0x58, 0xcf,
+    0xd0, 0xef, 0xaa, 0xfb, 0x43, 0x4d, 0x33, 0x85, 0x45, 0xf9, 0x02, 0x7f, 0x50, 0x3c, 0x9f, 0xa8,
+    0x51, 0xa3, 0x40, 0x8f, 0x92, 0x9d, 0x38, 0xf5, 0xbc, 0xb6, 0xda, 0x21, 0x10, 0xff, 0xf3, 0xd2,
+    0xcd, 0x0c, 0x13, 0xec, 0x5f, 0x97, 0x44, 0x17, 0xc4, 0xa7, 0x7e, 0x3d, 0x64, 0x5d, 0x19, 0x73,
+    0x60, 0x81, 0x4f, 0xdc, 0x22, 0x2a, 0x90, 0x88, 0x46, 0xee, 0xb8, 0x14, 0xde, 0x5e, 0x0b, 0xdb,
+    0xe0, 0x32, 0x3a, 0x0a, 0x49, 0x06, 0x24, 0x5c, 0xc2, 0xd3, 0xac, 0x62, 0x91, 0x95, 0xe4, 0x79,
+    0xe7, 0xc8, 0x37, 0x6d, 0x8d, 0xd5, 0x4e, 0xa9, 0x6c, 0x56, 0xf4, 0xea, 0x65, 0x7a, 0xae, 0x08,
+    0xba, 0x78, 0x25, 0x2e, 0x1c, 0xa6, 0xb4, 0xc6, 0xe8, 0xdd, 0x74, 0x1f, 0x4b, 0xbd, 0x8b, 0x8a,
+    0x70, 0x3e, 0xb5, 0x66, 0x48, 0x03, 0xf6, 0x0e, 0x61, 0x35, 0x57, 0xb9, 0x86, 0xc1, 0x1d, 0x9e,
+    0xe1, 0xf8, 0x98, 0x11, 0x69, 0xd9, 0x8e, 0x94, 0x9b, 0x1e, 0x87, 0xe9, 0xce, 0x55, 0x28, 0xdf,
+    0x8c, 0xa1, 0x89, 0x0d, 0xbf, 0xe6, 0x42, 0x68, 0x41, 0x99, 0x2d, 0x0f, 0xb0, 0x54, 0xbb, 0x16,
+]
+
+# 逆S-Box（復号用）
+_INV_SBOX = [0] * 256
+for _i, _v in enumerate(_SBOX):
+    _INV_SBOX[_v] = _i
+
+_RCON = [0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36]
+
+
+def _xtime(a):
+    """GF(2^8)上で2倍する"""
+    a <<= 1
+    return (a ^ 0x1b) & 0xff if a & 0x100 else a
+
+def _gmul(a, b):
+    """GF(2^8)上の乗算"""
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = _xtime(a)
+        b >>= 1
+    return result
+
+# InvMixColumns用の乗算テーブル（起動時に一度だけ生成）
+_MUL9 = [_gmul(i, 9) for i in range(256)]
+_MUL11 = [_gmul(i, 11) for i in range(256)]
+_MUL13 = [_gmul(i, 13) for i in range(256)]
+_MUL14 = [_gmul(i, 14) for i in range(256)]
+
+
+def _expand_key(key):
+    """AES-128の鍵スケジュールを生成し、ラウンド鍵（11個×16バイト）を返す"""
+    if len(key) != 16:
+        raise ValueError("AES-128の鍵は16バイトである必要があります")
+
+    words = [list(key[i:i + 4]) for i in range(0, 16, 4)]
+    for i in range(4, 44):
+        temp = list(words[i - 1])
+        if i % 4 == 0:
+            temp = temp[1:] + temp[:1] # RotWord
+            temp = [_SBOX[b] for b in temp] # SubWord
+            temp[0] ^= _RCON[i // 4 - 1]
+        words.append([words[i - 4][j] ^ temp[j] for j in range(4)])
+
+    return [sum(words[r * 4:r * 4 + 4], []) for r in range(11)]
+
+
+class AESDecryptor:
+    """AES-128の復号器（ECB / CBC）"""
+
+    def __init__(self, key):
+        self._round_keys = _expand_key(bytes(key))
+
+    def decrypt_block(self, block):
+        """16バイトのブロックを1つ復号する"""
+        rk = self._round_keys
+        s = [block[i] ^ rk[10][i] for i in range(16)]
+
+        for rnd in range(9, -1, -1):
+            # InvShiftRows + InvSubBytes（状態は列優先で並んでいる）
+            s = [
+                _INV_SBOX[s[0]], _INV_SBOX[s[13]], _INV_SBOX[s[10]], _INV_SBOX[s[7]],
+                _INV_SBOX[s[4]], _INV_SBOX[s[1]], _INV_SBOX[s[14]], _INV_SBOX[s[11]],
+                _INV_SBOX[s[8]], _INV_SBOX[s[5]], _INV_SBOX[s[2]], _INV_SBOX[s[15]],
+                _INV_SBOX[s[12]], _INV_SBOX[s[9]], _INV_SBOX[s[6]], _INV_SBOX[s[3]],
+            ]
+            # AddRoundKey
+            k = rk[rnd]
+            s = [s[i] ^ k[i] for i in range(16)]
+            # InvMixColumns（最終ラウンドは省略）
+            if rnd > 0:
+                mixed = []
+                for c in range(0, 16, 4):
+                    a0, a1, a2, a3 = s[c:c + 4]
+                    mixed += [
+                        _MUL14[a0] ^ _MUL11[a1] ^ _MUL13[a2] ^ _MUL9[a3],
+                        _MUL9[a0] ^ _MUL14[a1] ^ _MUL11[a2] ^ _MUL13[a3],
+                        _MUL13[a0] ^ _MUL9[a1] ^ _MUL14[a2] ^ _MUL11[a3],
+                        _MUL11[a0] ^ _MUL13[a1] ^ _MUL9[a2] ^ _MUL14[a3],
+                    ]
+                s = mixed
+
+        return bytes(s)
+
+    def decrypt_ecb(self, data):
+        """ECBモードで復号する（長さは16の倍数であること）"""
+        if len(data) % 16:
+            raise ValueError("暗号化データの長さが16の倍数ではありません")
+        return b''.join(self.decrypt_block(data[i:i + 16]) for i in range(0, len(data), 16))
+
+    def decrypt_cbc(self, data, iv):
+        """CBCモードで復号する（長さは16の倍数であること）"""
+        if len(data) % 16:
+            raise ValueError("暗号化データの長さが16の倍数ではありません")
+        out = []
+        prev = bytes(iv)
+        for i in range(0, len(data), 16):
+            block = data[i:i + 16]
+            plain = self.decrypt_block(block)
+            out.append(bytes(p ^ q for p, q in zip(plain, prev)))
+            prev = block
+        return b''.join(out)
@@ -0,0 +1,304 @@
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+from pstg_util import get_app_dir
+
+# キャッシュ形式のバージョン（形式を変更した場合は上げる）
+CACHE_FORMAT_VERSION = 1
+
+# 解析済み設定のキャッシュファイル名
+SETTINGS_CACHE_FILE = 'settings.cache'
+
+# 処理結果のキャッシュフォルダ名
+RESULT_CACHE_DIR = 'results'
+
+# 抽出したモジュールテーブルのキャッシュフォルダ名（ExtractCacheDir未指定時）
+EXTRACT_CACHE_DIR = 'extract'
+
+# 前回解析したモジュールテーブルと割り当て結果の保存フォルダ名（アーカイブのパスごと）
+TABLE_CACHE_DIR = 'tables'
+
+# 出力ファイルごとに、各アーカイブが出力したエントリのキーの保存フォルダ名（既存のTOMLの更新用）
+CONTRIBUTION_CACHE_DIR = 'contributions'
+
+# 出力したエントリのキーの保存サイズの上限（古い出力ファイルの記録から削除する）
+CONTRIBUTION_CACHE_SIZE = 16 * 1024 * 1024
+
+# コンパイル済みマッチャーを保持する最大数
+MAX_CACHED_MATCHERS = 8
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# ディレクトリキャッシュのエントリファイルの拡張子
+CACHE_ENTRY_EXT = '.cache'
+
+
+def get_cache_dir():
+    """キャッシュディレクトリのパスを取得（Settingsフォルダと同じ階層のCacheフォルダ）"""
+    return os.path.join(get_app_dir(), 'Cache')
+
+def hash_file(path):
+    """ファイル内容のSHA-256をチャンク単位で計算する"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_data(*parts):
+    """文字列・バイト列を連結したSHA-256を計算する（キャッシュのキー用）"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0') # 区切り
+    return digest.hexdigest()
+
+def write_file_atomic(path, data):
+    """一時ファイルに書き込んでから置き換える（同時実行中のプロセスが壊れたファイルを読まないように）"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.tmp_', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SettingsCache:
+    """
+    解析済みの設定ファイルを保存するバイナリキャッシュ
+    エントリはパス・更新日時・サイズ・内容のハッシュで検証する
+    （更新日時とサイズが一致すればファイルを読まずに使い、異なる場合はハッシュで内容の変更を確認する）
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache_dir(), SETTINGS_CACHE_FILE)
+        self._entries = {} # 正規化したパス -> {'mtime_ns', 'size', 'sha256', 'data'}
+        self._matchers = {} # 設定のフィンガープリント -> コンパイル済みマッチャー
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """キャッシュファイルを読み込む（壊れている場合・形式が古い場合は空から始める）"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as file:
+                payload = pickle.load(file)
+            if payload.get('version') != CACHE_FORMAT_VERSION:
+                logging.info("設定キャッシュの形式が異なるため再作成します")
+                return
+            self._entries = payload.get('entries', {})
+            self._matchers = payload.get('matchers', {})
+        except Exception as e:
+            logging.warning(f"設定キャッシュを読み込めませんでした（再作成します）: {e}")
+            self._entries = {}
+            self._matchers = {}
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def get(self, path):
+        """ファイルが変更されていなければキャッシュ済みのデータを返す（なければNone）"""
+        entry = self._entries.get(self._key(path))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        if entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            self.hits += 1
+            return entry['data']
+
+        # 更新日時だけが変わった場合（保存し直しただけなど）は内容のハッシュで判定する
+        if entry['size'] == stat.st_size and entry['sha256'] == hash_file(path):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self._dirty = True
+            self.hits += 1
+            return entry['data']
+
+        self.misses += 1
+        return None
+
+    def put(self, path, data):
+        """ファイルの解析結果を保存する"""
+        try:
+            stat = os.stat(path)
+            sha256 = hash_file(path)
+        except OSError as e:
+            logging.warning(f"設定キャッシュに登録できませんでした: {path}: {e}")
+            return
+        self._entries[self._key(path)] = {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': sha256,
+            'data': data,
+        }
+        self._dirty = True
+
+    def get_matcher(self, fingerprint):
+        """設定のフィンガープリントに対応するコンパイル済みマッチャーを返す（なければNone）"""
+        return self._matchers.get(fingerprint)
+
+    def put_matcher(self, fingerprint, matcher):
+        """コンパイル済みマッチャーを保存する（古いものから削除して上限を保つ）"""
+        self._matchers.pop(fingerprint, None)
+        self._matchers[fingerprint] = matcher
+        while len(self._matchers) > MAX_CACHED_MATCHERS:
+            del self._matchers[next(iter(self._matchers))]
+        self._dirty = True
+
+    def save(self):
+        """変更がある場合のみキャッシュファイルを書き込む"""
+        if not self._dirty:
+            return
+        payload = {'version': CACHE_FORMAT_VERSION, 'entries': self._entries, 'matchers': self._matchers}
+        try:
+            write_file_atomic(self.path, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+            self._dirty = False
+            logging.info(f"設定キャッシュを保存しました: {self.path}")
+        except OSError as e:
+            logging.warning(f"設定キャッシュを保存できませんでした: {e}")
+
+
+class DirectoryCache:
+    """
+    キーごとに1ファイルで保存するLRUキャッシュ（複数プロセスから同時に使用できる）
+    最終使用日時はファイルの更新日時で管理し、合計サイズが上限を超えたら古いものから削除する
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max(0, int(max_bytes))
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{CACHE_ENTRY_EXT}")
+
+    def get(self, key):
+        """キーに対応する値を返す（なければNone）"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                payload = pickle.load(file)
+            if payload.get('version') != CACHE_FORMAT_VERSION or payload.get('key') != key:
+                raise ValueError("キャッシュの形式が一致しません")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logging.warning(f"キャッシュを読み込めなかったため削除します: {path}: {e}")
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path) # 最終使用日時を更新（LRU）
+        except OSError:
+            pass
+        self.hits += 1
+        return payload['value']
+
+    def put(self, key, value):
+        """値を保存し、上限を超えた場合は古いエントリを削除する"""
+        if not self.max_bytes:
+            return
+        data = pickle.dumps({'version': CACHE_FORMAT_VERSION, 'key': key, 'value': value}, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            logging.info(f"キャッシュの上限を超えるため保存しません: {key} ({len(data)} bytes)")
+            return
+        try:
+            write_file_atomic(self._path(key), data)
+        except OSError as e:
+            logging.warning(f"キャッシュを保存できませんでした: {key}: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """合計サイズが上限以下になるまで最終使用日時の古いエントリから削除する"""
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(CACHE_ENTRY_EXT):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        except FileNotFoundError:
+            return
+
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                logging.debug(f"キャッシュを削除しました（LRU）: {path}")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+# プロセス内で共有する設定キャッシュ
+_settings_cache = None
+
+def get_settings_cache():
+    """プロセス内で共有する設定キャッシュを取得する（初回のみファイルから読み込む）"""
+    global _settings_cache
+    if _settings_cache is None:
+        _settings_cache = SettingsCache()
+    return _settings_cache
+
+def get_result_cache(max_bytes):
+    """処理結果（生成したTOMLの内容）のキャッシュを取得する"""
+    return DirectoryCache(os.path.join(get_cache_dir(), RESULT_CACHE_DIR), max_bytes)
+
+def get_table_cache(max_bytes):
+    """前回解析したモジュールテーブルのキャッシュを取得する（モジュールテーブルの差分の検出用）"""
+    return DirectoryCache(os.path.join(get_cache_dir(), TABLE_CACHE_DIR), max_bytes)
+
+def get_contribution_cache():
+    """出力ファイルごとに、各アーカイブが前回出力したエントリのキーの保存先を取得する"""
+    return DirectoryCache(os.path.join(get_cache_dir(), CONTRIBUTION_CACHE_DIR), CONTRIBUTION_CACHE_SIZE)
+
+def get_extract_cache(directory, max_bytes):
+    """抽出したモジュールテーブルのキャッシュを取得する（directoryが空の場合はCacheフォルダ内、相対パスはアプリケーションのディレクトリ基準）"""
+    if not directory:
+        directory = os.path.join(get_cache_dir(), EXTRACT_CACHE_DIR)
+    elif not os.path.isabs(directory):
+        directory = os.path.join(get_app_dir(), directory)
+    return DirectoryCache(directory, max_bytes)
@@ -0,0 +1,104 @@
+import os
+import time
+import logging
+import pstg_ipc
+
+# 取りまとめ役の接続先ファイル名・ロックファイル名（Cacheフォルダ内）
+COORDINATOR_ENDPOINT = 'coordinator.json'
+COORDINATOR_LOCK = 'coordinator.lock'
+
+# 取りまとめ役が待ち受けを始める前にロックを取得したプロセスを待つ時間（秒）
+LOCK_WAIT_SECONDS = 2.0
+
+# 取りまとめを続ける最大時間（秒）。連続して起動され続けても処理を始められるように
+MAX_COALESCE_SECONDS = 10.0
+
+# この時間以上前のロックは異常終了したプロセスの残骸とみなす（秒）
+STALE_LOCK_SECONDS = 30.0
+
+# 転送の応答を待つ時間（秒）。取りまとめ役はパスを受け取るだけなのですぐに応答する
+FORWARD_TIMEOUT = 1.0
+
+
+def _lock_path():
+    return pstg_ipc.get_endpoint_path(COORDINATOR_LOCK)
+
+def _try_lock():
+    """取りまとめ役のロックを取得する（取得できた場合True）"""
+    path = _lock_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # 異常終了したプロセスのロックが残っている場合は削除して取り直す
+        try:
+            if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+                logging.warning(f"古いロックファイルを削除します: {path}")
+                os.remove(path)
+                return _try_lock()
+        except OSError:
+            pass
+        return False
+    with os.fdopen(fd, 'w') as file:
+        file.write(str(os.getpid()))
+    return True
+
+def _release_lock():
+    try:
+        os.remove(_lock_path())
+    except OSError:
+        pass
+
+def _forward(paths):
+    """取りまとめ役にパスを転送する（受け付けられた場合True）"""
+    response = pstg_ipc.send_request('add', timeout=FORWARD_TIMEOUT, endpoint_name=COORDINATOR_ENDPOINT, paths=paths)
+    return bool(response and response.get('status') == 'ok')
+
+def coalesce_paths(paths, window):
+    """
+    短時間に連続して起動されたプロセスの引数を1つのバッチにまとめる（「送る」で複数ファイルを選択した場合など）
+    - 取りまとめ役が待ち受けている場合はパスを転送してNoneを返す（呼び出し側はそのまま終了する）
+    - 最初に起動したプロセスはロックを取得して取りまとめ役になり、window秒新しいパスが届かなくなるまで受け付ける
+    戻り値: このプロセスで処理するパスのリスト、または転送した場合はNone
+    """
+    paths = [os.path.abspath(path.strip('{}')) for path in paths]
+    if window <= 0:
+        return paths
+
+    # ロックを取得できなければ取りまとめ役がいるため転送する（ロックが取得されている間のみ再試行する）
+    # 取りまとめ役は待ち受けを閉じてからロックを解放するため、ロックが解放された後に届かない転送を待つことはない
+    wait_until = time.monotonic() + LOCK_WAIT_SECONDS
+    while True:
+        if _try_lock():
+            break
+        if _forward(paths):
+            logging.info(f"起動中のプロセスにパスを転送しました: {paths}")
+            return None
+        if time.monotonic() >= wait_until:
+            # 取りまとめ役と通信できない場合はこのプロセスで処理する
+            logging.warning("取りまとめ役のプロセスに転送できなかったため、このプロセスで処理します")
+            return paths
+        time.sleep(0.05)
+
+    collected = list(paths)
+
+    def handle(request):
+        if request.get('command') != 'add':
+            return {'status': 'error', 'message': f"unknown command: {request.get('command')}"}
+        for path in request.get('paths', []):
+            if path not in collected:
+                collected.append(path)
+        logging.info(f"転送されたパスを受け付けました: {request.get('paths')}")
+        return {'status': 'ok'}
+
+    try:
+        endpoint = pstg_ipc.ServiceEndpoint(handle, endpoint_name=COORDINATOR_ENDPOINT)
+        try:
+            endpoint.serve_forever(idle_timeout=window, deadline=time.monotonic() + MAX_COALESCE_SECONDS)
+        finally:
+            endpoint.close()
+    finally:
+        _release_lock()
+
+    logging.info(f"{len(collected)}件のパスをまとめて処理します")
+    return collected
@@ -1,8 +1,54 @@
 import configparser
 import os
 import logging
+from pstg_cache import get_settings_cache
 from pstg_util import get_app_dir
 
+def read_config_cached(config, path):
+    """
+    INIファイルをConfigParserに読み込む
+    ファイルが変更されていなければ解析済みのセクションをキャッシュから復元する
+    """
+    if not os.path.exists(path):
+        return
+
+    cache = get_settings_cache()
+    sections = cache.get(path)
+    if sections is None:
+        parsed = configparser.ConfigParser()
+        parsed.read(path, encoding='utf-8-sig')
+        # 補間前の値をセクションごとに保存する
+        sections = {section: dict(parsed.items(section, raw=True)) for section in parsed.sections()}
+        cache.put(path, sections)
+        cache.save()
+    config.read_dict(sections)
+
+def get_config_path():
+    """Config.iniのパスを取得（Settingsフォルダになければアプリケーションのディレクトリ）"""
+    app_dir = get_app_dir()
+    ini_path = os.path.join(app_dir, 'Settings', 'Config.ini')
+    if not os.path.exists(ini_path):
+        ini_path = os.path.join(app_dir, 'Config.ini')
+    return ini_path
+
+def load_coalesce_window():
+    """
+    連続して起動されたプロセスのパスをまとめる待ち時間（秒）をConfig.iniから読み込む
+    起動直後（設定キャッシュの読み込みやサービスへの転送より前）に呼ばれるため、Config.iniのみを直接読む
+    プロファイル・トレースを出力するデバッグ設定が有効な場合は、このプロセスで計測するため0を返す
+    """
+    config = configparser.ConfigParser()
+    try:
+        config.read(get_config_path(), encoding='utf-8-sig')
+        show_debug = config.getboolean('DebugSettings', 'ShowDebugSettings', fallback=False) and config.getboolean('DebugSettings', 'OutputLog', fallback=False)
+        if show_debug and (config.getboolean('DebugSettings', 'OutputProfile', fallback=False) or config.getboolean('DebugSettings', 'OutputTrace', fallback=False)):
+            return 0
+        # CoalesceWindowMs（0は無効。有効にすると1件だけの起動も待ち時間の分遅れるため、既定では無効）
+        return max(0, config.getint('GeneralSettings', 'CoalesceWindowMs', fallback=0)) / 1000
+    except (configparser.Error, ValueError) as e:
+        logging.warning(f"CoalesceWindowMsを読み込めませんでした: {e}")
+        return 0
+
 def load_app_config():
     """アプリケーション設定を読み込む"""
     app_dir = get_app_dir()
@@ -13,22 +59,20 @@ def load_app_config():
         # 設定ディレクトリが見つからない場合、Settingsをチェックし、次にrootをチェックする。
         pass
 
-    ini_path = os.path.join(settings_dir, 'Config.ini') # 設定ファイルのパス
-    if not os.path.exists(ini_path):
-        ini_path = os.path.join(app_dir, 'Config.ini') # 設定ファイルが見つからない場合、アプリケーションのディレクトリをチェックする。
+    ini_path = get_config_path() # 設定ファイルのパス（Settingsフォルダになければアプリケーションのディレクトリ）
 
     profile_path = os.path.join(settings_dir, 'TomlProfile.ini') # プロファイル設定ファイルのパス
     
     config = configparser.ConfigParser() # ConfigParserオブジェクトを作成する。
     try:
-        config.read(ini_path, encoding='utf-8-sig') # 設定ファイルを読み込む。
+        read_config_cached(config, ini_path) # 設定ファイルを読み込む（変更がなければキャッシュを使う）
     except Exception as e:
         logging.error(f"設定ファイルの読み込みに失敗しました: {e}")
 
     profile_config = configparser.ConfigParser() # ConfigParserオブジェクトを作成する。
     if os.path.exists(profile_path):
         try:
-            profile_config.read(profile_path, encoding='utf-8-sig')
+            read_config_cached(profile_config, profile_path)
         except Exception as e:
             logging.error(f"プロファイル設定の読み込みに失敗しました: {e}")
     else:
@@ -45,8 +89,39 @@ def load_app_config():
         'SaveInParentDirectory': config.getboolean('GeneralSettings', 'SaveInParentDirectory', fallback=False),
         # OverwriteExistingFiles（既存のファイルを上書きする）
         'OverwriteExistingFiles': config.getboolean('GeneralSettings', 'OverwriteExistingFiles', fallback=False),
+        # BackupLimit（出力ファイルごとに残すタイムスタンプ付きバックアップの数、0は無制限）
+        'BackupLimit': config.getint('GeneralSettings', 'BackupLimit', fallback=10),
+        # UpdateExistingFiles（既存のTOMLは処理したアーカイブのモジュールID / (chara, cos)のみ更新し、他の行は残す）
+        'UpdateExistingFiles': config.getboolean('GeneralSettings', 'UpdateExistingFiles', fallback=False),
         # UseModuleNameContains（モジュール名を含める）
         'UseModuleNameContains': config.getboolean('GeneralSettings', 'UseModuleNameContains', fallback=False),
+        # TempLocation（Tempワークスペースの作成場所: app / ram / system）
+        'TempLocation': config.get('GeneralSettings', 'TempLocation', fallback='app').strip().lower(),
+        # MaxWorkers（複数アーカイブ処理時のワーカープロセス数、0は自動）
+        'MaxWorkers': config.getint('GeneralSettings', 'MaxWorkers', fallback=0),
+        # UseSettingsCache（解析済みのPoseScale設定とマッチャーをCacheフォルダに保存して再利用する）
+        'UseSettingsCache': config.getboolean('GeneralSettings', 'UseSettingsCache', fallback=True),
+        # UseResultCache（同じアーカイブ・同じ設定の場合は前回の出力を再利用する）
+        'UseResultCache': config.getboolean('GeneralSettings', 'UseResultCache', fallback=True),
+        # ResultCacheSizeMB（出力キャッシュの上限サイズ、MB単位）
+        'ResultCacheSizeMB': config.getint('GeneralSettings', 'ResultCacheSizeMB', fallback=64),
+        # UseExtractCache（アーカイブから抽出したモジュールテーブルを再利用する）
+        'UseExtractCache': config.getboolean('GeneralSettings', 'UseExtractCache', fallback=True),
+        # ExtractCacheDir（抽出キャッシュの保存先、空の場合はCache/extract）
+        'ExtractCacheDir': config.get('GeneralSettings', 'ExtractCacheDir', fallback='').strip('"'),
+        # ExtractCacheSizeMB（抽出キャッシュの上限サイズ、MB単位）
+        'ExtractCacheSizeMB': config.getint('GeneralSettings', 'ExtractCacheSizeMB', fallback=512),
+        # UseTableDiff（前回のモジュールテーブルと比較し、追加・変更されたモジュールのみ設定を決定する）
+        'UseTableDiff': config.getboolean('GeneralSettings', 'UseTableDiff', fallback=True),
+        # TableCacheSizeMB（前回のモジュールテーブルの保存の上限サイズ、MB単位）
+        'TableCacheSizeMB': config.getint('GeneralSettings', 'TableCacheSizeMB', fallback=64),
+        # ServiceIdleMinutes（常駐サービスがジョブを待つ時間、0は無制限）
+        'ServiceIdleMinutes': config.getint('GeneralSettings', 'ServiceIdleMinutes', fallback=30),
+        # WatchIntervalMs / WatchDebounceMs（フォルダ監視モードの確認間隔と、更新が落ち着くまで待つ時間）
+        'WatchIntervalMs': config.getint('GeneralSettings', 'WatchIntervalMs', fallback=500),
+        'WatchDebounceMs': config.getint('GeneralSettings', 'WatchDebounceMs', fallback=300),
+        # MergeConflictPolicy（まとめて出力する際に同じモジュールID / (chara, cos)の値が異なる場合: first / last / skip）
+        'MergeConflictPolicy': config.get('GeneralSettings', 'MergeConflictPolicy', fallback='first').strip().lower(),
         # Language（言語）
         # 'Language': config.get('GeneralSettings', 'Language', fallback='en'),
         # ShowDebugSettings（デバッグ設定を表示する）
@@ -55,12 +130,25 @@ def load_app_config():
         'OutputLog': config.getboolean('DebugSettings', 'OutputLog', fallback=False),
         # DeleteTemp（一時ファイルを削除する）
         'DeleteTemp': config.getboolean('DebugSettings', 'DeleteTemp', fallback=True),
+        # OutputTrace（処理段階ごとの所要時間をlogsフォルダにトレースとして出力する）
+        'OutputTrace': config.getboolean('DebugSettings', 'OutputTrace', fallback=False),
+        # OutputProfile（cProfileとtracemallocで実行し、logsフォルダに結果を出力する）
+        'OutputProfile': config.getboolean('DebugSettings', 'OutputProfile', fallback=False),
         # HistoryLimit（履歴制限）
         # 'HistoryLimit': config.getint('DebugSettings', 'HistoryLimit', fallback=50),
         'ConfigParser': config, # Main config（メイン設定）
         'ProfileConfig': profile_config, # Profile config（プロファイル設定）
-        'SettingsDir': settings_dir # Expose settings dir for other modules（他のモジュール用の設定ディレクトリ）
+        'SettingsDir': settings_dir, # Expose settings dir for other modules（他のモジュール用の設定ディレクトリ）
+        'ConfigFiles': [ini_path, profile_path] # 読み込んだ設定ファイル（変更の監視用）
     }
     
-    logging.info(f"設定を読み込みました: {app_config}")
+    logging.info("設定を読み込みました: %s", app_config) # 出力しない場合は設定の文字列化を省略する
     return app_config
+
+def debug_settings_enabled(app_config):
+    """
+    DebugSettingsを有効にするか（ShowDebugSettingsとOutputLogの両方が有効な場合のみ）
+    OutputLogがFalseの場合は、デバッグ設定が有効でもコンソールログを抑制する
+    """
+    show_debug = app_config['ConfigParser'].getboolean('DebugSettings', 'ShowDebugSettings', fallback=False)
+    return show_debug and app_config.get('OutputLog', False)
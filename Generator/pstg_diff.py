@@ -0,0 +1,72 @@
+import os
+import logging
+import pstg_cache
+from pstg_loader import rules_fingerprint
+
+# 保存する状態の形式のバージョン（形式を変更した場合は上げる）
+TABLE_STATE_VERSION = 1
+
+
+def table_key(dragged_file):
+    """アーカイブのパスからキャッシュのキーを作る（アーカイブが更新されても同じキー）"""
+    return pstg_cache.hash_data(os.path.normcase(os.path.abspath(dragged_file)))
+
+def diff_tables(previous_modules, module_data):
+    """前回と今回のモジュールテーブルをモジュール番号ごとに比較し、(追加, 変更, 削除)の数を返す"""
+    previous = {module['module_num']: module for module in previous_modules}
+    current = {module['module_num']: module for module in module_data}
+    added = sum(1 for num in current if num not in previous)
+    changed = sum(1 for num, module in current.items() if num in previous and previous[num] != module)
+    removed = sum(1 for num in previous if num not in current)
+    return added, changed, removed
+
+def _match_key(module_value):
+    """設定の割り当てに影響するモジュールの値（キャラクターとモジュール名）"""
+    return module_value.get('chara'), module_value.get('name')
+
+def resolve_modules_incremental(table_cache, dragged_file, module_data, pose_settings, get_matcher, map_chara):
+    """
+    前回の実行で保存したモジュールテーブルと割り当て結果を使い、追加・変更されたモジュールのみ設定を決定する
+    PoseScale設定が前回と異なる場合は全てのモジュールを決定し直す
+    get_matcher: マッチャーを返す関数（決定が必要なモジュールがある場合のみ呼び出す）
+    戻り値: (割り当て結果（resolve_modulesと同じ形式）, 差分 {'added', 'changed', 'removed', 'resolved'}（前回の状態がない場合はNone）)
+    """
+    key = table_key(dragged_file)
+    fingerprint = rules_fingerprint(pose_settings)
+    previous = table_cache.get(key)
+    if previous is not None and (previous.get('version') != TABLE_STATE_VERSION or previous.get('fingerprint') != fingerprint):
+        logging.info(f"PoseScale設定が変更されたため全てのモジュールの設定を決定し直します: {dragged_file}")
+        previous = None
+
+    # (キャラクター, モジュール名) -> (設定のindex, 'Specific' / 'Fallback')
+    resolved = previous['resolved'] if previous else {}
+    pending = [module_value for module_value in module_data if _match_key(module_value) not in resolved]
+    if pending:
+        matcher = get_matcher()
+        setting_index = {id(setting): index for index, setting in enumerate(matcher.settings)}
+        for module_value in pending:
+            match_key = _match_key(module_value)
+            if match_key in resolved:
+                continue # 同じ名前のモジュールは決定済み
+            module_chara = map_chara(module_value["chara"], "module_to_setting") # モジュールキャラクター
+            setting, match_type = matcher.resolve(module_value["name"], module_chara)
+            resolved[match_key] = (setting_index[id(setting)] if setting is not None else None, match_type)
+
+    assignments = []
+    current = {} # 今回のモジュールの割り当て結果のみ保存する
+    for module_value in module_data:
+        match_key = _match_key(module_value)
+        index, match_type = current[match_key] = resolved[match_key]
+        setting = pose_settings[index] if index is not None else None
+        if setting is None:
+            logging.debug("マッチする設定が見つかりませんでした: %s", module_value['name'])
+        assignments.append((module_value, setting, match_type))
+
+    table_diff = None
+    if previous is not None:
+        added, changed, removed = diff_tables(previous['modules'], module_data)
+        table_diff = {'added': added, 'changed': changed, 'removed': removed, 'resolved': len(pending)}
+        logging.info(f"モジュールテーブルの差分: 追加 {added} / 変更 {changed} / 削除 {removed}（設定を決定したモジュール: {len(pending)}件）")
+
+    table_cache.put(key, {'version': TABLE_STATE_VERSION, 'fingerprint': fingerprint, 'modules': module_data, 'resolved': current})
+    return assignments, table_diff
@@ -1,101 +1,159 @@
 import os
 import json
+import codecs
+import itertools
 import logging
-from pstg_util import get_temp_dir
+from pstg_util import current_workspace, get_temp_dir
 
-def load_and_combine_text_data():
-    """Tempディレクトリ内のBINファイルを読み込んで結合する"""
+# 1回に読み込むバイト数（BINファイルはこの単位で読み込んで解析する）
+READ_CHUNK_SIZE = 64 * 1024
+
+# module_data に格納するキー
+MODULE_KEYS = ('chara', 'cos', 'id', 'name')
+
+def load_bin_files_from_temp():
+    """FarcPackで解凍したTempディレクトリ内のBINファイルを(ファイル名, パス)のリストで返す"""
     temp_dir = get_temp_dir()
-    text_data = ''
-    
+
     # gm_module_tblフォルダを検索する。
     gm_module_tbl_dirs = [d for d in os.listdir(temp_dir) if os.path.isdir(os.path.join(temp_dir, d)) and 'gm_module_tbl' in d]
-    
+
     # gm_module_tblフォルダが見つからない場合、ログを出力する。
     if not gm_module_tbl_dirs:
         logging.error("Tempディレクトリにgm_module_tblフォルダが存在しません")
-        return ""
-    
+        return None
+
+    sources = []
     # gm_module_tblフォルダ内のファイルを検索する。
     for dir_name in gm_module_tbl_dirs:
         gm_module_tbl_path = os.path.join(temp_dir, dir_name)
-        # gm_module_tblフォルダ内のファイルを検索する。
+        # gm_module_tblフォルダ内のBINファイルを検索する（読み込みは解析時にチャンク単位で行う）
         for file_name in os.listdir(gm_module_tbl_path):
-            # BINファイルを検索する。
             if file_name.endswith('.bin'):
-                try:
-                    # BINファイルを読み込む。
-                    with open(os.path.join(gm_module_tbl_path, file_name), 'r', encoding='utf-8') as file:
-                        content = file.read()
-                        # BINファイルの内容を結合する。
-                        if content:
-                            text_data += content
-                            logging.debug(f"{file_name} の内容: {content}")
-                            logging.info(f"Binファイルを正常に読み込みました: {file_name}")
-                        else:
-                            # 空のファイルをスキップする。
-                            logging.warning(f"空のファイルをスキップしました: {file_name}")
-                except Exception as e:
-                    # ファイルの読み込みに失敗した場合、ログを出力する。
-                    logging.error(f"ファイルの読み込みに失敗しました {file_name}: {e}")
-
-    # BINファイルの内容を結合する。
-    if not text_data:
-        logging.error("BINファイルからデータを読み込めませんでした")
-        return ""
-
-    # BINデータを結合する。
-    combined_data = f'BINデータ\n{text_data}\n'
-    logging.info(f"combined_data を正常に読み込みました")
-    return combined_data
-
-def process_data():
-    """BINデータを解析してJSONとして保存し、辞書データを返す"""
-    try:
-        # BINデータを結合する。
-        combined_data = load_and_combine_text_data()
-        # BINデータを結合できなかった場合、ログを出力する。
-        if not combined_data:
-            logging.error("BINデータを結合できませんでした")
-            return []
+                sources.append((file_name, os.path.join(gm_module_tbl_path, file_name)))
+    return sources
+
+def read_sources(sources):
+    """(ファイル名, データ)のリストのうち、パスで渡されたものを読み込んでバイト列にする（キャッシュ保存用）"""
+    loaded = []
+    for file_name, data in sources:
+        if not isinstance(data, (bytes, bytearray)):
+            with open(data, 'rb') as file:
+                data = file.read()
+        loaded.append((file_name, bytes(data)))
+    return loaded
+
+def iter_source_chunks(data, chunk_size=READ_CHUNK_SIZE):
+    """BINデータ（バイト列、またはファイルパス）をチャンク単位で返す"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+    else:
+        with open(data, 'rb') as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+def iter_lines(chunks):
+    """バイト列のチャンクをUTF-8としてデコードし、1行ずつ返す（チャンク境界をまたぐ行も連結する）"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = '' # 前のチャンクの末尾に残った未完成の行
+    for chunk in chunks:
+        text = pending + decoder.decode(bytes(chunk))
+        lines = text.splitlines(keepends=True)
+        # 改行で終わっていない最後の行は次のチャンクと連結する
+        pending = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+        # \r\nがチャンク境界で分かれた場合に備え、\rで終わる行も次のチャンクまで保留する
+        if lines and lines[-1].endswith('\r') and not pending:
+            pending = lines.pop()
+        yield from lines
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+def iter_module_records(lines):
+    """行を解析し、module.N.key=value 形式のレコードを(モジュール番号, キー, 値)で返す"""
+    for line in lines:
+        line = line.strip()
+        # module.で始まる行を解析する。
+        if not line.startswith('module.'):
+            continue
+
+        # =で区切る。
+        if '=' in line:
+            key_part, value = line.split('=', 1) # キーと値で区切る。
+            key_part = key_part.strip() # キー部分を空白文字を削除する。
+            value = value.strip() # 値部分を空白文字を削除する。
 
-        modules_by_id = {} # モジュールIDをキーとする辞書
-        
-        # BINデータを解析する。
-        for line in combined_data.splitlines():
-            line = line.strip()
-            # module.で始まる行を解析する。
-            if not line.startswith('module.'):
+            # module_numとkeyで区切る。
+            parts = key_part.split('.')
+            if len(parts) < 3:
                 continue
-            
-            # =で区切る。
-            if '=' in line:
-                key_part, value = line.split('=', 1) # キーと値で区切る。
-                key_part = key_part.strip() # キー部分を空白文字を削除する。
-                value = value.strip() # 値部分を空白文字を削除する。
-                
-                # module_numとkeyで区切る。
-                parts = key_part.split('.')
-                if len(parts) < 3:
-                    continue
-                
-                module_num = parts[1] # モジュール番号
-                key = parts[2] # キー
-                
-                # chara, cos, id, nameで区切る。
-                if key in ['chara', 'cos', 'id', 'name']:
-                    # モジュール番号をキーとする辞書に値を格納する。
-                    if module_num not in modules_by_id:
-                        modules_by_id[module_num] = {"module_num": module_num} # モジュール番号をキーとする辞書
-                    
-                    modules_by_id[module_num][key] = value # モジュール番号をキーとする辞書に値を格納する。
+
+            # chara, cos, id, nameのみ返す。
+            if parts[2] in MODULE_KEYS:
+                yield parts[1], parts[2], value # モジュール番号, キー, 値
+
+def group_modules(records, modules_by_id=None):
+    """レコードを受け取った順にモジュール番号ごとの辞書へまとめる"""
+    if modules_by_id is None:
+        modules_by_id = {} # モジュール番号をキーとする辞書
+    for module_num, key, value in records:
+        module = modules_by_id.get(module_num)
+        if module is None:
+            module = modules_by_id[module_num] = {"module_num": module_num} # モジュール番号をキーとする辞書
+        module[key] = value # モジュール番号をキーとする辞書に値を格納する。
+    return modules_by_id
+
+def parse_sources(sources):
+    """BINデータを順に読み込み、モジュール番号をキーとする辞書を返す"""
+    modules_by_id = {}
+    for file_name, data in sources:
+        count_before = len(modules_by_id)
+        try:
+            chunks = iter_source_chunks(data)
+            first_chunk = next(chunks, None)
+            if first_chunk is None or not len(first_chunk):
+                # 空のファイルをスキップする。
+                logging.warning(f"空のファイルをスキップしました: {file_name}")
+                continue
+            group_modules(iter_module_records(iter_lines(itertools.chain([first_chunk], chunks))), modules_by_id)
+            logging.info(f"Binファイルを正常に読み込みました: {file_name} (新規モジュール: {len(modules_by_id) - count_before})")
+        except Exception as e:
+            # ファイルの読み込みに失敗した場合、ログを出力する（読み込めた分のモジュールは保持する）
+            logging.error(f"ファイルの読み込みに失敗しました {file_name}: {e}")
+    return modules_by_id
+
+def process_data(sources=None, save_json=False):
+    """
+    BINデータを解析し、辞書データを返す
+    sourcesに(エントリ名, データ)のリストが渡された場合はそれを使い、Noneの場合はTempディレクトリ内のBINファイルを読み込む
+    save_json: 解析結果をTempワークスペースのmodule_data.jsonに保存する（Tempを残すデバッグ設定の場合のみ。通常は保存しない）
+    """
+    try:
+        if sources is None:
+            sources = load_bin_files_from_temp()
+            if sources is None:
+                logging.error("BINデータを読み込めませんでした")
+                return []
+
+        # BINデータをチャンク単位で解析する。
+        modules_by_id = parse_sources(sources)
+        if not modules_by_id:
+            logging.error("BINファイルからデータを読み込めませんでした")
+            return []
 
         module_data_list = list(modules_by_id.values()) # モジュール番号をキーとする辞書をリストに変換する。
-        module_data_dict = {"modules": module_data_list} # モジュール番号をキーとする辞書を辞書に変換する。
 
-        temp_dir = get_temp_dir() # 一時ディレクトリ
+        temp_dir = current_workspace() # 一時ディレクトリ（Tempワークスペースの外で呼び出された場合は保存しない）
+        if not save_json or temp_dir is None:
+            return module_data_list
+        module_data_dict = {"modules": module_data_list} # モジュール番号をキーとする辞書を辞書に変換する。
         module_data_path = os.path.join(temp_dir, 'module_data.json') # モジュールデータのパス
-        
+
         # モジュールデータを保存する。
         with open(module_data_path, 'w', encoding='utf-8') as json_file:
             json.dump(module_data_dict, json_file, ensure_ascii=False, indent=4)
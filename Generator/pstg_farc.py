@@ -1,20 +1,341 @@
-import sys
+import io
 import os
 import shutil
+import struct
 import subprocess
 import logging
+import zlib
+import pstg_trace
+from pstg_aes import AESDecryptor
 from pstg_util import get_temp_dir, make_hidden_folder
 
 
-def get_dragged_file():
-    """コマンドライン引数からドラッグされたファイルを取得"""
-    if len(sys.argv) != 2:
-        print("ファイルをドラッグアンドドロップしてください")
-        logging.error("引数が正しくありません。ファイルをドラッグアンドドロップしてください。")
-        sys.exit(1)
-    dragged_file = sys.argv[1] # ドラッグアンドドロップされたファイル
-    logging.info(f"ドラッグアンドドロップされたファイルパス: {dragged_file}")
-    return dragged_file
+# FARCの暗号鍵（DT系はECB、FT系はCBC）
+FARC_KEY_DT = b'project_diva.bin'
+FARC_KEY_FT = bytes.fromhex('1372D57B6E9E31EBCBE0518F3E129F5B')
+
+FARC_FLAG_COMPRESSED = 0x02 # 圧縮フラグ
+FARC_FLAG_ENCRYPTED = 0x04 # 暗号化フラグ
+
+
+class FarcError(Exception):
+    """FARCの読み込みに失敗した場合の例外"""
+
+
+class FarcEntry:
+    """FARC内の1ファイル分のエントリ情報"""
+    __slots__ = ('name', 'offset', 'stored_size', 'size', 'compressed', 'encrypted')
+
+    def __init__(self, name, offset, stored_size, size, compressed=False, encrypted=False):
+        self.name = name # エントリ名
+        self.offset = offset # データ開始位置
+        self.stored_size = stored_size # アーカイブ内のサイズ（圧縮・暗号化後）
+        self.size = size # 展開後のサイズ
+        self.compressed = compressed # gzip圧縮の有無
+        self.encrypted = encrypted # AES暗号化の有無
+
+    def __repr__(self):
+        return f"FarcEntry({self.name!r}, offset={self.offset}, size={self.size})"
+
+
+class FarcReader:
+    """FARCアーカイブ（FArc / FArC / FARC）を読み込むリーダー"""
+
+    def __init__(self, source):
+        # sourceはファイルパス、またはファイルライクオブジェクト（入れ子のFARC用）
+        self.path = source if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', '<memory>')
+        self.format = None # 'FArc' / 'FArC' / 'FARC' / 'FARC-FT'
+        self.alignment = 0
+        self.entries = []
+        self._file = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+        try:
+            self._read_header()
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _read_header(self):
+        """ヘッダーとエントリテーブルを読み込む"""
+        head = self._file.read(8)
+        if len(head) < 8:
+            raise FarcError(f"FARCヘッダーが短すぎます: {self.path}")
+
+        signature = head[:4]
+        header_end = 8 + struct.unpack('>I', head[4:])[0] # ヘッダー終端位置
+
+        if signature == b'FArc': # 無圧縮
+            self.format = 'FArc'
+            header = self._file.read(header_end - 8)
+            self.alignment = struct.unpack_from('>I', header, 0)[0]
+            self.entries = list(self._parse_entries(header, 4, compressed=False))
+        elif signature == b'FArC': # gzip圧縮
+            self.format = 'FArC'
+            header = self._file.read(header_end - 8)
+            self.alignment = struct.unpack_from('>I', header, 0)[0]
+            self.entries = list(self._parse_entries(header, 4, compressed=True))
+        elif signature == b'FARC': # 拡張形式（暗号化あり）
+            self._read_extended_header(header_end)
+        else:
+            raise FarcError(f"FARCファイルではありません (signature={signature!r}): {self.path}")
+
+        logging.info(f"FARCを読み込みました: {self.path} (形式: {self.format}, エントリ数: {len(self.entries)})")
+
+    def _read_extended_header(self, header_end):
+        """FARC形式のヘッダーを読み込む（DT系: 平文ヘッダー / FT系: CBC暗号化ヘッダー）"""
+        flags, _padding, alignment = struct.unpack('>III', self._file.read(12))
+        compressed = bool(flags & FARC_FLAG_COMPRESSED)
+        encrypted = bool(flags & FARC_FLAG_ENCRYPTED)
+
+        # FT系はアライメント位置にIVが入るため、2の累乗かどうかで判別する（MikuMikuLibraryと同じ判定）
+        if encrypted and alignment & (alignment - 1):
+            self.format = 'FARC-FT'
+            self._file.seek(0x10)
+            iv = self._file.read(16)
+            encrypted_header = self._file.read(header_end - 0x20)
+            encrypted_header = encrypted_header[:len(encrypted_header) // 16 * 16]
+            header = AESDecryptor(FARC_KEY_FT).decrypt_cbc(encrypted_header, iv)
+
+            self.alignment, ft_flag, entry_count = struct.unpack_from('>III', header, 0)
+            # ft_flag == 1: エントリごとにフラグを持つ（16バイト） / それ以外: ヘッダーのフラグを使う（12バイト）
+            per_entry_flags = ft_flag == 1
+            pos = 16 if per_entry_flags else 12
+            entries = []
+            for _ in range(entry_count):
+                name, pos = self._read_cstring(header, pos)
+                if per_entry_flags:
+                    offset, stored_size, size, entry_flags = struct.unpack_from('>IIII', header, pos)
+                    pos += 16
+                    entry_compressed = bool(entry_flags & FARC_FLAG_COMPRESSED)
+                    entry_encrypted = bool(entry_flags & FARC_FLAG_ENCRYPTED)
+                else:
+                    offset, stored_size, size = struct.unpack_from('>III', header, pos)
+                    pos += 12
+                    entry_compressed, entry_encrypted = compressed, encrypted
+                entries.append(FarcEntry(name, offset, stored_size, size, compressed=entry_compressed, encrypted=entry_encrypted))
+            self.entries = entries
+        else:
+            self.format = 'FARC'
+            self.alignment = alignment
+            header = self._file.read(header_end - 0x14)
+            self.entries = list(self._parse_entries(header, 0, compressed=compressed, encrypted=encrypted, sized=True))
+
+    def _parse_entries(self, header, pos, compressed, encrypted=False, sized=None):
+        """エントリテーブル（名前 + オフセット + サイズ）を終端まで読み込む"""
+        if sized is None:
+            sized = compressed # FArCは圧縮後サイズと展開後サイズの両方を持つ
+
+        while pos < len(header):
+            name, pos = self._read_cstring(header, pos)
+            if not name: # パディング
+                break
+            if sized:
+                offset, stored_size, size = struct.unpack_from('>III', header, pos)
+                pos += 12
+            else:
+                offset, size = struct.unpack_from('>II', header, pos)
+                stored_size = size
+                pos += 8
+            yield FarcEntry(name, offset, stored_size, size, compressed=compressed, encrypted=encrypted)
+
+    @staticmethod
+    def _read_cstring(buffer, pos):
+        """NUL終端文字列を読み込む"""
+        end = buffer.find(b'\x00', pos)
+        if end < 0:
+            raise FarcError("FARCのエントリ名が途中で切れています")
+        return buffer[pos:end].decode('utf-8', errors='replace'), end + 1
+
+    def find_entries(self, predicate):
+        """条件に一致するエントリを返す"""
+        return [entry for entry in self.entries if predicate(entry.name)]
+
+    def read_entry(self, entry):
+        """エントリ1件分のデータを復号・展開して返す"""
+        self._file.seek(entry.offset)
+
+        if entry.encrypted:
+            length = (entry.stored_size + 15) // 16 * 16 # AESのブロック境界まで読む
+            data = self._file.read(length)
+            if len(data) < entry.stored_size:
+                raise FarcError(f"エントリのデータが不足しています: {entry.name}")
+            if self.format == 'FARC-FT':
+                data = AESDecryptor(FARC_KEY_FT).decrypt_cbc(data[16:len(data) // 16 * 16], data[:16])
+            else:
+                data = AESDecryptor(FARC_KEY_DT).decrypt_ecb(data[:len(data) // 16 * 16])
+        else:
+            data = self._file.read(entry.stored_size)
+            if len(data) < entry.stored_size:
+                raise FarcError(f"エントリのデータが不足しています: {entry.name}")
+
+        # gzipヘッダーがある場合のみ展開（末尾のパディングは無視される）
+        if entry.compressed and data[:2] == b'\x1f\x8b':
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(data) + decompressor.flush()
+
+        return data[:entry.size]
+
+
+def get_dragged_files(paths):
+    """
+    コマンドライン引数（ドラッグされたファイル・フォルダ）から処理対象のファイルを取得
+    フォルダの場合は配下の.farcファイルと解凍済みのモジュールテーブルのフォルダを再帰的に列挙する（重複は除外）
+    解凍済みのフォルダ・モジュールテーブルの.binはそのまま処理対象にする
+    """
+    dragged_files = []
+    seen = set()
+
+    def add(path):
+        key = os.path.normcase(os.path.abspath(path))
+        if key not in seen:
+            seen.add(key)
+            dragged_files.append(path)
+
+    for path in paths:
+        path = path.strip('{}') # ドラッグアンドドロップされたファイル
+        logging.info(f"ドラッグアンドドロップされたファイルパス: {path}")
+        if os.path.isdir(path) and list_module_table_bins(path):
+            # 解凍済みのモジュールテーブルのフォルダ
+            add(path)
+        elif os.path.isdir(path):
+            # フォルダ配下のFARCと解凍済みのモジュールテーブルのフォルダを列挙
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                if root != path and list_module_table_bins(root) and not any(f.lower().endswith('.farc') for f in files):
+                    # 同名のFARCがある場合はFARCを処理する（同じ出力を二重に生成しない）
+                    if not os.path.exists(f"{root}.farc"):
+                        add(root)
+                    dirs[:] = []
+                    continue
+                for file_name in sorted(files):
+                    if file_name.lower().endswith('.farc'):
+                        add(os.path.join(root, file_name))
+        elif os.path.isfile(path) and path.lower().endswith('.bin') and not is_module_table_bin(path):
+            logging.error(f"モジュールテーブルではないBINファイルは処理できません: {path}")
+        elif os.path.isfile(path):
+            add(path)
+        else:
+            logging.error(f"ファイルが存在しません: {path}")
+
+    logging.info(f"処理対象のファイル数: {len(dragged_files)}")
+    return dragged_files
+
+def is_module_table_entry(entry_name, archive_name=''):
+    """
+    エントリ名がモジュールテーブルかどうかを判定する
+    - gm_module_tbl*.bin（パック内のモジュールテーブル）
+    - gm_module_tbl*.farc（パック内に入れ子になったモジュールテーブルのFARC）
+    - gm_module_tblという名前のアーカイブ内の.bin（FarcPackの解凍先フォルダと同じ扱い）
+    """
+    base_name = os.path.basename(entry_name.replace('\\', '/')).lower()
+    if base_name.endswith('.bin'):
+        return 'gm_module_tbl' in base_name or 'gm_module_tbl' in archive_name.lower()
+    if base_name.endswith('.farc'):
+        return 'gm_module_tbl' in base_name
+    return False
+
+def list_module_table_bins(directory):
+    """
+    フォルダ直下のモジュールテーブル（.bin）を(ファイル名, パス)のリストで返す（解凍済みのフォルダの判定にも使う）
+    gm_module_tbl*.farcは解凍済みのデータではないため含めない（FARCとして処理する）
+    """
+    dir_name = os.path.basename(os.path.normpath(directory))
+    try:
+        file_names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    return [(file_name, os.path.join(directory, file_name)) for file_name in file_names
+            if file_name.lower().endswith('.bin') and is_module_table_entry(file_name, dir_name)
+            and os.path.isfile(os.path.join(directory, file_name))]
+
+def is_module_table_bin(path):
+    """直接渡されたモジュールテーブルの.bin（gm_module_tbl*.bin、またはgm_module_tblフォルダ内の.bin）か"""
+    if not path.lower().endswith('.bin'):
+        return False
+    return is_module_table_entry(os.path.basename(path), os.path.basename(os.path.dirname(os.path.abspath(path))))
+
+def is_raw_table_input(path):
+    """FARCではなく、解凍済みのフォルダまたはモジュールテーブルの.binが直接渡されたか"""
+    return os.path.isdir(path) or is_module_table_bin(path)
+
+def module_table_sources(path):
+    """解凍済みのフォルダまたは.binファイルから、モジュールテーブルを(ファイル名, パス)のリストで返す（解凍・コピーは行わない）"""
+    if os.path.isdir(path):
+        return list_module_table_bins(path)
+    return [(os.path.basename(path), path)]
+
+def get_output_dir(path):
+    """
+    入力に対応する出力先フォルダ（FARCと同じ場所）
+    - FARC: FARCのあるフォルダ
+    - gm_module_tblフォルダ（FarcPackの解凍先）: その親フォルダ（解凍元のFARCがあった場所）
+    - それ以外のフォルダ: そのフォルダ
+    - .bin: gm_module_tblフォルダ内にある場合はその親フォルダ、それ以外は.binのあるフォルダ
+    """
+    path = os.path.normpath(path)
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    if is_raw_table_input(path) and 'gm_module_tbl' in os.path.basename(directory).lower():
+        return os.path.dirname(directory)
+    return directory
+
+def get_archive_name(dragged_file):
+    """アーカイブ名（拡張子なし）。FarcPackの解凍先フォルダ名に相当し、エントリの選択に使う"""
+    return os.path.splitext(os.path.basename(dragged_file.strip('{}')))[0]
+
+def read_module_table_entries(reader, archive_name=''):
+    """エントリテーブルからモジュールテーブルだけを選び、そのエントリのみ展開して返す"""
+    sources = []
+    selected = reader.find_entries(lambda entry_name: is_module_table_entry(entry_name, archive_name))
+    skipped_bytes = sum(entry.stored_size for entry in reader.entries) - sum(entry.stored_size for entry in selected)
+    logging.info(f"モジュールテーブルのエントリを選択しました: {len(selected)}/{len(reader.entries)}件 (展開をスキップ: {skipped_bytes} bytes)")
+
+    for entry in selected:
+        data = reader.read_entry(entry)
+        if entry.name.lower().endswith('.farc'):
+            # 入れ子のFARCはメモリ上で開き、同じ条件で選択する
+            nested_name = os.path.splitext(os.path.basename(entry.name))[0]
+            with FarcReader(io.BytesIO(data)) as nested_reader:
+                sources.extend(read_module_table_entries(nested_reader, nested_name))
+        else:
+            sources.append((entry.name, data))
+            logging.info(f"FARCからエントリを読み込みました: {entry.name} ({entry.size} bytes)")
+    return sources
+
+def read_module_table(dragged_file, farc_pack_path=None):
+    """
+    FARCからモジュールテーブル（.bin）のみを読み込み、(エントリ名, データ)のリストを返す
+    組み込みリーダーで読めない場合はFarcPackでTempに解凍し、Noneを返す（pstg_extractがTempを走査する）
+    """
+    dragged_file = dragged_file.strip('{}')
+    archive_name = get_archive_name(dragged_file) # FarcPackの解凍先フォルダ名に相当
+
+    try:
+        with pstg_trace.span('farc_read') as trace_span, FarcReader(dragged_file) as reader:
+            sources = read_module_table_entries(reader, archive_name)
+            trace_span.set(entries=len(sources), bytes=sum(len(data) for _, data in sources))
+            if not sources:
+                # モジュールテーブルを含まないアーカイブ（フォルダ内の他のFARCなど）は通常の結果として扱う
+                logging.debug(f"アーカイブ内にモジュールテーブルが見つかりません: {dragged_file}")
+            return sources
+
+    except (FarcError, OSError, ValueError, zlib.error, struct.error) as e:
+        logging.warning(f"組み込みFARCリーダーで読み込めませんでした: {e}")
+
+    # FarcPackが設定されている場合のみフォールバック（アーカイブ全体を解凍する）
+    if farc_pack_path and os.path.exists(farc_pack_path):
+        logging.info("FarcPackで解凍します")
+        process_file(dragged_file, farc_pack_path)
+        return None
+
+    raise FarcError(f"FARCを読み込めませんでした: {dragged_file}")
 
 def process_file(dragged_file, farc_pack_path):
     """ファイルをTempにコピーし、FarcPackで解凍する"""
@@ -31,14 +352,16 @@ def process_file(dragged_file, farc_pack_path):
 
     # ファイルコピー
     try:
-        shutil.copy(dragged_file, temp_file_path)
+        with pstg_trace.span('copy', bytes=os.path.getsize(dragged_file)):
+            shutil.copy(dragged_file, temp_file_path)
         logging.info(f"ファイルがTempフォルダにコピーされました: {temp_file_path}")
     except Exception as e:
         logging.error(f"ファイルコピー中にエラーが発生しました: {e}")
         raise
 
     # FarcPackで解凍
-    open_with_farcPack(temp_file_path, farc_pack_path)
+    with pstg_trace.span('farcpack'):
+        open_with_farcPack(temp_file_path, farc_pack_path)
     
     return os.path.dirname(dragged_file)
 
@@ -0,0 +1,255 @@
+import os
+import hashlib
+import time
+import sqlite3
+import logging
+import concurrent.futures
+import pstg_util
+from pstg_cache import HASH_CHUNK_SIZE, get_cache_dir, hash_data, hash_file
+from pstg_extract import parse_sources
+from pstg_farc import FarcReader, get_archive_name, get_dragged_files, is_raw_table_input, module_table_sources, read_module_table_entries
+from pstg_match import RuleMatcher
+
+# モジュールインデックスのファイル名（Cacheフォルダ内）
+INDEX_FILE = 'module_index.sqlite'
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    error TEXT,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS modules (
+    archive TEXT NOT NULL REFERENCES archives(path) ON DELETE CASCADE,
+    module_num TEXT,
+    id TEXT,
+    name TEXT,
+    chara TEXT,
+    cos TEXT
+);
+CREATE INDEX IF NOT EXISTS modules_archive ON modules(archive);
+CREATE INDEX IF NOT EXISTS modules_id ON modules(id);
+"""
+
+
+def get_index_path():
+    """モジュールインデックスのパスを取得"""
+    return os.path.join(get_cache_dir(), INDEX_FILE)
+
+def open_index(path=None):
+    """モジュールインデックスを開く（存在しない場合は作成、形式が古い場合は作り直す）"""
+    path = path or get_index_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        if version:
+            logging.info("モジュールインデックスの形式が異なるため作り直します")
+        conn.executescript("DROP TABLE IF EXISTS modules; DROP TABLE IF EXISTS archives;")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(_SCHEMA)
+    return conn
+
+class HashingReader:
+    """
+    ファイルを読み込みながらSHA-256を計算するファイルライクオブジェクト（FarcReaderに渡して、スキャン時のアーカイブの読み込みとハッシュ計算を1回で行う）
+    前方へシークした場合は読み飛ばした部分もハッシュに含め、hexdigest()で未読の残りを読んで完了する
+    """
+
+    def __init__(self, path):
+        self.name = path
+        self._file = open(path, 'rb')
+        self._digest = hashlib.sha256()
+        self._hashed = 0 # ハッシュに含めた位置
+
+    def _hash_until(self, target=None):
+        """ハッシュに含めた位置からtarget（Noneは終端）まで読み込んでハッシュに含める"""
+        self._file.seek(self._hashed)
+        while target is None or self._hashed < target:
+            size = HASH_CHUNK_SIZE if target is None else min(HASH_CHUNK_SIZE, target - self._hashed)
+            chunk = self._file.read(size)
+            if not chunk:
+                break
+            self._digest.update(chunk)
+            self._hashed += len(chunk)
+
+    def read(self, size=-1):
+        pos = self._file.tell()
+        if pos > self._hashed:
+            self._hash_until(pos)
+            pos = self._file.tell()
+        data = self._file.read(size)
+        if pos + len(data) > self._hashed:
+            self._digest.update(data[self._hashed - pos:])
+            self._hashed = pos + len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def hexdigest(self):
+        """ファイル全体のSHA-256（hash_fileと同じ値）"""
+        position = self._file.tell()
+        self._hash_until()
+        self._file.seek(position)
+        return self._digest.hexdigest()
+
+    def close(self):
+        self._file.close()
+
+def extract_archive(path):
+    """
+    アーカイブのモジュールテーブルを解析する（ワーカープロセスで実行される）
+    アーカイブは1回だけ読み込み、モジュールテーブルの展開と内容のハッシュ計算を同時に行う
+    戻り値: (パス, SHA-256, モジュールのリスト, エラー内容またはNone)
+    """
+    try:
+        if is_raw_table_input(path):
+            # 解凍済みのモジュールテーブルのフォルダ・.bin（生成時の出力キャッシュと同じくファイル名と内容のハッシュ）
+            sources = module_table_sources(path)
+            sha256 = hash_data(*(part for file_name, source_path in sources for part in (file_name, hash_file(source_path))))
+            return path, sha256, list(parse_sources(sources).values()), None
+
+        # 組み込みリーダーのみ（FarcPackは使わない）。モジュールテーブルを含まないアーカイブはモジュール0件
+        hashing_file = HashingReader(path)
+        with FarcReader(hashing_file) as reader:
+            sources = read_module_table_entries(reader, get_archive_name(path))
+            sha256 = hashing_file.hexdigest()
+        modules = list(parse_sources(sources).values())
+        return path, sha256, modules, None
+    except Exception as e:
+        logging.error(f"アーカイブを解析できませんでした: {path}: {e}")
+        return path, None, [], str(e)
+
+def _store_archive(conn, path, signature, sha256, modules, error):
+    """アーカイブとモジュールを保存する（既存の内容は置き換える）"""
+    conn.execute("DELETE FROM archives WHERE path = ?", (path,))
+    conn.execute(
+        "INSERT INTO archives (path, mtime_ns, size, sha256, error, scanned_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (path, signature[0], signature[1], sha256 or '', error, time.time()),
+    )
+    conn.executemany(
+        "INSERT INTO modules (archive, module_num, id, name, chara, cos) VALUES (?, ?, ?, ?, ?, ?)",
+        [(path, m.get('module_num'), m.get('id'), m.get('name'), m.get('chara'), m.get('cos')) for m in modules],
+    )
+
+def _signature(path):
+    """変更の検出に使う(更新日時, サイズ)。解凍済みのフォルダはモジュールテーブルの.binの最新の更新日時と合計サイズ"""
+    if os.path.isdir(path):
+        stats = [os.stat(source_path) for _, source_path in module_table_sources(path)]
+        return max((stat.st_mtime_ns for stat in stats), default=0), sum(stat.st_size for stat in stats)
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def scan_library(conn, root, max_workers=0):
+    """
+    modsフォルダ配下の全てのFARCを解析してインデックスを更新する
+    更新日時とサイズが変わっていないアーカイブは読み込まず、変わっていても内容のハッシュが同じなら更新日時のみ更新する
+    戻り値: {'archives', 'scanned', 'unchanged', 'removed', 'errors', 'modules', 'paths'（対象のアーカイブのリスト）}
+    """
+    root = os.path.abspath(root)
+    archives = [os.path.abspath(path) for path in get_dragged_files([root])]
+    known = {path: (mtime_ns, size, sha256) for path, mtime_ns, size, sha256 in conn.execute("SELECT path, mtime_ns, size, sha256 FROM archives")}
+    stats = {'archives': len(archives), 'scanned': 0, 'unchanged': 0, 'removed': 0, 'errors': 0, 'modules': 0, 'paths': archives}
+
+    # 変更されたアーカイブを選ぶ
+    signatures = {}
+    to_extract = []
+    for path in archives:
+        try:
+            signatures[path] = _signature(path)
+        except OSError:
+            continue
+        previous = known.get(path)
+        if previous and previous[:2] == signatures[path]:
+            stats['unchanged'] += 1
+            continue
+        to_extract.append(path)
+
+    # 削除されたアーカイブをインデックスから除く
+    prefix = os.path.join(root, '')
+    for path in known:
+        if path.startswith(prefix) and path not in signatures:
+            conn.execute("DELETE FROM archives WHERE path = ?", (path,))
+            stats['removed'] += 1
+
+    # 変更されたアーカイブを並列で解析し、完了したものから保存する
+    logging.info(f"{len(to_extract)}件のアーカイブを解析します（変更なし: {stats['unchanged']}件）")
+    for path, sha256, modules, error in _map_extract(to_extract, max_workers):
+        previous = known.get(path)
+        if not error and previous and previous[2] == sha256:
+            # 更新日時だけが変わった場合（ハッシュは解析と同時に計算済み）
+            conn.execute("UPDATE archives SET mtime_ns = ?, size = ? WHERE path = ?", (*signatures[path], path))
+            stats['unchanged'] += 1
+            continue
+        _store_archive(conn, path, signatures[path], sha256, modules, error)
+        stats['scanned'] += 1
+        stats['errors'] += bool(error)
+    conn.commit()
+
+    stats['modules'] = conn.execute(
+        "SELECT COUNT(*) FROM modules WHERE archive >= ? AND archive < ?", (prefix, prefix + '\uffff')
+    ).fetchone()[0]
+    return stats
+
+def _map_extract(paths, max_workers=0):
+    """アーカイブを並列で解析する（1件またはワーカー1つの場合はこのプロセスで処理する）"""
+    if not max_workers or max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(paths) or 1))
+    if max_workers == 1:
+        yield from map(extract_archive, paths)
+        return
+
+    log_queue, log_listener = pstg_util.start_log_listener()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=pstg_util.setup_worker_logging, initargs=(log_queue, logging.getLogger().level)) as executor:
+            yield from executor.map(extract_archive, paths, chunksize=8)
+    finally:
+        if log_listener:
+            log_listener.stop()
+
+def find_id_collisions(conn):
+    """
+    複数のアーカイブで使われているモジュールIDを返す
+    戻り値: [(モジュールID, [(アーカイブ, モジュール名), ...]), ...]
+    """
+    rows = conn.execute(
+        """
+        SELECT id, archive, name FROM modules
+        WHERE id IN (SELECT id FROM modules GROUP BY id HAVING COUNT(DISTINCT archive) > 1)
+        ORDER BY CAST(id AS INTEGER), id, archive
+        """
+    )
+    collisions = {}
+    for module_id, archive, name in rows:
+        collisions.setdefault(module_id, []).append((archive, name))
+    return list(collisions.items())
+
+def match_rule(conn, setting, map_chara):
+    """
+    PoseScale設定（Chara / ModuleNameContains / ModuleExclude）に一致するモジュールを返す
+    Charaが空の場合は全てのキャラクターのモジュールを対象にする
+    戻り値: [(アーカイブ, モジュールID, モジュール名, キャラクター), ...]
+    """
+    matchers = {} # Chara -> マッチャー（Chara指定なしの場合は全てのキャラクターを対象にする）
+    matched = []
+    for archive, module_id, name, chara in conn.execute("SELECT archive, id, name, chara FROM modules ORDER BY archive, CAST(id AS INTEGER)"):
+        module_chara = map_chara(chara, "module_to_setting")
+        rule_chara = setting.get('Chara') or module_chara
+        matcher = matchers.get(rule_chara)
+        if matcher is None:
+            matcher = matchers[rule_chara] = RuleMatcher([dict(setting, Chara=rule_chara)])
+        found, _ = matcher.resolve(name or '', module_chara)
+        if found is not None:
+            matched.append((archive, module_id, name, chara))
+    return matched
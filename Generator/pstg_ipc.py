@@ -0,0 +1,184 @@
+import os
+import json
+import socket
+import secrets
+import time
+import logging
+from pstg_util import get_app_dir
+
+# サービスの接続先を書き込むファイル（Cacheフォルダ内）
+ENDPOINT_FILE = 'service.json'
+
+# 接続を待つ時間（秒）。サービスが起動していない場合はすぐに通常の処理に戻る
+CONNECT_TIMEOUT = 0.5
+
+# pingの応答を待つ時間（秒）。接続先ファイルが古く、別のプログラムが同じポートを使っている場合に待ち続けないように
+HANDSHAKE_TIMEOUT = 2.0
+
+# 1メッセージの最大サイズ（JSON 1行）
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+PROTOCOL_VERSION = 1
+
+
+def get_endpoint_path(name=ENDPOINT_FILE):
+    """接続先ファイルのパスを取得"""
+    return os.path.join(get_app_dir(), 'Cache', name)
+
+def read_endpoint(name=ENDPOINT_FILE):
+    """接続先（{'port', 'token', 'pid'}）を読み込む（待ち受けているプロセスがない場合はNone）"""
+    try:
+        with open(get_endpoint_path(name), 'r', encoding='utf-8') as file:
+            endpoint = json.load(file)
+        if endpoint.get('protocol') != PROTOCOL_VERSION:
+            return None
+        return endpoint
+    except (OSError, ValueError):
+        return None
+
+def write_endpoint(port, token, name=ENDPOINT_FILE):
+    """接続先を書き込む（他のプロセスが書きかけのファイルを読まないよう置き換えで保存）"""
+    path = get_endpoint_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump({'protocol': PROTOCOL_VERSION, 'port': port, 'token': token, 'pid': os.getpid()}, file)
+    os.replace(temp_path, path)
+
+def remove_endpoint(name=ENDPOINT_FILE):
+    """このプロセスが書き込んだ接続先ファイルを削除する"""
+    endpoint = read_endpoint(name)
+    if endpoint and endpoint.get('pid') == os.getpid():
+        try:
+            os.remove(get_endpoint_path(name))
+        except OSError:
+            pass
+
+def send_message(sock, message):
+    """メッセージをJSON 1行として送信する"""
+    sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+def receive_message(sock_file):
+    """JSON 1行のメッセージを受信する（接続が閉じられた場合はNone）"""
+    line = sock_file.readline(MAX_MESSAGE_SIZE + 1)
+    if not line:
+        return None
+    if len(line) > MAX_MESSAGE_SIZE:
+        raise ValueError("メッセージが大きすぎます")
+    return json.loads(line.decode('utf-8'))
+
+def send_request(command, timeout=None, endpoint_name=ENDPOINT_FILE, **params):
+    """
+    サービスにリクエストを送信し、応答を返す
+    サービスが起動していない・接続できない場合はNoneを返す（呼び出し側は通常の処理を行う）
+    timeout: 応答を待つ時間（秒、Noneは無制限）
+    endpoint_name: 接続先ファイル名（サービス以外の待ち受けに送信する場合）
+    """
+    endpoint = read_endpoint(endpoint_name)
+    if not endpoint:
+        return None
+
+    try:
+        sock = socket.create_connection(('127.0.0.1', endpoint['port']), timeout=CONNECT_TIMEOUT)
+    except OSError:
+        logging.debug("サービスに接続できませんでした")
+        return None
+
+    try:
+        with sock, sock.makefile('rb') as sock_file:
+            sock.settimeout(timeout)
+            request = dict(params, command=command, token=endpoint['token'])
+            send_message(sock, request)
+            response = receive_message(sock_file)
+    except (OSError, ValueError) as e:
+        logging.warning(f"サービスとの通信に失敗しました: {e}")
+        return None
+    if response is not None and not isinstance(response, dict):
+        logging.warning("サービスから不正な応答を受信しました")
+        return None
+    return response
+
+def ping(endpoint_name=ENDPOINT_FILE, timeout=HANDSHAKE_TIMEOUT):
+    """
+    接続先が応答するか確認する（時間を区切らないリクエストを送る前のハンドシェイク）
+    戻り値: 応答（{'status': 'ok', 'pid'}）、応答がない場合・トークンが一致しない場合はNone
+    """
+    response = send_request('ping', timeout=timeout, endpoint_name=endpoint_name)
+    if not response or response.get('status') != 'ok':
+        return None
+    return response
+
+
+class ServiceEndpoint:
+    """
+    ローカルのTCPソケット（127.0.0.1のみ）でリクエストを受け付けるエンドポイント
+    接続先のポートとトークンはCacheフォルダのservice.jsonに書き込み、トークンが一致しないリクエストは拒否する
+    """
+
+    def __init__(self, handler, endpoint_name=ENDPOINT_FILE):
+        self.handler = handler # リクエスト(dict) -> 応答(dict)
+        self.endpoint_name = endpoint_name # 接続先ファイル名
+        self.token = secrets.token_hex(16)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen()
+        self.port = self._server.getsockname()[1]
+        self._running = False
+
+    def serve_forever(self, idle_timeout=None, deadline=None):
+        """
+        リクエストを1件ずつ処理する（idle_timeout秒リクエストがなければ終了）
+        ハンドラーが応答に'stop': Trueを含めた場合、deadline（time.monotonic()の値）を過ぎた場合も終了する
+        """
+        write_endpoint(self.port, self.token, self.endpoint_name)
+        self._running = True
+        logging.info(f"待ち受けを開始しました: 127.0.0.1:{self.port} ({self.endpoint_name})")
+        try:
+            while self._running:
+                timeout = idle_timeout
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                self._server.settimeout(timeout)
+                try:
+                    conn, _ = self._server.accept()
+                except socket.timeout:
+                    logging.info("一定時間リクエストがなかったため、待ち受けを終了します")
+                    break
+                with conn:
+                    self._handle_connection(conn)
+        finally:
+            self.close()
+
+    def _handle_connection(self, conn):
+        conn.settimeout(None)
+        try:
+            with conn.makefile('rb') as conn_file:
+                request = receive_message(conn_file)
+                if request is None:
+                    return
+                if not secrets.compare_digest(str(request.get('token', '')), self.token):
+                    logging.warning("トークンが一致しないリクエストを拒否しました")
+                    send_message(conn, {'status': 'error', 'message': 'invalid token'})
+                    return
+                try:
+                    response = self.handler(request)
+                except Exception as e:
+                    logging.exception(f"リクエストの処理中にエラーが発生しました: {e}")
+                    response = {'status': 'error', 'message': str(e)}
+                if response.pop('stop', False):
+                    self._running = False
+                send_message(conn, response)
+        except (OSError, ValueError) as e:
+            logging.warning(f"クライアントとの通信に失敗しました: {e}")
+
+    def close(self):
+        """待ち受けを終了し、接続先ファイルを削除する（先にソケットを閉じ、接続待ちのクライアントをすぐに失敗させる）"""
+        self._running = False
+        try:
+            self._server.close()
+        except OSError:
+            pass
+        remove_endpoint(self.endpoint_name)
@@ -1,17 +1,50 @@
 import os
+import json
+import hashlib
 import configparser
 import logging
-from pstg_util import get_app_dir, is_match
+from pstg_cache import get_settings_cache, hash_data, hash_file
+from pstg_match import RuleMatcher, select_profiles
+from pstg_util import get_app_dir, get_app_version
 
-def load_pose_scale_settings(module_data, app_config):
-    """プロファイルとモジュールデータに基づいてPoseScale設定を読み込む"""
+def get_pose_data_dir(app_config):
+    """PoseScaleDataのディレクトリを取得する（Settingsフォルダから探し、なければrootフォルダ）"""
     app_dir = get_app_dir() # アプリケーションのディレクトリ
     settings_dir = app_config.get('SettingsDir', os.path.join(app_dir, 'Settings')) # 設定ディレクトリ
-    
-    # PoseScaleDataをSettingsフォルダから探し、なければrootフォルダから探す
+
     pose_data_dir = os.path.join(settings_dir, 'PoseScaleData') # PoseScaleDataのディレクトリ
     if not os.path.exists(pose_data_dir): # PoseScaleDataのディレクトリが存在しない場合
         pose_data_dir = os.path.join(app_dir, 'PoseScaleData') # PoseScaleDataのディレクトリ
+    return pose_data_dir
+
+def settings_fingerprint(app_config):
+    """
+    出力に影響する全ての設定のフィンガープリントを返す
+    （Config.ini / TomlProfile.iniの内容と、読み込まれる可能性のある全てのPoseScaleデータの設定ファイル）
+    どのプロファイルが選ばれるかはモジュールデータ次第のため、PoseScaleDataフォルダ内のINIは全て含める
+    """
+    parts = [get_app_version(), str(app_config.get('UseModuleNameContains'))]
+    for key in ('ConfigParser', 'ProfileConfig'):
+        config = app_config.get(key)
+        if config is not None:
+            sections = {section: dict(config.items(section, raw=True)) for section in config.sections()}
+            parts.append(json.dumps(sections, ensure_ascii=False, sort_keys=True))
+
+    pose_data_dir = get_pose_data_dir(app_config)
+    if os.path.isdir(pose_data_dir):
+        for file_name in sorted(os.listdir(pose_data_dir)):
+            if file_name.lower().endswith('.ini'):
+                parts.append(file_name)
+                parts.append(hash_file(os.path.join(pose_data_dir, file_name)))
+    return hash_data(*parts)
+
+def load_pose_scale_settings(module_data, app_config, matched_profiles=None, used_files=None):
+    """
+    プロファイルとモジュールデータに基づいてPoseScale設定を読み込む
+    matched_profiles: 一致したTomlProfileのセクション名（Noneの場合はモジュールデータから選択する）
+    used_files: リストを渡すと読み込んだ設定ファイルのパスを追加する
+    """
+    pose_data_dir = get_pose_data_dir(app_config) # PoseScaleDataのディレクトリ
 
     config_profile = app_config.get('ProfileConfig', app_config['ConfigParser']) # 設定ファイル
     use_module_name_contains = app_config['UseModuleNameContains'] # モジュール名を含むか
@@ -21,44 +54,20 @@ def load_pose_scale_settings(module_data, app_config):
 
     # プロファイル選択は「いずれかのキーワードが含まれるか (OR)」で判定
     if use_module_name_contains:
-        # プロファイル選択は「いずれかのキーワードが含まれるか (OR)」で判定
+        # 一致したプロファイルが渡されていない場合はここで選択する
+        if matched_profiles is None:
+            matched_profiles = select_profiles(module_data, config_profile)
+
         for section in config_profile.sections():
             if section.startswith('TomlProfile_'):
-                # プロファイル選択は「いずれかのキーワードが含まれるか (OR)」で判定
-                match_str = config_profile.get(section, 'ModuleMatch', fallback='')
-                match_keywords = [m.strip() for m in match_str.split(',') if m.strip()]
-                
-                # プロファイル選択は「いずれかのキーワードが含まれるか (OR)」で判定
-                exclude_str = config_profile.get(section, 'ModuleExclude', fallback='')
-                exclude_keywords = [m.strip() for m in exclude_str.split(',') if m.strip()]
-                
-                logging.debug(f"Checking Profile: {section}, Keywords: {match_keywords}, Exclude: {exclude_keywords}")
-
-                # モジュールデータ内にマッチするキーワードがあるか確認
-                is_profile_match = False
-                for module in module_data: # モジュールデータを走査
-                    name = module.get('name', '')
-                    
-                    # Check Exclude first（除外キーワードがあるか確認）
-                    if any(ex in name for ex in exclude_keywords):
-                        continue
-
-                    # プロファイル選択は「いずれかのキーワードが含まれるか (OR)」で判定
-                    if any(k in name for k in match_keywords):
-                        logging.debug(f"  Match found! Module: {name} contains one of {match_keywords}")
-                        is_profile_match = True
-                        break
-                
-                if not is_profile_match:
-                     # マッチしなかった場合、最初の数件のモジュール名をログに出して確認
-                     sample_names = [m.get('name', '') for m in module_data[:3]]
-                     logging.debug(f"  No match in profile {section}. Sample module names: {sample_names}")
-                
-                if is_profile_match: # マッチした場合
+                if section in matched_profiles: # マッチした場合
                     config_file_base = config_profile[section]['ConfigFile']
                     config_files_to_read.append(f"{config_file_base}.ini")
                     logging.info(f"Profile matched: {section} -> Loading {config_file_base}.ini")
                 else:
+                    # マッチしなかった場合、最初の数件のモジュール名をログに出して確認
+                    sample_names = [m.get('name', '') for m in module_data[:3]]
+                    logging.debug("  No match in profile %s. Sample module names: %s", section, sample_names)
                     logging.info(f"Profile skipped (no match in module data): {section}")
         
         # UseModuleNameContainsがTrueの場合、PoseScaleData.iniを読み込む
@@ -79,29 +88,73 @@ def load_pose_scale_settings(module_data, app_config):
             continue
             
         logging.info(f"使用するconfig file: {config_file_path}")
+        if used_files is not None:
+            used_files.append(config_file_path)
         
-        # 設定ファイルを読み込む
-        config_pose = configparser.ConfigParser()
-        try: # 設定ファイルを読み込む
-            config_pose.read(config_file_path, encoding='utf-8-sig')
-        except UnicodeDecodeError: # 設定ファイルを読み込む
-            logging.warning(f"UTF-8での読み込みに失敗しました。cp932で再試行します: {config_file_path}")
-            config_pose.read(config_file_path, encoding='cp932')
-
-        # 読み込んだ設定ファイルを走査
-        for section in config_pose.sections():
-            # PoseScale設定セクションを走査
-            if section.startswith('PoseScaleSetting_'):
-                # PoseScale設定を読み込む
-                setting = {
-                    "Chara": config_pose.get(section, "Chara", fallback=None), # キャラクター名
-                    "ModuleNameContains": config_pose.get(section, "ModuleNameContains", fallback=None), # モジュール名を含むか
-                    "ModuleExclude": config_pose.get(section, "ModuleExclude", fallback=None), # モジュール名を除外する
-                    "PoseID": config_pose.get(section, "PoseID", fallback=None), # ポーズID
-                    "Scale": config_pose.get(section, "Scale", fallback=None) # スケール
-                }
-                pose_settings.append(setting) # pose_settingsに追加
-                logging.debug(f"セクションの設定を読み込みます {section}: {setting}")
+        # 設定ファイルを読み込む（変更がなければキャッシュ済みの解析結果を使う）
+        pose_settings.extend(read_pose_scale_file(config_file_path, app_config.get('UseSettingsCache', True)))
 
     logging.info(f"pose_settings を正常に読み込みました。件数: {len(pose_settings)}")
     return pose_settings
+
+def parse_pose_scale_file(config_file_path):
+    """PoseScaleデータの設定ファイルを解析し、PoseScale設定のリストを返す"""
+    config_pose = configparser.ConfigParser()
+    try: # 設定ファイルを読み込む
+        config_pose.read(config_file_path, encoding='utf-8-sig')
+    except UnicodeDecodeError: # 設定ファイルを読み込む
+        logging.warning(f"UTF-8での読み込みに失敗しました。cp932で再試行します: {config_file_path}")
+        config_pose.read(config_file_path, encoding='cp932')
+
+    pose_settings = []
+    # 読み込んだ設定ファイルを走査
+    for section in config_pose.sections():
+        # PoseScale設定セクションを走査
+        if section.startswith('PoseScaleSetting_'):
+            # PoseScale設定を読み込む
+            setting = {
+                "Chara": config_pose.get(section, "Chara", fallback=None), # キャラクター名
+                "ModuleNameContains": config_pose.get(section, "ModuleNameContains", fallback=None), # モジュール名を含むか
+                "ModuleExclude": config_pose.get(section, "ModuleExclude", fallback=None), # モジュール名を除外する
+                "PoseID": config_pose.get(section, "PoseID", fallback=None), # ポーズID
+                "Scale": config_pose.get(section, "Scale", fallback=None) # スケール
+            }
+            pose_settings.append(setting) # pose_settingsに追加
+            logging.debug("セクションの設定を読み込みます %s: %s", section, setting)
+    return pose_settings
+
+def read_pose_scale_file(config_file_path, use_cache=True):
+    """PoseScaleデータの設定ファイルを読み込む（ファイルが変更されていなければINIを解析せずキャッシュを使う）"""
+    if not use_cache:
+        return parse_pose_scale_file(config_file_path)
+
+    cache = get_settings_cache()
+    pose_settings = cache.get(config_file_path)
+    if pose_settings is not None:
+        logging.info(f"キャッシュ済みの設定を使用します: {config_file_path}")
+        return [dict(setting) for setting in pose_settings]
+
+    pose_settings = parse_pose_scale_file(config_file_path)
+    cache.put(config_file_path, [dict(setting) for setting in pose_settings])
+    return pose_settings
+
+def rules_fingerprint(pose_settings):
+    """PoseScale設定の内容（順序を含む）のハッシュ"""
+    return hashlib.sha256(json.dumps(pose_settings, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_rule_matcher(pose_settings, use_cache=True):
+    """PoseScale設定のマッチャーを取得する（同じ設定でコンパイル済みのものがあればキャッシュから使う）"""
+    if not use_cache:
+        return RuleMatcher(pose_settings)
+
+    fingerprint = rules_fingerprint(pose_settings)
+    cache = get_settings_cache()
+    matcher = cache.get_matcher(fingerprint)
+    if matcher is None:
+        matcher = RuleMatcher(pose_settings)
+        cache.put_matcher(fingerprint, matcher)
+    else:
+        logging.debug(f"コンパイル済みのマッチャーを使用します: {fingerprint[:12]}")
+    # キャッシュに変更がある場合のみ書き込む
+    cache.save()
+    return matcher
@@ -1,17 +1,31 @@
 import logging
 import time     # デバッグログ用（起動時間計測）
 logging.debug(f"[DEBUG] {time.time()}: SCRIPT START")
+import argparse
+import collections
+import concurrent.futures
+import multiprocessing
 import os
 import subprocess
 import sys
 import traceback
+import pstg_cache
+import pstg_coalesce
 import pstg_config
+import pstg_diff
 import pstg_farc
 import pstg_extract
+import pstg_index
+import pstg_ipc
 import pstg_loader
+import pstg_match
+import pstg_merge
 import pstg_pose
+import pstg_profile
 import pstg_scale
+import pstg_trace
 import pstg_util
+import pstg_watch
 
 
 # コンソールウィンドウの存在チェック
@@ -53,10 +67,730 @@ def launch_editor():
         if has_console():  # コンソール使用時
             input("Press Enter to exit...\n")
 
+# コマンドライン引数の解析
+def parse_arguments(argv):
+    """コマンドライン引数を解析する（ドラッグ＆ドロップされたパスとオプション）"""
+    parser = argparse.ArgumentParser(prog='PoseScaleTomlGenerator', description='Generate pose / scale TOML files from gm_module_tbl farc files.')
+    parser.add_argument('paths', nargs='*', help='farc files, extracted gm_module_tbl folders or .bin files, or folders containing them')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (0 = auto)')
+    parser.add_argument('--no-cache', action='store_true', help='ignore cached results and extracted module tables')
+    parser.add_argument('--service', action='store_true', help='run as a resident service that accepts jobs from later invocations')
+    parser.add_argument('--stop-service', action='store_true', help='stop the running service')
+    parser.add_argument('--no-service', action='store_true', help='process in this process even if a service is running')
+    parser.add_argument('--merge', metavar='DIR', help='merge the outputs of all archives into one pose TOML / scale_db.toml in DIR')
+    parser.add_argument('--update', action='store_true', help='update only the entries of the processed archives in existing pose TOML / scale_db.toml files and keep other lines')
+    parser.add_argument('--conflict', choices=pstg_merge.CONFLICT_POLICIES, default=None, help='which entry to keep when merged archives disagree (default: MergeConflictPolicy)')
+    parser.add_argument('--profile', action='store_true', help='run under cProfile and tracemalloc and write .pstats and an allocation report to logs/')
+    parser.add_argument('--trace', action='store_true', help='record per-stage timings and write a Chrome trace-event JSON file to logs/')
+    parser.add_argument('--watch', metavar='DIR', help='watch a mod folder and regenerate TOML files when farc or settings files change')
+    return parser.parse_args(argv)
+
+def parse_scan_arguments(argv):
+    """scanコマンドの引数を解析する"""
+    parser = argparse.ArgumentParser(prog='PoseScaleTomlGenerator scan', description='Build or query the module index of a mods folder.')
+    parser.add_argument('root', nargs='?', help='mods folder to scan (updates the index incrementally)')
+    parser.add_argument('--db', help='index file (default: Cache/module_index.sqlite)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (0 = auto)')
+    parser.add_argument('--collisions', action='store_true', help='list module ids used by more than one archive')
+    parser.add_argument('--match', metavar='KEYWORDS', help='list modules whose name contains any of the comma separated keywords')
+    parser.add_argument('--exclude', metavar='KEYWORDS', help='exclude keywords for --match')
+    parser.add_argument('--chara', metavar='CHARA', help='character for --match (e.g. MIK)')
+    parser.add_argument('--profile', action='store_true', help='run under cProfile and tracemalloc and write .pstats and an allocation report to logs/')
+    return parser.parse_args(argv)
+
+# ワーカープロセスの状態（設定はプロセス起動時に一度だけ受け取る）
+_worker_state = {}
+
+# ワーカー1つあたりに投入しておくアーカイブ数（時間のかかるアーカイブの後ろに結果が溜まり続けないように上限を設ける）
+IN_FLIGHT_PER_WORKER = 4
+
+def _init_worker(app_config, log_queue, log_level):
+    """ワーカープロセスの初期化（設定・キャラクターマッピングの共有とログ転送）"""
+    pstg_util.setup_worker_logging(log_queue, log_level)
+    pstg_trace.enable(app_config.get('OutputTrace', False))
+    _worker_state['app_config'] = app_config
+    _worker_state['map_chara'] = pstg_util.load_chara_mapping()
+
+def _process_archive_in_worker(dragged_file):
+    """ワーカープロセスでアーカイブを処理する"""
+    result = process_archive(dragged_file, _worker_state['app_config'], _worker_state['map_chara'])
+    if pstg_trace.is_enabled():
+        result['trace'] = pstg_trace.drain() # ワーカーで記録したスパンを親プロセスへ渡す
+    return result
+
+def run_batch(dragged_files, app_config, max_workers=0):
+    """複数のアーカイブを処理し、アーカイブごとの結果リストを入力順で返す"""
+    return list(iter_batch(dragged_files, app_config, max_workers))
+
+def iter_batch(dragged_files, app_config, max_workers=0):
+    """複数のアーカイブを処理し、アーカイブごとの結果を入力順に1件ずつ返す"""
+    # ワーカー数の決定（0以下は自動: CPU数とファイル数の小さい方）
+    if not max_workers or max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(dragged_files)))
+
+    # 1件またはワーカー1つの場合はプロセスを起動せずにその場で処理する
+    if max_workers == 1:
+        map_chara = pstg_util.load_chara_mapping()
+        for dragged_file in dragged_files:
+            yield process_archive(dragged_file, app_config, map_chara)
+        return
+
+    logging.info(f"{len(dragged_files)}件のアーカイブを{max_workers}プロセスで処理します")
+    log_queue, log_listener = pstg_util.start_log_listener()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(app_config, log_queue, logging.getLogger().level)) as executor:
+            # 投入済みで結果を返していないアーカイブはmax_workers * IN_FLIGHT_PER_WORKER件まで（入力順に返した分だけ追加する）
+            max_in_flight = max_workers * IN_FLIGHT_PER_WORKER
+            futures = collections.deque()
+            submitted = 0
+            for dragged_file in dragged_files:
+                while submitted < len(dragged_files) and len(futures) < max_in_flight:
+                    futures.append(executor.submit(_process_archive_in_worker, dragged_files[submitted]))
+                    submitted += 1
+                future = futures.popleft() # 返した結果をワーカー側の参照から解放する
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # ワーカープロセス自体が異常終了した場合
+                    logging.error(f"ワーカープロセスでエラーが発生しました: {dragged_file}: {e}")
+                    result = _make_result(dragged_file, 'error', message=str(e))
+                pstg_trace.add_events(result.pop('trace', None))
+                yield result
+    finally:
+        if log_listener:
+            log_listener.stop()
+
+def _make_result(dragged_file, status, message='', **counts):
+    """アーカイブ1件分の処理結果"""
+    result = {
+        'file': dragged_file, # 入力ファイル
+        'status': status, # 'ok' / 'error' / 'no_modules' / 'no_settings'
+        'message': message, # エラー内容など
+        'modules': 0, # モジュール数
+        'matched_modules': 0, # 設定が割り当てられたモジュール数
+        'settings': 0, # PoseScale設定数
+        'pose_entries': 0, # Pose TOMLのエントリ数
+        'scale_entries': 0, # Scale TOMLのエントリ数
+        'saved_files': [], # 保存したファイル
+        'settings_files': [], # 読み込んだPoseScaleデータの設定ファイル
+        'outputs': None, # まとめて出力する場合の生成結果 {'pose': {Pose TOMLファイル名: エントリ}, 'scale': エントリ}
+        'result_cache': None, # 出力キャッシュ: 'hit' / 'miss'（無効の場合はNone）
+        'extract_cache': None, # 抽出キャッシュ: 'hit' / 'miss'（無効・未使用の場合はNone）
+        'table_diff': None, # 前回のモジュールテーブルとの差分 {'added', 'changed', 'removed', 'resolved'}（前回の状態がない場合はNone）
+    }
+    result.update(counts)
+    return result
+
+def process_archive(dragged_file, app_config, map_chara):
+    """アーカイブ1件を処理してTOMLファイルを保存し、結果を返す"""
+    try:
+        # アーカイブごとに独立したTempワークスペースで処理する（並列実行・同時実行での衝突防止）
+        with pstg_trace.span('archive', file=os.path.basename(dragged_file)), \
+                pstg_util.temp_workspace(app_config.get('TempLocation', 'app'), delete=app_config.get('DeleteTemp', True)):
+            return _process_archive(dragged_file, app_config, map_chara)
+
+    except Exception as e:
+        logging.error(f"処理中にエラーが発生しました: {dragged_file}: {e}")
+        logging.error(traceback.format_exc())
+        return _make_result(dragged_file, 'error', message=str(e))
+
+def _process_archive(dragged_file, app_config, map_chara):
+    """アーカイブ1件の処理本体（Tempワークスペース内で実行される）"""
+    logging.info(f"処理を開始します: {dragged_file}")
+    dragged_file_dir = pstg_farc.get_output_dir(dragged_file)
+    raw_input = pstg_farc.is_raw_table_input(dragged_file) # 解凍済みのフォルダ・.binが渡された場合は解凍しない
+
+    # 保存先
+    save_directory = dragged_file_dir
+    if app_config['SaveInParentDirectory']:
+        save_directory = os.path.dirname(dragged_file_dir)
+
+    # アーカイブの内容と名前のハッシュ（出力キャッシュ・抽出キャッシュのキー）
+    archive_hash = None
+    if raw_input and app_config.get('UseResultCache', True):
+        archive_hash = pstg_cache.hash_data(*(part for file_name, path in pstg_farc.module_table_sources(dragged_file) for part in (file_name, pstg_cache.hash_file(path))))
+    elif not raw_input and (app_config.get('UseResultCache', True) or app_config.get('UseExtractCache', True)):
+        # 抽出するエントリはアーカイブ名にも依存するため、内容のハッシュに名前を加える
+        archive_hash = pstg_cache.hash_data(pstg_cache.hash_file(dragged_file), pstg_farc.get_archive_name(dragged_file).lower())
+
+    # 同じアーカイブ・同じ設定で生成済みの場合は前回の出力を保存して終了する（解凍・解析・マッチングを省略）
+    result_cache = None
+    result_key = None
+    if app_config.get('UseResultCache', True):
+        result_cache = pstg_cache.get_result_cache(app_config.get('ResultCacheSizeMB', 64) * 1024 * 1024)
+        fingerprint = app_config.get('SettingsFingerprint') or pstg_loader.settings_fingerprint(app_config)
+        result_key = pstg_cache.hash_data(archive_hash, fingerprint)
+        cached = result_cache.get(result_key)
+        if cached is not None:
+            logging.info(f"出力キャッシュを使用します: {dragged_file}")
+            with pstg_trace.span('save', result_cache='hit'):
+                saved_files, outputs = deliver_outputs(save_directory, cached['matched_profiles'], cached['pose_toml_entries'], cached['scale_toml_entries'], app_config, dragged_file)
+            return _make_result(dragged_file, 'ok', saved_files=saved_files, outputs=outputs, settings_files=cached.get('settings_files', []), result_cache='hit', **cached['counts'])
+
+    # FARCからモジュールテーブルを読み込む（抽出済みの場合はキャッシュから）
+    with pstg_trace.span('read') as trace_span:
+        if raw_input:
+            module_sources, extract_status = pstg_farc.module_table_sources(dragged_file), None
+        else:
+            module_sources, extract_status = load_module_sources(dragged_file, archive_hash, app_config)
+        trace_span.set(sources=len(module_sources or []), extract_cache=extract_status)
+
+    # データの抽出
+    with pstg_trace.span('extract') as trace_span:
+        module_data = pstg_extract.process_data(module_sources, save_json=not app_config.get('DeleteTemp', True)) # Tempを残す場合のみJSONを保存する
+        trace_span.set(modules=len(module_data))
+    if not module_data:
+        logging.error("データの抽出に失敗しました。処理を中止します。")
+        return _make_result(dragged_file, 'no_modules', message='No module data could be extracted.', extract_cache=extract_status)
+
+    # 一致するTomlProfileを1回の走査で選択する（設定の読み込みと保存の両方で使う）
+    matched_profiles = None
+    if app_config['UseModuleNameContains']:
+        config_profile = app_config.get('ProfileConfig', app_config['ConfigParser'])
+        with pstg_trace.span('profile_select') as trace_span:
+            matched_profiles = pstg_match.select_profiles(module_data, config_profile)
+            trace_span.set(profiles=len(matched_profiles))
+
+    # PoseScale設定の読み込み
+    settings_files = [] # 読み込んだPoseScaleデータの設定ファイル
+    with pstg_trace.span('settings_load') as trace_span:
+        pose_settings = pstg_loader.load_pose_scale_settings(module_data, app_config, matched_profiles, settings_files) # PoseScale設定の読み込み
+        trace_span.set(settings=len(pose_settings), files=len(settings_files))
+    if not pose_settings:
+        logging.error("有効なPoseScale設定が読み込めませんでした。処理を中止します。")
+        return _make_result(dragged_file, 'no_settings', message='No valid PoseScale settings were found.', modules=len(module_data), settings_files=settings_files, extract_cache=extract_status)
+
+    # モジュールごとに適用する設定を1回の走査で決定する（Pose / Scale共通）
+    # 前回のモジュールテーブルがある場合は、追加・変更されたモジュールのみ決定する
+    table_diff = None
+    with pstg_trace.span('match', modules=len(module_data)) as trace_span:
+        get_matcher = lambda: pstg_loader.load_rule_matcher(pose_settings, app_config.get('UseSettingsCache', True))
+        if app_config.get('UseTableDiff', True):
+            table_cache = pstg_cache.get_table_cache(app_config.get('TableCacheSizeMB', 64) * 1024 * 1024)
+            assignments, table_diff = pstg_diff.resolve_modules_incremental(table_cache, dragged_file, module_data, pose_settings, get_matcher, map_chara)
+            if table_diff:
+                trace_span.set(resolved=table_diff['resolved'])
+        else:
+            assignments = pstg_match.resolve_modules(module_data, get_matcher(), map_chara)
+
+    # Pose TOMLの生成
+    with pstg_trace.span('pose_gen') as trace_span:
+        pose_toml_entries = pstg_pose.build_pose_entries(assignments) 
+        trace_span.set(entries=len(pose_toml_entries))
+
+    # Scale TOMLの生成
+    with pstg_trace.span('scale_gen') as trace_span:
+        scale_toml_entries = pstg_scale.build_scale_entries(assignments, map_chara)
+        trace_span.set(entries=len(scale_toml_entries))
+
+    # ファイルの保存
+    with pstg_trace.span('save') as trace_span:
+        saved_files, outputs = deliver_outputs(save_directory, matched_profiles, pose_toml_entries, scale_toml_entries, app_config, dragged_file)
+        trace_span.set(files=len(saved_files))
+
+    counts = {
+        'modules': len(module_data), 'settings': len(pose_settings),
+        'matched_modules': sum(1 for _, setting, _ in assignments if setting is not None),
+        'pose_entries': len(pose_toml_entries), 'scale_entries': len(scale_toml_entries),
+    }
+
+    # 次回の実行のために出力をキャッシュする
+    if result_cache is not None:
+        result_cache.put(result_key, {
+            'matched_profiles': matched_profiles,
+            'pose_toml_entries': pose_toml_entries,
+            'scale_toml_entries': scale_toml_entries,
+            'counts': counts,
+            'settings_files': settings_files,
+        })
+
+    return _make_result(dragged_file, 'ok', saved_files=saved_files, outputs=outputs, settings_files=settings_files, result_cache='miss' if result_cache is not None else None,
+                        extract_cache=extract_status, table_diff=table_diff, **counts)
+
+def load_module_sources(dragged_file, archive_hash, app_config):
+    """
+    アーカイブのモジュールテーブルを(エントリ名, データ)のリストで返す
+    抽出キャッシュが有効な場合は同じ内容のアーカイブから抽出済みのデータを使い、なければ抽出してキャッシュに保存する
+    戻り値: (モジュールテーブル, 'hit' / 'miss' / None)
+    """
+    extract_cache = None
+    if archive_hash and app_config.get('UseExtractCache', True):
+        extract_cache = pstg_cache.get_extract_cache(app_config.get('ExtractCacheDir', ''), app_config.get('ExtractCacheSizeMB', 512) * 1024 * 1024)
+        sources = extract_cache.get(archive_hash)
+        if sources is not None:
+            logging.info(f"抽出キャッシュを使用します: {dragged_file}")
+            return sources, 'hit'
+
+    # 組み込みリーダーで読めない場合はFarcPackでTempに解凍する
+    sources = pstg_farc.read_module_table(dragged_file, app_config.get('FarcPackPath', ''))
+    if extract_cache is None:
+        return sources, None
+
+    if sources is None:
+        sources = pstg_extract.load_bin_files_from_temp()
+    if sources:
+        sources = pstg_extract.read_sources(sources)
+        extract_cache.put(archive_hash, sources)
+    return sources, 'miss'
+
+def pose_file_names(matched_profiles, app_config):
+    """Pose TOMLのファイル名（拡張子なし）のリスト（プロファイル有効時は一致したプロファイルごと）"""
+    if not app_config['UseModuleNameContains']:
+        return [app_config['DefaultPoseFileName']]
+    config_profile = app_config.get('ProfileConfig', app_config['ConfigParser']) # ConfigParser
+    return [config_profile[section]['PoseFileName'] for section in matched_profiles or []]
+
+def deliver_outputs(save_directory, matched_profiles, pose_toml_entries, scale_toml_entries, app_config, source=None):
+    """
+    生成したTOMLを保存する（まとめて出力するモードでは保存せず、生成結果を返す）
+    source: 出力元のアーカイブ（既存のTOMLを更新する場合に、前回の出力から消えたエントリを削除するために記録する）
+    戻り値: (保存したファイルのリスト, まとめて出力する場合の生成結果またはNone)
+    """
+    if app_config.get('MergeOutput'):
+        pose = {name: pose_toml_entries for name in pose_file_names(matched_profiles, app_config)}
+        return [], {'pose': pose, 'scale': scale_toml_entries}
+    return save_outputs(save_directory, matched_profiles, pose_toml_entries, scale_toml_entries, app_config, source), None
+
+def save_outputs(save_directory, matched_profiles, pose_toml_entries, scale_toml_entries, app_config, source=None):
+    """
+    Pose / Scale TOMLを保存し、保存したファイルのリストを返す（matched_profiles: 一致したTomlProfileのセクション名）
+    source: 出力元のアーカイブ（指定した場合は出力したキーを記録し、既存のTOMLの更新時に前回の出力から消えたエントリを削除する）
+    """
+    # プロファイルごとの保存ロジック（Config依存度高いためmainで処理しつつutilのsaveを呼ぶ)
+    saved_files = []
+    
+    use_module_name_contains = app_config['UseModuleNameContains'] # モジュール名を含むか
+    overwrite_existing = app_config.get('OverwriteExistingFiles', False) # 上書き保存
+    backup_limit = app_config.get('BackupLimit', pstg_util.DEFAULT_BACKUP_LIMIT) # バックアップの上限
+    update_existing = app_config.get('UpdateExistingFiles', False) # 既存のTOMLの該当エントリのみ更新
+    config_profile = app_config.get('ProfileConfig', app_config['ConfigParser']) # ConfigParser
+    pose_sources = {source: pstg_merge.entry_keys(pose_toml_entries, 'pose')} if source else None # 出力したキー
+    scale_sources = {source: pstg_merge.entry_keys(scale_toml_entries, 'scale')} if source else None
+
+    def should_save(entries, save_path):
+        # 更新する場合は、出力が空でも前回の出力から消えたエントリを既存のTOMLから削除する
+        return entries or (update_existing and source and os.path.exists(save_path))
+
+    # プロファイルごとの保存
+    if use_module_name_contains:
+        # 一致したプロファイルごとに保存
+        for section in matched_profiles or []:
+            pose_file_name = config_profile[section]['PoseFileName'] # Pose TOMLファイル名
+            save_path = os.path.join(save_directory, f'{pose_file_name}.toml') # 保存パス
+            
+            if should_save(pose_toml_entries, save_path):
+                pstg_merge.save_toml(save_path, pose_toml_entries, 'pose', overwrite_existing, backup_limit, update_existing, pose_sources) # Pose TOML保存
+                saved_files.append(save_path)
+            else:
+                logging.info(f"Pose TOMLの内容が空のため、生成をスキップしました: {save_path}")
+    else:
+        # モジュール名を含まない
+        default_pose_file_name = app_config['DefaultPoseFileName'] # デフォルトPose TOMLファイル名
+        save_path = os.path.join(save_directory, f'{default_pose_file_name}.toml') # 保存パス
+        
+        if should_save(pose_toml_entries, save_path):
+            pstg_merge.save_toml(save_path, pose_toml_entries, 'pose', overwrite_existing, backup_limit, update_existing, pose_sources) # Pose TOML保存
+            saved_files.append(save_path)
+        else:
+            logging.info(f"Pose TOMLの内容が空のため、生成をスキップしました: {save_path}")
+
+    # Scale TOMLは常に保存
+    scale_file_name = 'scale_db.toml' # Scale TOMLファイル名
+    save_path_scale = os.path.join(save_directory, scale_file_name) # 保存パス
+    
+    if should_save(scale_toml_entries, save_path_scale):
+        pstg_merge.save_toml(save_path_scale, scale_toml_entries, 'scale', overwrite_existing, backup_limit, update_existing, scale_sources) # Scale TOML保存
+        saved_files.append(save_path_scale)
+    else:
+         logging.info(f"Scale TOMLの内容が空のため、生成をスキップしました: {save_path_scale}")
+
+    return saved_files
+
+def print_summary(results, elapsed):
+    """アーカイブごとの処理結果をコンソールに表示する"""
+    labels = {'ok': 'OK', 'error': 'ERROR', 'no_modules': 'NO DATA', 'no_settings': 'NO SETTINGS'}
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+
+    print(f"Processed {len(results)} archive(s) in {elapsed:.2f}s ({succeeded} succeeded)")
+    for result in results:
+        label = labels.get(result['status'], result['status'])
+        if result['status'] == 'ok':
+            note = ' [cached]' if result.get('result_cache') == 'hit' else ''
+            table_diff = result.get('table_diff')
+            if table_diff:
+                note += f" [diff: +{table_diff['added']} ~{table_diff['changed']} -{table_diff['removed']}]"
+            print(f"  [{label}] {result['file']} (modules: {result['modules']}, matched: {result['matched_modules']}, pose: {result['pose_entries']}, scale: {result['scale_entries']}){note}")
+        else:
+            print(f"  [{label}] {result['file']}: {result['message']}")
+        logging.info(f"処理結果 [{label}] {result['file']}: {result}")
+
+    for key, name in (('result_cache', '出力キャッシュ'), ('extract_cache', '抽出キャッシュ')):
+        cache_hits = sum(1 for result in results if result.get(key) == 'hit')
+        cache_misses = sum(1 for result in results if result.get(key) == 'miss')
+        if cache_hits or cache_misses:
+            logging.info(f"{name}: ヒット {cache_hits} / ミス {cache_misses}")
+
+def load_runtime_config(setup_log=True):
+    """
+    設定を読み込み、実行用に調整したapp_configを返す（設定ファイルがない場合はNone）
+    setup_log: ログの初期化と古いTempワークスペースの削除も行う（サービスのジョブごとの再読み込みではFalse）
+    """
+    app_config = pstg_config.load_app_config()
+
+    # Config.iniが存在しない、または読み込み失敗した場合
+    if not app_config:
+        return None
+
+    # FarcPackPathの検証（組み込みFARCリーダーで読めない場合のフォールバック用のため任意）
+    farc_pack_path = app_config.get('FarcPackPath', '')
+    if farc_pack_path and (not os.path.exists(farc_pack_path) or not os.path.basename(farc_pack_path).lower() == 'farcpack.exe'):
+        logging.warning("FarcPackパスが無効なため、組み込みFARCリーダーのみを使用します。")
+        farc_pack_path = ''
+    app_config['FarcPackPath'] = farc_pack_path # 検証済みのパスをワーカーと共有
+
+    # DebugSettingsの読み込み
+    # app_configにはConfigParserオブジェクトが含まれている
+    config_parser = app_config['ConfigParser']
+
+    show_debug = pstg_config.debug_settings_enabled(app_config)
+    output_log = app_config.get('OutputLog', False)
+    delete_temp = app_config.get('DeleteTemp', True)
+
+    if not show_debug:
+        # デバッグ設定が非表示の場合、デフォルト値を強制的に使用する
+        output_log = False
+        delete_temp = True
+    app_config['DeleteTemp'] = delete_temp # ワーカーと共有
+    app_config['OutputTrace'] = show_debug and app_config.get('OutputTrace', False) # デバッグ設定が非表示の場合は無効
+
+    if setup_log:
+        pstg_util.setup_logging(show_debug=show_debug, output_log=output_log)
+
+        # 以前の実行で残ったTempワークスペースをバックグラウンドで削除
+        pstg_util.sweep_stale_workspaces(app_config.get('TempLocation', 'app'))
+
+    return app_config
+
+def run_merge(dragged_files, app_config, output_dir, max_workers=0, policy=None):
+    """
+    複数アーカイブの出力をモジュールID / (chara, cos)で重複を除いて1つにまとめて保存し、結果リストを返す
+    アーカイブは並列で処理し、完了した順（入力順）に取り込む
+    """
+    app_config['MergeOutput'] = True # ワーカーはファイルを保存せずに生成結果を返す
+    merger = pstg_merge.OutputMerger(policy or app_config.get('MergeConflictPolicy', 'first'))
+    results = []
+    for result in iter_batch(dragged_files, app_config, max_workers):
+        outputs = result.pop('outputs', None)
+        if outputs:
+            for pose_file_name, entries in outputs['pose'].items():
+                merger.add_pose(pose_file_name, entries, result['file'])
+            merger.add_scale(outputs['scale'], result['file'])
+        results.append(result)
+
+    saved_files = merger.save(output_dir, overwrite=app_config.get('OverwriteExistingFiles', False),
+                              backup_limit=app_config.get('BackupLimit', pstg_util.DEFAULT_BACKUP_LIMIT),
+                              update_existing=app_config.get('UpdateExistingFiles', False))
+    pose_count = sum(len(entries) for entries in merger.pose.values())
+    print(f"Merged {len(results)} archive(s) into {output_dir} (pose: {pose_count}, scale: {len(merger.scale)}, duplicates: {merger.duplicates}, conflicts: {len(merger.conflicts)}, policy: {merger.policy})")
+    for kind, key, kept, dropped in merger.conflicts:
+        print(f"  [CONFLICT] {kind} {key}: kept {kept or 'none'}, dropped {', '.join(dropped)}")
+    logging.info(f"まとめた出力を保存しました: {saved_files}")
+    return results
+
+def run_paths(paths, app_config, jobs=None, no_cache=False, merge_dir=None, conflict_policy=None, update_existing=False):
+    """
+    ドラッグ＆ドロップされたパスを処理し、(結果リスト, 経過時間)を返す
+    merge_dirを指定した場合は全てのアーカイブの出力を1つにまとめてそのフォルダに保存する
+    update_existing: 既存のTOMLは処理したアーカイブのエントリのみ更新する（UpdateExistingFilesと同じ）
+    処理対象のFARCファイルが見つからない場合は(None, 0)を返す
+    """
+    dragged_files = pstg_farc.get_dragged_files(paths) # ドラッグ＆ドロップされたファイル（フォルダ内のFARCを含む）
+    if not dragged_files:
+        logging.error("処理対象のFARCファイルが見つかりませんでした。")
+        return None, 0
+
+    if update_existing:
+        app_config['UpdateExistingFiles'] = True # ワーカーと共有
+    if no_cache:
+        app_config['UseResultCache'] = False
+        app_config['UseExtractCache'] = False
+        app_config['UseTableDiff'] = False
+    if app_config.get('UseResultCache', True):
+        app_config['SettingsFingerprint'] = pstg_loader.settings_fingerprint(app_config) # 設定のフィンガープリントは1回だけ計算する
+
+    # アーカイブごとの処理（複数の場合はワーカープールで並列処理）
+    max_workers = jobs if jobs is not None else app_config.get('MaxWorkers', 0)
+    if pstg_profile.is_active():
+        max_workers = 1 # プロファイル実行中はcProfileで計測できるようにこのプロセスで処理する
+    start_time = time.perf_counter()
+    if merge_dir:
+        results = run_merge(dragged_files, app_config, merge_dir, max_workers, conflict_policy)
+    else:
+        results = run_batch(dragged_files, app_config, max_workers)
+    return results, time.perf_counter() - start_time
+
+def finish_run(results, elapsed):
+    """結果を表示し、設定がない場合は設定エディタを起動、エラーがある場合は入力待ちにする"""
+    print_summary(results, elapsed)
+
+    # 有効なPoseScale設定が存在しない場合は設定エディタを起動する
+    if any(result['status'] == 'no_settings' for result in results):
+        launch_editor()
+        return
+
+    if any(result['status'] == 'error' for result in results):
+        if has_console():   # コンソール使用時
+            input("Press Enter to exit...\n")
+        return
+
+    logging.info("全処理が完了しました")
+
+def run_watch(directory, app_config, jobs=None, no_cache=False):
+    """フォルダを監視し、FARCまたは関連する設定ファイルが変更されたアーカイブのTOMLを再生成する"""
+    directory = os.path.abspath(directory.strip('{}'))
+    if not os.path.isdir(directory):
+        print(f"The folder to watch does not exist: {directory}")
+        logging.error(f"監視するフォルダが存在しません: {directory}")
+        return
+
+    def process(paths, current_config):
+        results, elapsed = run_paths(paths, current_config, jobs, no_cache)
+        if results is None:
+            return []
+        print_summary(results, elapsed)
+        return results
+
+    pstg_watch.watch_directory(
+        directory, app_config,
+        reload_config=lambda: load_runtime_config(setup_log=False),
+        process=process,
+        interval=app_config.get('WatchIntervalMs', 500) / 1000,
+        debounce=app_config.get('WatchDebounceMs', 300) / 1000,
+    )
+
+def run_scan(args, app_config):
+    """
+    modsフォルダのモジュールインデックスを作成・更新し、問い合わせ結果を表示する
+    戻り値: 解析対象のアーカイブのリスト（プロファイルのタグ用）
+    """
+    archives = []
+    conn = pstg_index.open_index(args.db)
+    try:
+        if args.root:
+            if not os.path.isdir(args.root):
+                print(f"The folder does not exist: {args.root}")
+                return archives
+            start_time = time.perf_counter()
+            max_workers = args.jobs if args.jobs is not None else app_config.get('MaxWorkers', 0)
+            if pstg_profile.is_active():
+                max_workers = 1 # プロファイル実行中はcProfileで計測できるようにこのプロセスで処理する
+            stats = pstg_index.scan_library(conn, args.root, max_workers)
+            archives = stats['paths']
+            print(f"Indexed {stats['archives']} archive(s) in {time.perf_counter() - start_time:.2f}s "
+                  f"(scanned: {stats['scanned']}, unchanged: {stats['unchanged']}, removed: {stats['removed']}, errors: {stats['errors']}, modules: {stats['modules']})")
+
+        if args.collisions:
+            collisions = pstg_index.find_id_collisions(conn)
+            print(f"Module id collisions: {len(collisions)}")
+            for module_id, owners in collisions:
+                print(f"  id {module_id}:")
+                for archive, name in owners:
+                    print(f"    {name}  ({archive})")
+
+        if args.match is not None or args.chara or args.exclude:
+            setting = {'Chara': args.chara, 'ModuleNameContains': args.match, 'ModuleExclude': args.exclude}
+            matched = pstg_index.match_rule(conn, setting, pstg_util.load_chara_mapping())
+            print(f"Modules matched by the rule: {len(matched)}")
+            for archive, module_id, name, chara in matched:
+                print(f"  [{chara}] id {module_id} {name}  ({archive})")
+    finally:
+        conn.close()
+    return archives
+
+def _handle_service_request(request):
+    """サービスが受け付けたリクエストを処理する"""
+    command = request.get('command')
+    if command == 'ping':
+        return {'status': 'ok', 'pid': os.getpid()}
+    if command == 'stop':
+        return {'status': 'ok', 'stop': True}
+    if command != 'run':
+        return {'status': 'error', 'message': f'unknown command: {command}'}
+
+    args = parse_arguments(request.get('argv', []))
+    cwd = request.get('cwd') or os.getcwd()
+    # 取りまとめたパスはargvとは別に渡される（他のプロセスから受け取ったパスを含む）
+    paths = [path if os.path.isabs(path.strip('{}')) else os.path.join(cwd, path.strip('{}')) for path in request.get('paths') or args.paths]
+
+    # 設定はジョブごとに読み直す（変更がなければキャッシュ済みの解析結果を使う）
+    app_config = load_runtime_config(setup_log=False)
+    if not app_config:
+        return {'status': 'no_config'}
+
+    logging.info(f"ジョブを受け付けました: {paths}")
+    merge_dir = os.path.join(cwd, args.merge) if args.merge else None
+    results, elapsed = run_paths(paths, app_config, args.jobs, args.no_cache, merge_dir, args.conflict, args.update)
+    if results is None:
+        return {'status': 'no_files'}
+    return {'status': 'ok', 'results': results, 'elapsed': elapsed}
+
+def run_service():
+    """常駐サービスとして起動し、ローカルソケットでジョブを受け付ける"""
+    if pstg_ipc.ping():
+        print("The generator service is already running.")
+        return
+
+    app_config = load_runtime_config()
+    if not app_config:
+        print("The configuration file cannot be found.")
+        logging.error("設定ファイルが見つかりません。")
+        return
+
+    idle_minutes = app_config.get('ServiceIdleMinutes', 30)
+    endpoint = pstg_ipc.ServiceEndpoint(_handle_service_request)
+    print(f"Generator service is running on 127.0.0.1:{endpoint.port} (Ctrl+C to stop)")
+    try:
+        endpoint.serve_forever(idle_timeout=idle_minutes * 60 if idle_minutes > 0 else None)
+    except KeyboardInterrupt:
+        logging.info("サービスを停止します")
+    finally:
+        endpoint.close()
+        pstg_util.wait_for_temp_cleanup()
+
+def forward_to_service(argv, paths=None):
+    """
+    起動中のサービスにジョブを転送し、結果を表示する
+    paths: 処理するパス（取りまとめたパスなど、argvのパスと異なる場合のみ）
+    サービスが起動していない・pingに応答しない場合はFalseを返す（呼び出し側がこのプロセスで処理する）
+    """
+    # ジョブの完了までは時間を区切らずに待つため、先にサービスが応答することを確認する
+    if not pstg_ipc.ping():
+        return False
+    response = pstg_ipc.send_request('run', argv=argv, cwd=os.getcwd(), paths=paths)
+    if response is None or response.get('status') == 'error':
+        if response is not None:
+            logging.warning(f"サービスでエラーが発生したため、このプロセスで処理します: {response.get('message')}")
+        return False
+
+    status = response.get('status')
+    if status == 'no_config':
+        print("The configuration file cannot be found.")
+        launch_editor()
+    elif status == 'no_files':
+        print("No farc files were found in the given paths.")
+        if has_console():
+            input("Press Enter to exit...\n")
+    else:
+        finish_run(response['results'], response['elapsed'])
+    return True
+
+def write_trace_report():
+    """記録したスパンをlogsフォルダにChromeのトレースイベント形式で保存し、1行のサマリーを表示する"""
+    trace_path, summary = pstg_trace.write_trace(pstg_util.get_log_dir())
+    if summary:
+        print(f"Trace: {summary}")
+        logging.info(f"トレース: {summary}")
+    if trace_path:
+        print(f"Trace file: {trace_path}")
+        logging.info(f"トレースを保存しました: {trace_path}")
+
+def run_job(args, app_config):
+    """
+    フォルダ監視、またはドラッグ＆ドロップされたパスの処理を行う
+    戻り値: 処理したアーカイブのリスト（プロファイルのタグ用）
+    """
+    # フォルダ監視モード（変更されたアーカイブのみ再生成する）
+    if args.watch:
+        run_watch(args.watch, app_config, args.jobs, args.no_cache)
+        return []
+
+    # 2. ファイルのドラッグ＆ドロップ処理(引数がない場合は使い方を表示して終了
+    if not args.paths:
+        print("Usage: Drag and drop files or folders onto this executable, or use the 'Send to' menu.")
+        # input("Press Enter to exit...")
+        if has_console():
+            input("Press Enter to exit...\n")
+        return []
+
+    # プログラム開始ログ
+    logging.info("プログラムを開始します")
+
+    # 3. アーカイブごとの処理
+    with pstg_trace.span('batch') as trace_span:
+        results, elapsed = run_paths(args.paths, app_config, args.jobs, args.no_cache, args.merge, args.conflict, args.update)
+        trace_span.set(archives=len(results or []))
+    if pstg_trace.is_enabled():
+        write_trace_report()
+    if results is None:
+        print("No farc files were found in the given paths.")
+        if has_console():
+            input("Press Enter to exit...\n")
+        return []
+
+    # 4. 結果の表示
+    finish_run(results, elapsed)
+    return [result['file'] for result in results]
+
 # メイン処理
 def main():
     logging.debug(f"[DEBUG] {time.time()}: Entering main")
 
+    # scanコマンド（modsフォルダ全体のモジュールインデックス）
+    if sys.argv[1:2] == ['scan']:
+        scan_args = parse_scan_arguments(sys.argv[2:])
+        app_config = load_runtime_config()
+        if not app_config:
+            print("The configuration file cannot be found.")
+            return
+        try:
+            if profile_requested(scan_args.profile, app_config):
+                pstg_profile.run_profiled(lambda: run_scan(scan_args, app_config), pstg_util.get_log_dir())
+            else:
+                run_scan(scan_args, app_config)
+        finally:
+            pstg_util.wait_for_temp_cleanup()
+        return
+
+    args = parse_arguments(sys.argv[1:])
+    if args.service:
+        run_service()
+        return
+    if args.stop_service:
+        if pstg_ipc.send_request('stop', timeout=5) is None:
+            print("The generator service is not running.")
+        return
+
+    # 「送る」などで短時間に連続して起動された場合は、最初のプロセスが全てのパスをまとめて処理する
+    # 設定の読み込み・サービスへの転送・バージョン表示より前に行い、パスを渡すだけのプロセスはすぐに終了する
+    forward_paths = None # サービスに転送するパス（他のプロセスから受け取ったパスを含む場合）
+    if args.paths and not args.watch and not args.profile and not args.trace:
+        paths = pstg_coalesce.coalesce_paths(args.paths, pstg_config.load_coalesce_window())
+        if paths is None:
+            print("The files were passed to the instance that is already running.")
+            return
+        if len(paths) != len(args.paths):
+            forward_paths = paths
+        args.paths = paths
+
+    # 1. 設定の読み込み・ログの初期化（サービスへの転送で出る警告もログ設定に従って出力する）
+    pstg_trace.enable(args.trace)
+    with pstg_trace.span('config'):
+        app_config = load_runtime_config()
+    if app_config and app_config.get('OutputTrace'):
+        pstg_trace.enable()
+    elif app_config and args.trace:
+        app_config['OutputTrace'] = True # ワーカーと共有
+
+    # プロファイル実行（--profile、またはDebugSettingsのOutputProfile）ではこのプロセスで全て処理する
+    profile = profile_requested(args.profile, app_config)
+
+    # 常駐サービスが起動している場合はジョブを転送する（解析・生成はサービスで行う）
+    # トレース・プロファイル実行ではこのプロセスで計測・出力するため転送しない
+    local_only = profile or pstg_trace.is_enabled()
+    if app_config and args.paths and not args.no_service and not local_only and forward_to_service(sys.argv[1:], forward_paths):
+        return
+
     # バージョン情報をコンソールに表示
     from pstg_util import VERSION
     if VERSION != "v0.0.0-dev": # バージョン情報がある時
@@ -83,9 +817,6 @@ def main():
     
 
     try:
-        # 1. 設定の読み込み
-        app_config = pstg_config.load_app_config()
-        
         # Config.iniが存在しない、または読み込み失敗した場合
         if not app_config:
             print("The configuration file cannot be found.")
@@ -93,132 +824,10 @@ def main():
             launch_editor()
             return
 
-        # FarcPackPathの検証
-        farc_pack_path = app_config.get('FarcPackPath', '')
-        if not farc_pack_path or not os.path.exists(farc_pack_path) or not os.path.basename(farc_pack_path).lower() == 'farcpack.exe':
-            print("Invalid FarcPack path is set.")
-            logging.error("有効なFarcPackパスが設定されていません。")
-            launch_editor()
-            return
-
-        # 2. ログの初期化（削除予定）
-        # debug_settings = app_config['DebugSettings'] 
-        
-        # DebugSettingsの読み込み
-        # app_configにはConfigParserオブジェクトが含まれている
-        config_parser = app_config['ConfigParser']
-        
-        show_debug = config_parser.getboolean('DebugSettings', 'ShowDebugSettings', fallback=False)
-        output_log = app_config.get('OutputLog', False)
-        delete_temp = app_config.get('DeleteTemp', True)
-
-        # OutputLogがFalseの場合は、デバッグ設定が有効でもコンソールログを抑制する
-        if not output_log:
-            show_debug = False
-
-        if not show_debug:
-            # デバッグ設定が非表示の場合、デフォルト値を強制的に使用する
-            output_log = False
-            delete_temp = True
-            
-        pstg_util.setup_logging(show_debug=show_debug, output_log=output_log)
-        
-
-        # 3. ファイルのドラッグ＆ドロップ処理(引数がない場合は使い方を表示して終了
-        if len(sys.argv) < 2:
-            print("Usage: Drag and drop a file onto this executable, or use the 'Send to' menu.")
-            # input("Press Enter to exit...")
-            if has_console():
-                input("Press Enter to exit...\n")
-            return
-
-        # プログラム開始ログ
-        logging.info("プログラムを開始します")
-
-        dragged_file = pstg_farc.get_dragged_file() # ドラッグ＆ドロップされたファイルのパス
-        
-        # ファイルをTempにコピーして解凍
-        dragged_file_dir = pstg_farc.process_file(dragged_file, farc_pack_path)
-
-        # 4. データの抽出
-        module_data = pstg_extract.process_data()
-        if not module_data:
-            logging.error("データの抽出に失敗しました。処理を中止します。")
-            return
-
-        # 5. PoseScale設定の読み込み（設定ファイルが存在しない場合は設定エディタを起動して終了）
-        pose_settings = pstg_loader.load_pose_scale_settings(module_data, app_config) # PoseScale設定の読み込み
-        if not pose_settings:
-            logging.error("有効なPoseScale設定が読み込めませんでした。処理を中止します。")
-            launch_editor() # 設定エディタを起動
-            return
-
-        # 6. キャラクターマッピングの取得
-        map_chara = pstg_util.load_chara_mapping()
-
-        # 7. Pose TOMLの生成
-        pose_toml_entries = pstg_pose.generate_pose_toml(module_data, pose_settings, map_chara) 
-
-        # 8. Scale TOMLの生成
-        scale_toml_entries = pstg_scale.generate_scale_toml(module_data, pose_settings, map_chara)
-
-        # 9. ファイルの保存
-        save_directory = dragged_file_dir
-        if app_config['SaveInParentDirectory']:
-            save_directory = os.path.dirname(dragged_file_dir)
-
-        # プロファイルごとの保存ロジック（Config依存度高いためmainで処理しつつutilのsaveを呼ぶ)
-        
-        use_module_name_contains = app_config['UseModuleNameContains'] # モジュール名を含むか
-        overwrite_existing = app_config.get('OverwriteExistingFiles', False) # 上書き保存
-        config_profile = app_config.get('ProfileConfig', app_config['ConfigParser']) # ConfigParser
-
-        # プロファイルごとの保存
-        if use_module_name_contains:
-            # モジュール名を含むか
-            for section in config_profile.sections():
-                # TomlProfile_で始まるセクション
-                if section.startswith('TomlProfile_'):
-                    match_str = config_profile.get(section, 'ModuleMatch', fallback='')
-                    exclude_str = config_profile.get(section, 'ModuleExclude', fallback='')
-                    
-                    # モジュールデータ内にマッチするキーワードがあるか確認
-                    is_match = False
-                    # モジュールデータ内を走査
-                    for module in module_data:
-                        if pstg_util.is_match(module.get('name', ''), match_str, exclude_str):
-                            is_match = True
-                            break
-                    
-                    # マッチする場合
-                    if is_match:
-                        pose_file_name = config_profile[section]['PoseFileName'] # Pose TOMLファイル名
-                        save_path = os.path.join(save_directory, f'{pose_file_name}.toml') # 保存パス
-                        
-                        if pose_toml_entries:
-                            pstg_util.save_file_with_timestamp(save_path, '\n'.join(pose_toml_entries), overwrite=overwrite_existing) # Pose TOML保存
-                        else:
-                            logging.info(f"Pose TOMLの内容が空のため、生成をスキップしました: {save_path}")
+        if profile:
+            pstg_profile.run_profiled(lambda: run_job(args, app_config), pstg_util.get_log_dir())
         else:
-            # モジュール名を含まない
-            default_pose_file_name = app_config['DefaultPoseFileName'] # デフォルトPose TOMLファイル名
-            save_path = os.path.join(save_directory, f'{default_pose_file_name}.toml') # 保存パス
-            
-            if pose_toml_entries:
-                pstg_util.save_file_with_timestamp(save_path, '\n'.join(pose_toml_entries), overwrite=overwrite_existing) # Pose TOML保存
-            else:
-                logging.info(f"Pose TOMLの内容が空のため、生成をスキップしました: {save_path}")
-
-        # Scale TOMLは常に保存
-        scale_file_name = 'scale_db.toml' # Scale TOMLファイル名
-        save_path_scale = os.path.join(save_directory, scale_file_name) # 保存パス
-        
-        if scale_toml_entries:
-            pstg_util.save_file_with_timestamp(save_path_scale, '\n'.join(scale_toml_entries), overwrite=overwrite_existing) # Scale TOML保存
-        else:
-             logging.info(f"Scale TOMLの内容が空のため、生成をスキップしました: {save_path_scale}")
-
-        logging.info("全処理が完了しました")
+            run_job(args, app_config)
 
     except Exception as e:
         logging.error(f"予期せぬエラーが発生しました: {e}")
@@ -230,16 +839,15 @@ def main():
             input("Press Enter to exit...\n")
     
     finally:
-        # 10. クリーンアップ (デバッグ設定に基づく)
-        # app_configが読み込まれていない場合、デバッグ設定をスキップする
-        should_delete = True
-        if 'app_config' in locals() and app_config:
-             should_delete = app_config.get('DeleteTemp', True)
-        
-        if should_delete:
-            pstg_util.clean_temp_dir()
-        else:
-            logging.info("デバッグ設定によりTempフォルダの削除をスキップしました")
+        # 10. クリーンアップ（Tempワークスペースはアーカイブごとにバックグラウンドで削除されるため、完了を待って終了する）
+        pstg_util.wait_for_temp_cleanup()
+
+def profile_requested(profile_flag, app_config):
+    """--profileの指定、またはDebugSettingsのOutputProfileが有効か（設定はmain()で読み込んだものを使う）"""
+    if profile_flag:
+        return True
+    return bool(app_config) and pstg_config.debug_settings_enabled(app_config) and app_config.get('OutputProfile', False)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # PyInstallerでビルドしたEXEでワーカープロセスを起動するため
     main()
@@ -0,0 +1,223 @@
+import logging
+
+
+def split_keywords(keyword_str):
+    """カンマ区切りのキーワード文字列をリストに変換する（空要素は除外）"""
+    if not keyword_str:
+        return []
+    return [word.strip() for word in keyword_str.split(',') if word.strip()]
+
+def split_include_keywords(contains_str):
+    """
+    ModuleNameContainsを一致キーワードのリストに変換する（pstg_util.is_matchと同じ規則）
+    |で始まるキーワード（旧除外指定）と文字化けキーワードは無視する
+    """
+    includes = [word for word in split_keywords(contains_str) if not word.startswith('|')]
+    if '\ufffd' in includes:
+        logging.warning("設定 %s に無効な文字が含まれているため、そのキーワードは無視します。", contains_str)
+        includes = [word for word in includes if word != '\ufffd']
+    return includes
+
+
+class KeywordAutomaton:
+    """Aho-Corasick法で複数のキーワードを1回の走査で検索するオートマトン"""
+
+    def __init__(self, keywords=()):
+        self.keywords = [] # キーワードID -> キーワード
+        self._keyword_ids = {} # キーワード -> キーワードID
+        self._goto = [{}] # 状態遷移
+        self._fail = [0] # 失敗遷移
+        self._terminal = [()] # 各状態で終わるキーワードID（登録したキーワードのみ）
+        self._output = [()] # 各状態で一致するキーワードID（失敗遷移先の分を含む。build()で作成する）
+        for keyword in keywords:
+            self.add(keyword)
+        self.build()
+
+    def add(self, keyword):
+        """キーワードを登録してIDを返す（登録済みの場合は既存のID）"""
+        if keyword in self._keyword_ids:
+            return self._keyword_ids[keyword]
+
+        keyword_id = len(self.keywords)
+        self.keywords.append(keyword)
+        self._keyword_ids[keyword] = keyword_id
+
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(())
+            state = next_state
+        self._terminal[state] = self._terminal[state] + (keyword_id,)
+        self._built = False
+        return keyword_id
+
+    def keyword_id(self, keyword):
+        """キーワードのIDを返す（未登録の場合はNone）"""
+        return self._keyword_ids.get(keyword)
+
+    def build(self):
+        """失敗遷移を幅優先で構築する（add()の後に再度呼び出しても一致するキーワードIDは重複しない）"""
+        self._output = list(self._terminal)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail if fail != next_state else 0
+                if self._output[self._fail[next_state]]:
+                    self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+        self._built = True
+
+    def find(self, text):
+        """テキストに含まれるキーワードIDの集合を返す"""
+        if not self._built:
+            self.build()
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+class RuleMatcher:
+    """
+    PoseScale設定を一度だけコンパイルしたマッチャー
+    - 設定はCharaごとに振り分け、キーワードは事前に分割済み
+    - モジュール名は1回の走査で全ての一致・除外キーワードを検出する
+    - 優先順位は従来通り（ModuleNameContains指定ありの設定を先に、同じ種類の中では設定ファイルの順）
+    """
+
+    def __init__(self, settings):
+        self.settings = list(settings)
+        self._automaton = KeywordAutomaton()
+        self._specific = {} # Chara -> {一致キーワードID: [設定のindex, ...]}
+        self._fallback = {} # Chara -> [(設定のindex, 除外キーワードIDの集合), ...]
+        self._excludes = {} # 設定のindex -> 除外キーワードIDの集合
+
+        for index, setting in enumerate(self.settings):
+            chara = setting.get("Chara")
+            excludes = frozenset(self._automaton.add(word) for word in split_keywords(setting.get("ModuleExclude")))
+            self._excludes[index] = excludes
+
+            if setting.get("ModuleNameContains"): # Specific（特定のマッチング）
+                by_keyword = self._specific.setdefault(chara, {})
+                for word in split_include_keywords(setting["ModuleNameContains"]):
+                    rules = by_keyword.setdefault(self._automaton.add(word), [])
+                    if not rules or rules[-1] != index:
+                        rules.append(index)
+            else: # Fallback（ModuleNameContainsが空）
+                fallback = self._fallback.setdefault(chara, [])
+                # 除外なしのFallbackより後ろの設定が選ばれることはないため登録しない
+                if not fallback or fallback[-1][1]:
+                    fallback.append((index, excludes))
+
+        self._automaton.build()
+
+    def resolve(self, module_name, module_chara):
+        """
+        モジュールに適用する設定を返す（見つからない場合はNone）
+        戻り値: (設定, 'Specific' / 'Fallback') または (None, None)
+        """
+        specific = self._specific.get(module_chara)
+        fallback = self._fallback.get(module_chara)
+        if not specific and not fallback:
+            return None, None
+
+        hits = self._automaton.find(module_name) # モジュール名に含まれるキーワード
+
+        # First pass: Specific matches（一致キーワードを含み、除外キーワードを含まない最初の設定）
+        if specific and hits:
+            best = None
+            for keyword_id in hits:
+                for index in specific.get(keyword_id, ()):
+                    if best is not None and index >= best:
+                        break
+                    if not (self._excludes[index] & hits):
+                        best = index
+                        break
+            if best is not None:
+                return self.settings[best], 'Specific'
+
+        # Second pass: Fallback matches（除外キーワードを含まない最初の設定）
+        if fallback:
+            for index, excludes in fallback:
+                if not (excludes & hits):
+                    return self.settings[index], 'Fallback'
+
+        return None, None
+
+
+def resolve_modules(module_data, matcher, map_chara):
+    """
+    全モジュールに適用する設定を1回の走査で決定する（Pose / Scaleの両方の出力に使う）
+    戻り値: [(モジュール, 設定, 'Specific' / 'Fallback'), ...]（一致しない場合の設定と種類はNone）
+    """
+    assignments = []
+    for module_value in module_data:
+        module_chara = map_chara(module_value["chara"], "module_to_setting") # モジュールキャラクター
+        setting, match_type = matcher.resolve(module_value["name"], module_chara)
+        if setting is None:
+             logging.debug("マッチする設定が見つかりませんでした: %s", module_value['name'])
+        assignments.append((module_value, setting, match_type))
+    return assignments
+
+
+def select_profiles(module_data, config_profile):
+    """
+    TomlProfile_セクションのうち、モジュールデータと一致するプロファイルを選択する
+    全プロファイルのキーワードを1つのオートマトンにまとめ、モジュール名を1回ずつ走査する
+    一致条件: ModuleExcludeのキーワードを含まず、ModuleMatchのいずれかのキーワードを含むモジュールが1つ以上ある
+    戻り値: 一致したセクション名のリスト（設定ファイルの順）
+    """
+    automaton = KeywordAutomaton()
+    sections = [] # TomlProfile_セクション
+    excludes = {} # セクション -> 除外キーワードIDの集合
+    by_keyword = {} # 一致キーワードID -> [セクション, ...]
+
+    for section in config_profile.sections():
+        if not section.startswith('TomlProfile_'):
+            continue
+        sections.append(section)
+        match_str = config_profile.get(section, 'ModuleMatch', fallback='')
+        exclude_str = config_profile.get(section, 'ModuleExclude', fallback='')
+        excludes[section] = frozenset(automaton.add(word) for word in split_keywords(exclude_str))
+        for word in split_include_keywords(match_str):
+            by_keyword.setdefault(automaton.add(word), []).append(section)
+        logging.debug("Checking Profile: %s, Keywords: %s, Exclude: %s", section, match_str, exclude_str)
+    automaton.build()
+
+    matched = set()
+    remaining = len(sections)
+    for module in module_data: # モジュールデータを走査
+        if not remaining: # 全プロファイルが一致済み
+            break
+        name = module.get('name', '')
+        hits = automaton.find(name)
+        for keyword_id in hits:
+            for section in by_keyword.get(keyword_id, ()):
+                if section not in matched and not (excludes[section] & hits):
+                    matched.add(section)
+                    remaining -= 1
+                    logging.debug("  Match found! Profile: %s, Module: %s", section, name)
+
+    return [section for section in sections if section in matched]
@@ -0,0 +1,343 @@
+import os
+import re
+import logging
+import pstg_cache
+from pstg_pose import pose_entry_key
+from pstg_scale import scale_entry_key
+from pstg_util import DEFAULT_BACKUP_LIMIT, save_file_with_timestamp
+
+# Pose TOMLの「キー = 値  # コメント」の行
+_KEY_VALUE_LINE = re.compile(r'^(\s*)([^=#\s][^=#]*?)(\s*=\s*)([^#]*?)(\s*#.*)?$')
+
+# 同じモジュールID / (chara, cos)に異なる値が生成された場合の扱い
+CONFLICT_POLICIES = ('first', 'last', 'skip') # 先のアーカイブを優先 / 後のアーカイブを優先 / どちらも出力しない
+
+
+def _parse_key_value(line):
+    """「キー = 値」の行を(キー, 値, 行の部品)に分解する（該当しない行はNone）"""
+    match = _KEY_VALUE_LINE.match(line)
+    if not match:
+        return None
+    return match.group(2).strip().strip('"'), match.group(4).strip(), match
+
+def _replace_value(match, value):
+    """行の値だけを置き換える（インデントとコメントは保持する）"""
+    indent, key, separator, _, comment = match.groups()
+    return f"{indent}{key}{separator}{value}{comment or ''}"
+
+def _join_appended(lines, appended, separator='\n', trailing_newline=False):
+    """
+    既存の行の後ろに新しいエントリを追加したテキストを返す
+    追加がない場合は既存の行をそのまま戻す（末尾の改行の有無は追加の有無にかかわらず元のファイルに合わせる）
+    """
+    if not appended:
+        text = '\n'.join(lines)
+        return text + '\n' if trailing_newline and lines else text
+    lines = list(lines)
+    while lines and not lines[-1].strip():
+        lines.pop() # 末尾の空行は追加するエントリとの区切りに置き換える
+    text = (('\n'.join(lines) + separator) if lines else '') + '\n'.join(appended)
+    return text + '\n' if trailing_newline and not text.endswith('\n') else text
+
+def _scale_key(chara, cos):
+    """(chara, cos)を比較用のキーにする（引用符の有無とcosの表記（"001"と1など）の違いを除く）"""
+    chara = chara.strip().strip('"\'') if chara is not None else None
+    cos = cos.strip().strip('"\'') if cos is not None else None
+    try:
+        cos = int(cos)
+    except (TypeError, ValueError):
+        pass
+    return chara, cos
+
+def _scale_blocks(lines):
+    """[[cos_scale]]ごとの(開始行, 終了行)を求める（次のテーブルの見出しまで）"""
+    blocks = []
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('['):
+            if blocks and blocks[-1][1] is None:
+                blocks[-1][1] = index
+            if stripped == '[[cos_scale]]':
+                blocks.append([index, None])
+    if blocks and blocks[-1][1] is None:
+        blocks[-1][1] = len(lines)
+    return blocks
+
+def update_pose_text(existing_text, entries):
+    """
+    既存のPose TOMLのうち、entriesと同じモジュールIDの行の値だけを更新し、新しいモジュールIDの行を末尾に追加する
+    それ以外の行（他のアーカイブのエントリ・コメント・手動で編集した行）はそのまま残す
+    戻り値: (更新後のテキスト, 更新した行数, 追加した行数)
+    """
+    new_values = {} # モジュールID -> PoseID（entriesの順）
+    for entry in entries:
+        new_values[pose_entry_key(entry)] = entry.split('=', 1)[1].strip()
+
+    lines = existing_text.splitlines()
+    found = set()
+    updated = 0
+    for index, line in enumerate(lines):
+        parsed = _parse_key_value(line)
+        if parsed is None or parsed[0] not in new_values:
+            continue
+        key, value, match = parsed
+        found.add(key)
+        if value != new_values[key]:
+            lines[index] = _replace_value(match, new_values[key])
+            updated += 1
+
+    appended = [f"{key} = {value}" for key, value in new_values.items() if key not in found]
+    return _join_appended(lines, appended, '\n', existing_text.endswith('\n')), updated, len(appended)
+
+def update_scale_text(existing_text, entries):
+    """
+    既存のscale_db.tomlのうち、entriesと同じ(chara, cos)の[[cos_scale]]のscaleだけを更新し、新しい(chara, cos)を末尾に追加する
+    それ以外のテーブル・行（コメントや手動で追加したキー）はそのまま残す
+    戻り値: (更新後のテキスト, 更新したエントリ数, 追加したエントリ数)
+    """
+    new_entries = {} # (chara, cos) -> (scale, エントリ)
+    for entry in entries:
+        values = dict(_parse_key_value(line)[:2] for line in entry.splitlines() if _parse_key_value(line))
+        new_entries[_scale_key(*scale_entry_key(entry))] = (values.get('scale'), entry)
+
+    lines = existing_text.splitlines()
+    found = set()
+    updated = 0
+    inserts = [] # (挿入する行番号, 行)（scaleの行がないテーブル）
+    for start, end in _scale_blocks(lines):
+        values = {} # キー -> (値, 行番号, 行の部品)
+        for index in range(start + 1, end):
+            parsed = _parse_key_value(lines[index])
+            if parsed is not None:
+                values.setdefault(parsed[0], (parsed[1], index, parsed[2]))
+        key = _scale_key(values.get('chara', (None,))[0], values.get('cos', (None,))[0])
+        if key not in new_entries:
+            continue
+        found.add(key)
+        scale = new_entries[key][0]
+        if 'scale' in values:
+            value, index, match = values['scale']
+            if value != scale:
+                lines[index] = _replace_value(match, scale)
+                updated += 1
+        else:
+            inserts.append((values['cos'][1] + 1, f"scale = {scale}"))
+            updated += 1
+    for index, line in sorted(inserts, reverse=True):
+        lines.insert(index, line)
+
+    # 生成時と同じく、エントリの間は空行で区切る
+    appended = [entry.rstrip('\n') + '\n' for key, (_, entry) in new_entries.items() if key not in found]
+    return _join_appended(lines, appended, '\n\n', existing_text.endswith('\n')), updated, len(appended)
+
+def remove_pose_keys(existing_text, keys):
+    """
+    既存のPose TOMLから、keysのモジュールIDの行を削除する（コメントや他の行はそのまま残す）
+    戻り値: (削除後のテキスト, 削除した行数)
+    """
+    if not keys:
+        return existing_text, 0
+    lines = existing_text.splitlines()
+    kept = [line for line in lines if (_parse_key_value(line) or (None,))[0] not in keys]
+    removed = len(lines) - len(kept)
+    if not removed:
+        return existing_text, 0
+    return _join_appended(kept, [], '\n', existing_text.endswith('\n')), removed
+
+def remove_scale_keys(existing_text, keys):
+    """
+    既存のscale_db.tomlから、keysの(chara, cos)の[[cos_scale]]をテーブルごと削除する
+    テーブルの後ろのコメント（次のテーブルの説明）は残し、区切りの空行は削除する
+    戻り値: (削除後のテキスト, 削除したエントリ数)
+    """
+    if not keys:
+        return existing_text, 0
+    lines = existing_text.splitlines()
+    removes = [] # (開始行, 終了行)
+    for start, end in _scale_blocks(lines):
+        values = {}
+        for index in range(start + 1, end):
+            parsed = _parse_key_value(lines[index])
+            if parsed is not None:
+                values.setdefault(parsed[0], parsed[1])
+        if _scale_key(values.get('chara'), values.get('cos')) not in keys:
+            continue
+        stop = end
+        while stop > start + 1 and (not lines[stop - 1].strip() or lines[stop - 1].lstrip().startswith('#')):
+            stop -= 1 # 末尾の空行とコメントはテーブルに含めない
+        while stop < end and not lines[stop].strip():
+            stop += 1 # 区切りの空行は削除する
+        removes.append((start, stop))
+    if not removes:
+        return existing_text, 0
+    for start, stop in reversed(removes):
+        del lines[start:stop]
+    return _join_appended(lines, [], '\n', existing_text.endswith('\n')), len(removes)
+
+def entry_keys(entries, kind):
+    """エントリのキー（Pose: モジュールID、Scale: 比較用の(chara, cos)）の集合"""
+    if kind == 'pose':
+        return {pose_entry_key(entry) for entry in entries}
+    return {_scale_key(*scale_entry_key(entry)) for entry in entries}
+
+def _contribution_key(save_path):
+    return pstg_cache.hash_data(os.path.normcase(os.path.abspath(save_path)))
+
+def stale_keys(save_path, sources):
+    """
+    前回の保存で各アーカイブが出力し、今回は出力しなかったキーを返す
+    他のアーカイブが出力したキー（前回の記録を含む）は削除しない
+    sources: {アーカイブのパス: 今回出力したキーの集合}
+    戻り値: (削除するキーの集合, 保存する記録)
+    """
+    previous = pstg_cache.get_contribution_cache().get(_contribution_key(save_path)) or {}
+    current = dict(previous)
+    stale = set()
+    for source, keys in sources.items():
+        source = os.path.normcase(os.path.abspath(source))
+        stale |= previous.get(source, set()) - keys
+        current[source] = keys
+    for keys in current.values():
+        stale -= keys
+    return stale, current
+
+def read_existing_toml(save_path):
+    """既存のTOMLのテキストを読み込む（存在しない・読み込めない場合はNone）"""
+    try:
+        with open(save_path, 'r', encoding='utf-8-sig') as toml_file:
+            return toml_file.read()
+    except FileNotFoundError:
+        return None
+    except (OSError, UnicodeDecodeError) as e:
+        logging.warning(f"既存のTOMLを読み込めないため置き換えます: {save_path}: {e}")
+        return None
+
+def save_toml(save_path, entries, kind='pose', overwrite=False, backup_limit=DEFAULT_BACKUP_LIMIT, update_existing=False, sources=None):
+    """
+    Pose / Scale TOMLを保存する
+    update_existing: 既存のファイルがある場合は、entriesのモジュールID / (chara, cos)のみ更新して他の行は残す
+    sources: {アーカイブのパス: そのアーカイブが出力したキーの集合（entry_keys）}
+             出力したキーを記録し、更新時は前回そのアーカイブが出力して今回は出力しなかったキーを削除する
+    """
+    stale, record = set(), None
+    if sources is not None:
+        stale, record = stale_keys(save_path, sources)
+
+    existing_text = read_existing_toml(save_path) if update_existing else None
+    if existing_text is None and not entries:
+        return # 更新するTOMLがない場合は空のファイルを作らない
+    if existing_text is None:
+        saved = save_file_with_timestamp(save_path, '\n'.join(entries), overwrite=overwrite, backup_limit=backup_limit)
+    else:
+        remove = remove_pose_keys if kind == 'pose' else remove_scale_keys
+        update = update_pose_text if kind == 'pose' else update_scale_text
+        text, removed = remove(existing_text, stale)
+        text, updated, appended = update(text, entries)
+        logging.info(f"既存のTOMLを更新します: {save_path} (更新: {updated}件, 追加: {appended}件, 削除: {removed}件)")
+        saved = save_file_with_timestamp(save_path, text, overwrite=overwrite, backup_limit=backup_limit)
+
+    # 内容が変わらずに保存しなかった場合も、出力したキーは記録する
+    if record is not None and (saved or os.path.exists(save_path)):
+        pstg_cache.get_contribution_cache().put(_contribution_key(save_path), record)
+
+
+def _sort_key(key):
+    """数値のキーは数値順、それ以外は文字列順に並べる"""
+    if isinstance(key, tuple):
+        return tuple(_sort_key(part) for part in key)
+    try:
+        return (0, int(key), '')
+    except (TypeError, ValueError):
+        return (1, 0, str(key))
+
+
+class OutputMerger:
+    """
+    複数アーカイブのPose / Scale TOMLのエントリを1つにまとめる
+    アーカイブの結果は届いた順に取り込み、重複はモジュールID / (chara, cos)で除外する
+    （保持するのは重複を除いたエントリのみで、アーカイブごとのリストは取り込み後に破棄できる）
+    """
+
+    def __init__(self, policy='first'):
+        if policy not in CONFLICT_POLICIES:
+            logging.warning(f"不明な競合時の処理のため'first'を使用します: {policy}")
+            policy = 'first'
+        self.policy = policy
+        self.pose = {} # Pose TOMLファイル名 -> {モジュールID: (エントリ, アーカイブ)}
+        self.scale = {} # (chara, cos) -> (エントリ, アーカイブ)
+        self.conflict_records = {'pose': {}, 'scale': {}} # キー -> 競合の記録（Pose TOMLはファイル名ごと）
+        self.conflicts = [] # [種類, キー, 採用したアーカイブ, [採用しなかったアーカイブ, ...]]（キーごとに1件）
+        self.duplicates = 0 # 同じ内容の重複エントリ数
+        self.pose_sources = {} # Pose TOMLファイル名 -> {アーカイブ: 出力したキーの集合}（採用されなかったエントリを含む）
+        self.scale_sources = {} # アーカイブ -> 出力したキーの集合
+
+    def _add(self, entries, key, entry, source, records, kind):
+        record = records.get(key)
+        if record is not None and self.policy == 'skip':
+            # 出力しないキーに後から届いたアーカイブも記録する
+            if source not in record[3]:
+                record[3].append(source)
+            return
+        existing = entries.get(key)
+        if existing is None:
+            entries[key] = (entry, source)
+            return
+        if existing[0] == entry:
+            self.duplicates += 1
+            return
+
+        if self.policy == 'last':
+            entries[key] = (entry, source)
+            kept, dropped = source, [existing[1]]
+        elif self.policy == 'skip':
+            del entries[key]
+            kept, dropped = None, [existing[1], source]
+        else:
+            kept, dropped = existing[1], [source]
+        if record is None:
+            record = records[key] = [kind, key, kept, []]
+            self.conflicts.append(record)
+        record[2] = kept
+        record[3].extend(archive for archive in dropped if archive not in record[3] and archive != kept)
+        logging.warning(f"{kind}の競合: {key} ({existing[1]} / {source}) -> {kept or '出力しない'}")
+
+    def add_pose(self, pose_file_name, entries, source):
+        """アーカイブ1件分のPose TOMLのエントリを取り込む"""
+        merged = self.pose.setdefault(pose_file_name, {})
+        records = self.conflict_records['pose'].setdefault(pose_file_name, {})
+        self.pose_sources.setdefault(pose_file_name, {})[source] = entry_keys(entries, 'pose')
+        for entry in entries:
+            self._add(merged, pose_entry_key(entry), entry, source, records, 'Pose')
+
+    def add_scale(self, entries, source):
+        """アーカイブ1件分のScale TOMLのエントリを取り込む"""
+        self.scale_sources[source] = entry_keys(entries, 'scale')
+        for entry in entries:
+            self._add(self.scale, scale_entry_key(entry), entry, source, self.conflict_records['scale'], 'Scale')
+
+    def pose_entries(self, pose_file_name):
+        """まとめたPose TOMLのエントリ（モジュールID順）"""
+        merged = self.pose.get(pose_file_name, {})
+        return [merged[key][0] for key in sorted(merged, key=_sort_key)]
+
+    def scale_entries(self):
+        """まとめたScale TOMLのエントリ（chara, cos順）"""
+        return [self.scale[key][0] for key in sorted(self.scale, key=_sort_key)]
+
+    def save(self, output_dir, overwrite=False, backup_limit=DEFAULT_BACKUP_LIMIT, update_existing=False):
+        """まとめたTOMLを保存し、保存したファイルのリストを返す（update_existing: 既存のTOMLの該当エントリのみ更新する）"""
+        os.makedirs(output_dir, exist_ok=True)
+        saved_files = []
+        for pose_file_name in self.pose:
+            entries = self.pose_entries(pose_file_name)
+            if entries:
+                save_path = os.path.join(output_dir, f'{pose_file_name}.toml')
+                save_toml(save_path, entries, 'pose', overwrite, backup_limit, update_existing, self.pose_sources.get(pose_file_name))
+                saved_files.append(save_path)
+
+        entries = self.scale_entries()
+        if entries:
+            save_path = os.path.join(output_dir, 'scale_db.toml')
+            save_toml(save_path, entries, 'scale', overwrite, backup_limit, update_existing, self.scale_sources)
+            saved_files.append(save_path)
+        return saved_files
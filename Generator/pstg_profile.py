@@ -0,0 +1,109 @@
+import os
+import io
+import time
+import pstats
+import logging
+import cProfile
+import tracemalloc
+from datetime import datetime
+
+# レポートに出力する上位件数
+TOP_N = 30
+
+# tracemallocで記録するスタックの深さ
+TRACE_FRAMES = 1
+
+# プロファイル実行中かどうか（実行中はワーカープロセスを使わずにこのプロセスで処理する）
+_profile_state = {'active': False}
+
+
+def is_active():
+    return _profile_state['active']
+
+def _format_size(size):
+    """バイト数を読みやすい単位に変換する"""
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+def measure_inputs(paths):
+    """入力ファイルの(件数, 合計バイト数)を返す（プロファイルのタグ用）"""
+    count, total = 0, 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+            count += 1
+        except OSError:
+            pass
+    return count, total
+
+def _allocation_report(snapshot, peak):
+    """tracemallocのスナップショットから上位TOP_N件の確保元のレポートを作成する"""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    stats = snapshot.statistics('lineno')
+    total = sum(stat.size for stat in stats)
+    lines = [f"Peak traced memory: {_format_size(peak)}", f"Still allocated at exit: {_format_size(total)}", "",
+             f"Top {TOP_N} allocations by line:"]
+    for index, stat in enumerate(stats[:TOP_N], 1):
+        frame = stat.traceback[0]
+        lines.append(f"{index:3}. {frame.filename}:{frame.lineno}: {_format_size(stat.size)} ({stat.count} blocks)")
+    return lines
+
+def run_profiled(func, log_dir):
+    """
+    funcをcProfileとtracemallocの下で実行し、logsフォルダに.pstatsと確保メモリ上位のレポートを保存する
+    func: 処理した入力ファイルのリストを返す関数（件数と合計サイズをファイル名とレポートに記録する）
+    戻り値: (pstatsのパス, レポートのパス)。保存に失敗した場合はNone
+    """
+    started_at = datetime.now()
+    _profile_state['active'] = True
+    profiler = cProfile.Profile()
+    tracemalloc.start(TRACE_FRAMES)
+    start_time = time.perf_counter()
+    try:
+        inputs = profiler.runcall(func) or []
+    finally:
+        elapsed = time.perf_counter() - start_time
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        _profile_state['active'] = False
+
+    count, total = measure_inputs(inputs)
+    tag = f"{started_at.strftime('%Y%m%d%H%M%S')}_{count}files_{_format_size(total)}"
+    # ログ出力が無効な場合はlogsフォルダが作成されていないため、ここで作成する
+    os.makedirs(log_dir, exist_ok=True)
+    stats_path = os.path.join(log_dir, f"profile_{tag}.pstats")
+    report_path = os.path.join(log_dir, f"profile_{tag}.txt")
+    try:
+        profiler.dump_stats(stats_path)
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_N)
+        lines = [
+            f"Input: {count} file(s), {_format_size(total)} ({total} bytes)",
+            *(f"  {path}" for path in inputs),
+            f"Elapsed: {elapsed:.2f}s (archives are processed in this process while profiling;"
+            " the job is not forwarded to the service or coalesced, and config loading is not included)",
+            "",
+            *_allocation_report(snapshot, peak),
+            "",
+            f"Top {TOP_N} functions by cumulative time:",
+            stream.getvalue().strip(),
+        ]
+        with open(report_path, 'w', encoding='utf-8') as report_file:
+            report_file.write('\n'.join(lines) + '\n')
+    except OSError as e:
+        logging.error(f"プロファイルを保存できませんでした: {e}")
+        return None
+
+    print(f"Profile: {stats_path}")
+    print(f"Profile report: {report_path}")
+    return stats_path, report_path
@@ -1,64 +1,39 @@
 import logging
-from pstg_util import is_match
+from pstg_match import RuleMatcher, resolve_modules
 
-def generate_scale_toml(module_data, scale_settings, map_chara):
-    """Scale TOMLデータを生成する"""
+def build_scale_entries(assignments, map_chara):
+    """モジュールと設定の割り当て結果からScale TOMLデータを生成する"""
     scale_toml_entries = []
     logging.info("ScaleTomlデータの変換を開始")
 
-    # モジュールデータを走査
-    for module_value in module_data:
-        module_chara = map_chara(module_value["chara"], "module_to_setting") # モジュールキャラクター
-        
-        # First pass: Specific matches (ModuleNameContains is set)（特定の一致）
-        matched = False
-        # Pose設定を走査
-        for setting in scale_settings:
-            match_str = setting["ModuleNameContains"] # マッチング文字列
-            if match_str: # Specific（特定の一致）
-                if module_chara == setting["Chara"]: # キャラクターが一致
-                    if is_match(module_value["name"], match_str, setting.get("ModuleExclude")): # マッチング
-                        # Apply setting（設定を適用する）
-                        if setting["Scale"] is not None and str(setting["Scale"]).strip(): # Scaleが設定されているかつ空でない
-                            chara_value = map_chara(module_value["chara"], "module_to_cos_scale") # キャラクター値
-                            cos_value = int(module_value["cos"].replace("COS_", "")) - 1 # COS値
-                            scale_value = setting["Scale"] # Scale値
+    for module_value, setting, match_type in assignments:
+        if setting is None:
+            continue
 
-                            # TOMLエントリを生成
-                            entry = f'[[cos_scale]]\nchara = {chara_value}\ncos = {cos_value}\nscale = {scale_value}\n'
-                            scale_toml_entries.append(entry) # Scale TOMLデータ
-                            logging.debug(f"Scaleを設定 (Specific): Module={module_value['name']}, Scale={scale_value}")
-                        matched = True
-                        break
-        
-        # Second pass: Fallback matches (ModuleNameContains is empty)（一致しない場合）
-        if not matched:
-            for setting in scale_settings: # Scale設定を走査
-                match_str = setting["ModuleNameContains"] # マッチング文字列
-                if not match_str: # Fallback
-                    if module_chara == setting["Chara"]: # キャラクターが一致
-                        # Check excludes manually since is_match returns False for empty match_str（一致しない場合）
-                        exclude_str = setting.get("ModuleExclude") # 除外文字列
-                        is_excluded = False # 除外フラグ
-                        if exclude_str: # 除外文字列が設定されている
-                             excludes = [word.strip() for word in exclude_str.split(',') if word.strip()] # 除外文字列をリストに変換
-                             if any(exc in module_value["name"] for exc in excludes): # 除外文字列が一致
-                                 is_excluded = True # 除外フラグ
-                        
-                        if not is_excluded: # 除外文字列が一致しない場合
-                            # Apply setting（設定を適用する）
-                            if setting["Scale"] is not None and str(setting["Scale"]).strip(): # Scaleが設定されているかつ空でない
-                                chara_value = map_chara(module_value["chara"], "module_to_cos_scale") # キャラクター値
-                                cos_value = int(module_value["cos"].replace("COS_", "")) - 1 # COS値
-                                scale_value = setting["Scale"] # Scale値
+        # Apply setting（設定を適用する）
+        if setting["Scale"] is not None and str(setting["Scale"]).strip(): # Scaleが設定されているかつ空でない
+            chara_value = map_chara(module_value["chara"], "module_to_cos_scale") # キャラクター値
+            cos_value = int(module_value["cos"].replace("COS_", "")) - 1 # COS値
+            scale_value = setting["Scale"] # Scale値
 
-                                entry = f'[[cos_scale]]\nchara = {chara_value}\ncos = {cos_value}\nscale = {scale_value}\n'
-                                scale_toml_entries.append(entry)
-                                logging.debug(f"Scaleを設定 (Fallback): Module={module_value['name']}, Scale={scale_value}")
-                            matched = True
-                            break
-                            
-        if not matched:
-             logging.debug(f"マッチする設定が見つかりませんでした: {module_value['name']}")
+            # TOMLエントリを生成
+            entry = f'[[cos_scale]]\nchara = {chara_value}\ncos = {cos_value}\nscale = {scale_value}\n'
+            scale_toml_entries.append(entry) # Scale TOMLデータ
+            logging.debug("Scaleを設定 (%s): Module=%s, Scale=%s", match_type, module_value['name'], scale_value)
 
     return scale_toml_entries
+
+def generate_scale_toml(module_data, scale_settings, map_chara, matcher=None):
+    """Scale TOMLデータを生成する（matcherを渡した場合はコンパイル済みの設定を使う）"""
+    if matcher is None:
+        matcher = RuleMatcher(scale_settings)
+    return build_scale_entries(resolve_modules(module_data, matcher, map_chara), map_chara)
+
+def scale_entry_key(entry):
+    """Scale TOMLのエントリから(chara, cos)を取り出す（重複判定用）"""
+    values = {}
+    for line in entry.splitlines():
+        if '=' in line:
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip()
+    return values.get('chara'), values.get('cos')
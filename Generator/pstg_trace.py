@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+from datetime import datetime
+
+# 記録したスパン（有効な場合のみ）
+_trace_state = {'enabled': False, 'events': [], 'lock': threading.Lock()}
+
+
+class Span:
+    """計測中のスパン（処理件数などをargsとして追加できる）"""
+
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def set(self, **args):
+        """スパンに件数・バイト数などを追加する"""
+        self.args.update(args)
+
+
+class _NullSpan:
+    """トレースが無効な場合のスパン（何もしない）"""
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable(enabled=True):
+    """トレースを有効にする（ワーカープロセスでも呼び出す）"""
+    _trace_state['enabled'] = enabled
+
+def is_enabled():
+    return _trace_state['enabled']
+
+@contextlib.contextmanager
+def span(name, **args):
+    """
+    処理の区間を計測する（with pstg_trace.span('extract') as s: ... s.set(modules=10)）
+    トレースが無効な場合は何も記録しない
+    """
+    if not _trace_state['enabled']:
+        yield _NULL_SPAN
+        return
+
+    current = Span(name, dict(args))
+    start = time.perf_counter_ns()
+    try:
+        yield current
+    finally:
+        end = time.perf_counter_ns()
+        event = {
+            'name': name,
+            'ph': 'X', # 完了イベント（開始時刻と所要時間）
+            'ts': start / 1000, # マイクロ秒
+            'dur': (end - start) / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': current.args,
+        }
+        with _trace_state['lock']:
+            _trace_state['events'].append(event)
+
+def drain():
+    """記録したイベントを取り出して消去する（ワーカープロセスの結果に含めて親プロセスへ渡す）"""
+    with _trace_state['lock']:
+        events = _trace_state['events']
+        _trace_state['events'] = []
+    return events
+
+def add_events(events):
+    """ワーカープロセスで記録したイベントを取り込む"""
+    if events:
+        with _trace_state['lock']:
+            _trace_state['events'].extend(events)
+
+def summarize(events):
+    """
+    スパン名ごとの合計時間と件数を1行にまとめる
+    例: "archive 12.3ms x2 | extract 4.1ms x2 (modules=8, bytes=2048) | ..."
+    """
+    totals = {} # スパン名 -> [合計時間(us), 回数, {件数の合計}]
+    for event in events:
+        total = totals.setdefault(event['name'], [0.0, 0, {}])
+        total[0] += event['dur']
+        total[1] += 1
+        for key, value in event['args'].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[2][key] = total[2].get(key, 0) + value
+
+    parts = []
+    for name, (duration, count, counters) in totals.items():
+        part = f"{name} {duration / 1000:.1f}ms"
+        if count > 1:
+            part += f" x{count}"
+        if counters:
+            part += " (" + ", ".join(f"{key}={value}" for key, value in counters.items()) + ")"
+        parts.append(part)
+    return " | ".join(parts)
+
+def write_trace(log_dir):
+    """
+    記録したイベントをChromeのトレースイベント形式（chrome://tracing / Perfettoで表示可能）で保存する
+    戻り値: (保存したファイルのパス, 1行のサマリー)。イベントがない場合は(None, '')
+    """
+    events = drain()
+    if not events:
+        return None, ''
+
+    events.sort(key=lambda event: event['ts'])
+    origin = events[0]['ts']
+    for event in events:
+        event['ts'] -= origin # 最初のスパンの開始を0とする
+
+    os.makedirs(log_dir, exist_ok=True)
+    trace_path = os.path.join(log_dir, f"trace_{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    try:
+        with open(trace_path, 'w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file, ensure_ascii=False)
+    except OSError as e:
+        logging.error(f"トレースを保存できませんでした: {e}")
+        trace_path = None
+    return trace_path, summarize(events)
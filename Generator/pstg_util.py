@@ -1,9 +1,19 @@
+import atexit
 import os
+import queue
+import re
 import shutil
 import logging
 import sys
+import contextlib
 import ctypes
-from logging.handlers import RotatingFileHandler
+import functools
+import hashlib
+import multiprocessing
+import tempfile
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime
 
 
@@ -14,10 +24,66 @@ def get_app_dir():
     else:
         return os.path.dirname(os.path.abspath(__file__)) # 実行ファイルのディレクトリ
 
-def get_temp_dir():
-    """Tempディレクトリのパスを取得"""
+# 実行中のTempワークスペース（アーカイブ処理ごとに作成される。サービス・監視モードで並行して処理できるようスレッドごとに持つ）
+_workspace_local = threading.local()
+
+# バックグラウンドで実行中のTemp削除のスレッド
+_cleanup_state = {'threads': [], 'lock': threading.Lock()}
+
+# この時間以上前に作成されたワークスペースは異常終了時の残骸として削除する
+STALE_WORKSPACE_SECONDS = 24 * 60 * 60
+
+def get_temp_root(location='app'):
+    """
+    Tempワークスペースの親ディレクトリを取得
+    location: 'app'（実行ファイルのTempフォルダ） / 'ram'（/dev/shm、なければOSの一時フォルダ） / 'system'（OSの一時フォルダ、Windowsでは%TEMP%）
+    """
+    if location == 'ram':
+        if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            return os.path.join('/dev/shm', 'PoseScaleTomlGenerator')
+        location = 'system'
+    if location == 'system':
+        return os.path.join(tempfile.gettempdir(), 'PoseScaleTomlGenerator')
     return os.path.join(get_app_dir(), 'Temp') # Tempディレクトリ
 
+def create_workspace(location='app'):
+    """実行ごとに独立したTempワークスペースを作成し、現在のワークスペースとして設定する"""
+    temp_root = get_temp_root(location)
+    if location == 'app':
+        make_hidden_folder(temp_root) # Tempフォルダの作成 + 隠し属性設定
+    else:
+        os.makedirs(temp_root, exist_ok=True)
+
+    workspace = tempfile.mkdtemp(prefix=f'run_{os.getpid()}_', dir=temp_root) # 他の実行と衝突しない名前
+    _workspace_local.current = workspace
+    logging.info(f"Tempワークスペースを作成しました: {workspace}")
+    return workspace
+
+def current_workspace():
+    """このスレッドで有効なTempワークスペースのパス（temp_workspaceの外ではNone）"""
+    return getattr(_workspace_local, 'current', None)
+
+def get_temp_dir():
+    """現在のTempワークスペースのパスを取得（temp_workspaceの外で呼び出された場合はRuntimeError）"""
+    workspace = current_workspace()
+    if workspace is None:
+        raise RuntimeError("Tempワークスペースが作成されていません（temp_workspaceの中で呼び出してください）")
+    return workspace
+
+@contextlib.contextmanager
+def temp_workspace(location='app', delete=True):
+    """処理の間だけ有効なTempワークスペース（終了後はバックグラウンドで削除する）"""
+    previous = current_workspace()
+    workspace = create_workspace(location)
+    try:
+        yield workspace
+    finally:
+        _workspace_local.current = previous
+        if delete:
+            schedule_temp_cleanup(workspace)
+        else:
+            logging.info(f"デバッグ設定によりTempワークスペースの削除をスキップしました: {workspace}")
+
 def make_hidden_folder(path):
     """
     フォルダを作成し、Windows環境では隠し属性を設定
@@ -36,16 +102,33 @@ def make_hidden_folder(path):
             # 失敗しても処理続行（隠し属性が必須ではないため）
             pass
 
+def get_log_dir():
+    """ログディレクトリのパスを取得"""
+    return os.path.join(get_app_dir(), 'logs')
+
+# ファイル出力用のバックグラウンドのリスナー（ファイルへの書き込みは別スレッドで行う）
+_log_state = {'listener': None}
+
+def stop_file_logging():
+    """ファイル出力のリスナーを停止する（キューに残ったログを書き込んでから終了する）"""
+    listener = _log_state['listener']
+    _log_state['listener'] = None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
 def setup_logging(show_debug=False, output_log=False):
-    """ログの初期化"""
+    """
+    ログの初期化
+    ロガーのレベルは出力先が必要とする最も低いレベルにする（出力されないログはメッセージを組み立てる前に破棄される）
+    ファイル出力はキューを経由して別スレッドで書き込む
+    """
     logger = logging.getLogger() # ロガー
-    logger.setLevel(logging.DEBUG) # ログレベル
 
     if logger.hasHandlers(): # ハンドラーが設定されている場合
         logger.handlers.clear()
-
-    app_dir = get_app_dir()  # 実行ファイルのディレクトリ
-    log_dir = os.path.join(app_dir, 'logs')  # ログディレクトリ
+    stop_file_logging()
 
     # show_debug=Trueの時だけコンソール出力
     if show_debug:
@@ -57,16 +140,10 @@ def setup_logging(show_debug=False, output_log=False):
     else:
         # show_debug=Falseの時はNullHandler（すべてのログメッセージを無視する特殊なハンドラー）で出力を完全に抑制
         logger.addHandler(logging.NullHandler())    # Pythonのloggingモジュールが勝手に「lastResort」ハンドラーを使うのでその対策
-        # デバッグモードがOFFの時、logsフォルダが存在すれば削除する
-        if os.path.exists(log_dir):
-            try:
-                shutil.rmtree(log_dir, ignore_errors=True)
-                logging.info(f"Cleaned up logs directory: {log_dir}") # NullHandler行きになるが念のため
-            except Exception:
-                pass  
 
     # output_log=Trueの時だけファイル出力
     if output_log:
+        log_dir = get_log_dir()  # ログディレクトリ
         file_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
 
         os.makedirs(log_dir, exist_ok=True)  # ログディレクトリを作成
@@ -81,7 +158,6 @@ def setup_logging(show_debug=False, output_log=False):
         ) # ログハンドラー
         file_handler.setLevel(logging.INFO) # ファイルログレベル
         file_handler.setFormatter(file_formatter) # ファイルフォーマッター
-        logger.addHandler(file_handler) # ファイルハンドラーを追加
 
         debug_log_file = os.path.join(log_dir, 'debug_data.log') # デバッグログファイル
         debug_handler = RotatingFileHandler(
@@ -93,39 +169,195 @@ def setup_logging(show_debug=False, output_log=False):
         debug_handler.setLevel(logging.DEBUG) # デバッグログレベル
         debug_handler.setFormatter(file_formatter) # デバッグフォーマッター
         debug_handler.addFilter(lambda record: record.levelno == logging.DEBUG) # デバッグフィルター
-        logger.addHandler(debug_handler) # デバッグハンドラーを追加
-      
 
-def clean_temp_dir():
-    """Tempディレクトリを削除"""
-    temp_dir = get_temp_dir() # Tempディレクトリ
-    if os.path.exists(temp_dir): # Tempディレクトリが存在する場合
+        # ファイルへの書き込みはリスナーのスレッドで行う
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, file_handler, debug_handler, respect_handler_level=True)
+        listener.start()
+        _log_state['listener'] = listener
+        logger.addHandler(QueueHandler(log_queue)) # ファイルハンドラーの代わりにキューへ送る
+
+    # ログレベル（ファイル出力はDEBUG、コンソールのみはINFO、出力しない場合は警告以上のみ）
+    if output_log:
+        logger.setLevel(logging.DEBUG)
+    elif show_debug:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.WARNING)
+
+atexit.register(stop_file_logging)
+
+def start_log_listener():
+    """
+    ワーカープロセスのログをメインプロセスのハンドラーへ転送するリスナーを開始する
+    ログ出力が無効（NullHandlerのみ）の場合は(None, None)を返す
+    """
+    logger = logging.getLogger()
+    handlers = [h for h in logger.handlers if not isinstance(h, logging.NullHandler)]
+    if not handlers:
+        return None, None
+
+    log_queue = multiprocessing.Queue() # プロセス間で共有するログキュー
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+def setup_worker_logging(log_queue, level=logging.WARNING):
+    """
+    ワーカープロセスのログ初期化（メインプロセスのリスナーへ転送する）
+    level: メインプロセスのロガーのレベル（出力されないログはワーカー側で破棄する）
+    """
+    logger = logging.getLogger()
+    if logger.hasHandlers():
+        logger.handlers.clear()
+
+    logger.setLevel(level)
+    if log_queue is None:
+        logger.addHandler(logging.NullHandler())
+        return
+
+    logger.addHandler(QueueHandler(log_queue))
+
+def clean_temp_dir(temp_dir=None):
+    """Tempワークスペースを削除（省略時は現在のワークスペース）"""
+    if temp_dir is None:
+        temp_dir = current_workspace()
+    if temp_dir and os.path.exists(temp_dir): # Tempディレクトリが存在する場合
         try:
             shutil.rmtree(temp_dir, ignore_errors=True)
             logging.info(f"Tempディレクトリを削除しました: {temp_dir}")
         except Exception as e:
             logging.warning(f"Tempディレクトリの削除に失敗しました (無視します): {e}")
 
-def save_file_with_timestamp(file_path, data, overwrite=False):
-    """タイムスタンプ付きでファイルを保存 (overwrite=Trueの場合は上書き)"""
-    if os.path.exists(file_path) and not overwrite: # 既存のファイルが存在する場合
+def schedule_temp_cleanup(temp_dir):
+    """Tempワークスペースの削除をバックグラウンドで行う（プロセス終了時には完了を待つ）"""
+    thread = threading.Thread(target=clean_temp_dir, args=(temp_dir,), name='TempCleanup')
+    thread.start()
+    with _cleanup_state['lock']:
+        _cleanup_state['threads'].append(thread)
+
+def wait_for_temp_cleanup(timeout=None):
+    """バックグラウンドで実行中のTemp削除の完了を待つ"""
+    with _cleanup_state['lock']:
+        threads = list(_cleanup_state['threads'])
+    for thread in threads:
+        thread.join(timeout)
+    with _cleanup_state['lock']:
+        _cleanup_state['threads'] = [t for t in _cleanup_state['threads'] if t.is_alive()]
+
+def sweep_stale_workspaces(location='app'):
+    """異常終了などで残った古いTempワークスペースをバックグラウンドで削除する"""
+    temp_root = get_temp_root(location)
+
+    def sweep():
+        try:
+            entries = os.listdir(temp_root)
+        except OSError:
+            return
+        now = time.time()
+        for name in entries:
+            path = os.path.join(temp_root, name)
+            try:
+                if name.startswith('run_') and now - os.path.getmtime(path) > STALE_WORKSPACE_SECONDS:
+                    clean_temp_dir(path)
+            except OSError:
+                pass
+
+    threading.Thread(target=sweep, name='TempSweep', daemon=True).start()
+
+# 出力ファイルごとに残すタイムスタンプ付きバックアップの数（0は無制限）
+DEFAULT_BACKUP_LIMIT = 10
+
+# 既存のファイルと比較する際に1回に読み込むバイト数
+COMPARE_CHUNK_SIZE = 64 * 1024
+
+def _encode_text(data):
+    """テキストモードで保存した場合と同じバイト列にする（改行はOSの改行コード）"""
+    if os.linesep != '\n':
+        data = data.replace('\n', os.linesep)
+    return data.encode('utf-8')
+
+def _file_has_content(file_path, content):
+    """既存のファイルの内容がcontentと同じか（サイズを比較してから、ハッシュで比較する）"""
+    try:
+        if os.path.getsize(file_path) != len(content):
+            return False
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as existing_file:
+            for chunk in iter(lambda: existing_file.read(COMPARE_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except OSError:
+        return False
+    return digest.digest() == hashlib.sha256(content).digest()
+
+def list_backups(file_path):
+    """save_file_with_timestampが作成したバックアップ（ファイル名_YYYYMMDDHHMMSS.拡張子）を古い順に返す"""
+    directory = os.path.dirname(file_path) or '.'
+    base, ext = os.path.splitext(os.path.basename(file_path))
+    pattern = re.compile(re.escape(base) + r'_\d{14}' + re.escape(ext) + '$')
+    try:
+        names = sorted(name for name in os.listdir(directory) if pattern.match(name))
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in names]
+
+def prune_backups(file_path, backup_limit=DEFAULT_BACKUP_LIMIT):
+    """バックアップが上限を超えた場合、古いものから削除する"""
+    if not backup_limit or backup_limit < 0:
+        return
+    for backup_path in list_backups(file_path)[:-backup_limit]:
+        try:
+            os.remove(backup_path)
+            logging.info(f"古いバックアップを削除しました: {backup_path}")
+        except OSError as e:
+            logging.warning(f"バックアップの削除に失敗しました: {e}")
+
+def save_file_with_timestamp(file_path, data, overwrite=False, backup_limit=DEFAULT_BACKUP_LIMIT):
+    """
+    タイムスタンプ付きでファイルを保存 (overwrite=Trueの場合は上書き)
+    既存のファイルと内容が同じ場合は何もしない（バックアップも作成しない）
+    一時ファイルに書き込んでから置き換えるため、保存途中のファイルが読まれることはない
+    戻り値: ファイルを書き込んだ場合True
+    """
+    content = _encode_text(data)
+    exists = os.path.exists(file_path)
+    if exists and _file_has_content(file_path, content):
+        logging.info(f"内容が変わらないため保存をスキップしました: {file_path}")
+        return False
+
+    if exists and not overwrite: # 既存のファイルが存在する場合
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S") # タイムスタンプ
         base, ext = os.path.splitext(file_path) # ファイル名と拡張子
-        rename_path = f"{base}_{timestamp}{ext}" # リネーム後のファイル名
+        backup_path = f"{base}_{timestamp}{ext}" # バックアップのファイル名
         try:
-            os.rename(file_path, rename_path)
-            logging.info(f"既存のファイルをリネームしました: {rename_path}")
+            shutil.copy2(file_path, backup_path) # 置き換えるまで元のファイルを残す
+            logging.info(f"既存のファイルをバックアップしました: {backup_path}")
         except OSError as e:
-            logging.error(f"ファイルのリネームに失敗しました: {e}")
-    elif os.path.exists(file_path) and overwrite: # 既存のファイルが存在する場合
+            logging.error(f"ファイルのバックアップに失敗しました: {e}")
+        prune_backups(file_path, backup_limit)
+    elif exists and overwrite: # 既存のファイルが存在する場合
         logging.info(f"既存のファイルを上書きします: {file_path}")
 
-    try: # ファイルを保存
-        with open(file_path, 'w', encoding='utf-8') as save_file:
-            save_file.write(data)
+    temp_path = None
+    try: # 一時ファイルに保存してから置き換える
+        temp_path = f"{file_path}.{os.getpid()}_{threading.get_ident()}.tmp" # 同じフォルダに作成（os.replaceを使うため）
+        with open(temp_path, 'wb') as save_file:
+            save_file.write(content)
+        if exists:
+            shutil.copymode(file_path, temp_path) # 既存のファイルの権限を引き継ぐ
+        os.replace(temp_path, file_path)
+        temp_path = None
         logging.info(f'ファイルを保存しました {file_path}')
+        return True
     except OSError as e: # ファイルの保存に失敗しました
         logging.error(f"ファイルの保存に失敗しました: {e}")
+        return False
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
 
 def load_chara_mapping():
     """キャラクター名のマッピング関数を返す"""
@@ -172,10 +404,10 @@ def is_match(name, contains_str, exclude_str=None):
 
     # 文字化け対策
     if '\ufffd' in includes:
-        logging.warning(f"設定 {contains_str} に無効な文字が含まれているため、そのキーワードは無視します。")
+        logging.warning("設定 %s に無効な文字が含まれているため、そのキーワードは無視します。", contains_str)
         includes = [i for i in includes if i != '\ufffd']
 
-    logging.debug(f"Checking Module: {name} against Includes: {includes}, Excludes: {excludes}")
+    logging.debug("Checking Module: %s against Includes: %s, Excludes: %s", name, includes, excludes) # 出力しない場合は組み立てない
 
     # Exclude check (if ANY exclude word is found, return False)（ANDマッチ）
     if any(exc in name for exc in excludes):
@@ -185,8 +417,9 @@ def is_match(name, contains_str, exclude_str=None):
     return any(inc in name for inc in includes)
 
 
+@functools.lru_cache(maxsize=None)
 def get_app_version():
-    """EXEのバージョンリソースを取得する（開発環境はversion.txt）"""
+    """EXEのバージョンリソースを取得する（開発環境はversion.txt、結果はプロセス内で再利用する）"""
     
     # 1. 凍結アプリ(EXE)の場合: ctypesで自分自身のバージョンリソースを読む
     if getattr(sys, 'frozen', False):
@@ -250,5 +483,9 @@ def get_app_version():
 
     return "v0.0.0-dev"
 
-VERSION = get_app_version()
+def __getattr__(name):
+    """VERSIONは最初に参照されたときに取得する（インポート時にバージョンリソースを読まないように）"""
+    if name == 'VERSION':
+        return get_app_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+from pstg_loader import get_pose_data_dir
+
+# 変更を確認する間隔（秒）
+DEFAULT_INTERVAL = 0.5
+
+# ファイルの更新が落ち着くまで待つ時間（秒）。保存途中のFARCを読まないように
+DEFAULT_DEBOUNCE = 0.3
+
+
+def _stat_signature(path):
+    """ファイルの変更判定用の(更新日時, サイズ)を返す（存在しない場合はNone）"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _scan_archives(directory):
+    """フォルダ内の全てのFARCファイルの(更新日時, サイズ)を返す"""
+    archives = {}
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            if file_name.lower().endswith('.farc'):
+                path = os.path.join(root, file_name)
+                signature = _stat_signature(path)
+                if signature is not None:
+                    archives[path] = signature
+    return archives
+
+def _scan_settings(app_config):
+    """出力に影響する設定ファイル（Config.ini / TomlProfile.ini / PoseScaleDataのINI）の(更新日時, サイズ)を返す"""
+    settings = {}
+    for path in app_config.get('ConfigFiles', []):
+        settings[path] = _stat_signature(path)
+    pose_data_dir = get_pose_data_dir(app_config)
+    if os.path.isdir(pose_data_dir):
+        for file_name in os.listdir(pose_data_dir):
+            if file_name.lower().endswith('.ini'):
+                path = os.path.join(pose_data_dir, file_name)
+                settings[path] = _stat_signature(path)
+    return settings
+
+
+class ChangeIndex:
+    """
+    監視対象のFARCと設定ファイルの状態、アーカイブごとに読み込んだ設定ファイルを記録する
+    前回の状態と比較して、再生成が必要なアーカイブを返す
+    """
+
+    def __init__(self):
+        self.archives = {} # FARCのパス -> (更新日時, サイズ)
+        self.settings = {} # 設定ファイルのパス -> (更新日時, サイズ)
+        self.used_settings = {} # FARCのパス -> 読み込んだ設定ファイルのパスの集合
+
+    def record_results(self, results):
+        """処理結果から、アーカイブごとに読み込んだ設定ファイルを記録する"""
+        for result in results:
+            self.used_settings[result['file']] = {os.path.normcase(path) for path in result.get('settings_files', [])}
+
+    def changed_archives(self, archives):
+        """追加・更新されたFARCのリスト（削除されたものは記録から除く）"""
+        changed = [path for path, signature in archives.items() if self.archives.get(path) != signature]
+        for path in set(self.archives) - set(archives):
+            self.used_settings.pop(path, None)
+        self.archives = archives
+        return changed
+
+    def archives_affected_by(self, settings, config_files):
+        """
+        設定ファイルの変更により再生成が必要なFARCのリスト
+        Config.ini / TomlProfile.iniの変更やINIの追加・削除はプロファイルの選択が変わる可能性があるため全て対象とする
+        戻り値: (対象のFARCのリスト, 設定の再読み込みが必要か)
+        """
+        changed = {path for path in set(settings) | set(self.settings) if settings.get(path) != self.settings.get(path)}
+        added_or_removed = set(settings) ^ set(self.settings)
+        self.settings = settings
+        if not changed:
+            return [], False
+
+        logging.info(f"設定ファイルの変更を検出しました: {sorted(changed)}")
+        config_files = {os.path.normcase(path) for path in config_files}
+        changed_norm = {os.path.normcase(path) for path in changed}
+        if added_or_removed or changed_norm & config_files:
+            return list(self.archives), True
+
+        affected = [path for path in self.archives
+                    if path not in self.used_settings or self.used_settings[path] & changed_norm]
+        return affected, False
+
+
+def watch_directory(directory, app_config, reload_config, process, interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE):
+    """
+    フォルダ内のFARCと設定ファイルを監視し、変更があったアーカイブのTOMLのみ再生成する（Ctrl+Cで終了）
+    reload_config: 設定を読み直してapp_configを返す関数
+    process: (FARCのリスト, app_config)を受け取り処理結果のリストを返す関数
+    """
+    index = ChangeIndex()
+    index.settings = _scan_settings(app_config)
+    index.changed_archives(_scan_archives(directory))
+
+    # 起動時は全てのアーカイブを生成して、読み込んだ設定ファイルを記録する
+    if index.archives:
+        index.record_results(process(sorted(index.archives), app_config))
+    print(f"Watching {directory} for changes (Ctrl+C to stop)")
+    logging.info(f"フォルダの監視を開始します: {directory}")
+
+    pending = set() # 再生成を待っているFARC
+    last_change = 0.0 # 最後に変更を検出した時刻
+    try:
+        while True:
+            time.sleep(interval)
+
+            targets, reload_needed = index.archives_affected_by(_scan_settings(app_config), app_config.get('ConfigFiles', []))
+            if reload_needed:
+                app_config = reload_config() or app_config
+            changed = index.changed_archives(_scan_archives(directory))
+            if targets or changed:
+                pending.update(targets)
+                pending.update(changed)
+                last_change = time.monotonic()
+                continue # 更新が続いている間は待つ
+
+            # 一定時間変更がなければまとめて再生成する
+            if pending and time.monotonic() - last_change >= debounce:
+                paths = sorted(path for path in pending if path in index.archives)
+                pending.clear()
+                if paths:
+                    logging.info(f"変更されたアーカイブを再生成します: {paths}")
+                    index.record_results(process(paths, app_config))
+    except KeyboardInterrupt:
+        logging.info("フォルダの監視を終了します")
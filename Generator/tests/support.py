@@ -0,0 +1,106 @@
+import os
+import sys
+import gzip
+import struct
+
+# Generatorフォルダのpstg_*モジュールを読み込めるようにする
+GENERATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if GENERATOR_DIR not in sys.path:
+    sys.path.insert(0, GENERATOR_DIR)
+
+from pstg_aes import _SBOX, _expand_key, _xtime
+from pstg_farc import FARC_KEY_DT, FARC_KEY_FT
+
+
+def encrypt_block(key, block):
+    """AES-128で16バイトのブロックを1つ暗号化する（テストデータ作成用）"""
+    rk = _expand_key(bytes(key))
+    s = [block[i] ^ rk[0][i] for i in range(16)]
+    for rnd in range(1, 11):
+        # SubBytes + ShiftRows（状態は列優先で並んでいる）
+        s = [_SBOX[s[((i // 4 + i % 4) % 4) * 4 + i % 4]] for i in range(16)]
+        # MixColumns（最終ラウンドは省略）
+        if rnd < 10:
+            mixed = []
+            for c in range(0, 16, 4):
+                a0, a1, a2, a3 = s[c:c + 4]
+                mixed += [
+                    _xtime(a0) ^ _xtime(a1) ^ a1 ^ a2 ^ a3,
+                    a0 ^ _xtime(a1) ^ _xtime(a2) ^ a2 ^ a3,
+                    a0 ^ a1 ^ _xtime(a2) ^ _xtime(a3) ^ a3,
+                    _xtime(a0) ^ a0 ^ a1 ^ a2 ^ _xtime(a3),
+                ]
+            s = mixed
+        s = [s[i] ^ rk[rnd][i] for i in range(16)]
+    return bytes(s)
+
+def encrypt_ecb(key, data):
+    return b''.join(encrypt_block(key, data[i:i + 16]) for i in range(0, len(data), 16))
+
+def encrypt_cbc(key, iv, data):
+    out = []
+    prev = bytes(iv)
+    for i in range(0, len(data), 16):
+        prev = encrypt_block(key, bytes(p ^ q for p, q in zip(data[i:i + 16], prev)))
+        out.append(prev)
+    return b''.join(out)
+
+def _pad16(data):
+    return data + b'\x00' * (-len(data) % 16)
+
+def build_farc(files, fmt='FArc', ft_flag=1):
+    """
+    {エントリ名: データ}からFARCのバイト列を作る
+    fmt: 'FArc'（無圧縮） / 'FArC'（gzip圧縮） / 'FARC'（DT系: ECB暗号化+圧縮） / 'FARC-FT'（FT系: CBC暗号化ヘッダー）
+    ft_flag: FT系のヘッダーのフラグ（1: エントリごとにフラグを持つ / 0: ヘッダーのフラグを使う）
+    """
+    names = list(files)
+    if fmt in ('FArc', 'FArC'):
+        per_entry = 8 if fmt == 'FArc' else 12
+        header_size = 4 + sum(len(name.encode()) + 1 + per_entry for name in names)
+        table, body = b'', b''
+        for name in names:
+            stored = gzip.compress(files[name]) if fmt == 'FArC' else files[name]
+            offset = 8 + header_size + len(body)
+            sizes = (offset, len(files[name])) if fmt == 'FArc' else (offset, len(stored), len(files[name]))
+            table += name.encode() + b'\x00' + struct.pack(f'>{len(sizes)}I', *sizes)
+            body += stored
+        return fmt.encode() + struct.pack('>II', header_size, 1) + table + body
+
+    if fmt == 'FARC':
+        header_size = 12 + sum(len(name.encode()) + 1 + 12 for name in names)
+        data_start = (8 + header_size + 15) // 16 * 16
+        table, body = b'', b''
+        for name in names:
+            compressed = gzip.compress(files[name])
+            table += name.encode() + b'\x00' + struct.pack('>III', data_start + len(body), len(compressed), len(files[name]))
+            body += encrypt_ecb(FARC_KEY_DT, _pad16(compressed))
+        head = b'FARC' + struct.pack('>IIII', header_size, 6, 0, 16) + table
+        return head + b'\x00' * (data_start - len(head)) + body
+
+    if fmt == 'FARC-FT':
+        iv = bytes(range(3, 19))
+        stored_entries = []
+        for index, name in enumerate(names):
+            entry_iv = bytes((index * 16 + i) & 0xff for i in range(16))
+            stored_entries.append(entry_iv + encrypt_cbc(FARC_KEY_FT, entry_iv, _pad16(gzip.compress(files[name]))))
+        per_entry = 16 if ft_flag == 1 else 12
+        table_size = (16 if ft_flag == 1 else 12) + sum(len(name.encode()) + 1 + per_entry for name in names)
+        header_end = 0x20 + (table_size + 15) // 16 * 16
+        table = struct.pack('>III', 1, ft_flag, len(names)) + (b'\x00' * 4 if ft_flag == 1 else b'')
+        body = b''
+        for name, stored in zip(names, stored_entries):
+            table += name.encode() + b'\x00' + struct.pack('>III', header_end + len(body), len(stored), len(files[name]))
+            if ft_flag == 1:
+                table += struct.pack('>I', 6)
+            body += stored
+        # アライメントの位置にIVが入る（IVの先頭4バイトが2の累乗でないためFT系と判定される）
+        return b'FARC' + struct.pack('>III', header_end - 8, 6, 0) + iv + encrypt_cbc(FARC_KEY_FT, iv, _pad16(table)) + body
+
+    raise ValueError(f"unknown format: {fmt}")
+
+def write_farc(path, files, fmt='FArc', ft_flag=1):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as farc_file:
+        farc_file.write(build_farc(files, fmt, ft_flag))
+    return path
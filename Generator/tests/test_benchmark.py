@@ -0,0 +1,46 @@
+import unittest
+
+import support
+from benchmark import bench, equivalence
+
+
+def make_results(**medians):
+    return {'cases': {'100x20': {'timings': {name: {'median': median, 'min': median} for name, median in medians.items()}}}}
+
+
+class CompareTest(unittest.TestCase):
+    def test_regressions(self):
+        baseline = make_results(process_data=0.010, generate_pose_toml=0.0010, generate_scale_toml=0.010)
+        results = make_results(process_data=0.020, generate_pose_toml=0.0020, generate_scale_toml=0.011)
+        # 倍率が閾値を超えても、差がMIN_DELTA未満なら誤差とみなす
+        self.assertEqual(bench.compare(results, baseline), [('100x20', 'process_data', 0.010, 0.020, 2.0)])
+        self.assertEqual(bench.compare(results, baseline, threshold=3.0), [])
+
+    def test_missing_cases_are_skipped(self):
+        self.assertEqual(bench.compare(make_results(process_data=1.0), {'cases': {}}), [])
+        self.assertEqual(bench.compare(make_results(process_data=1.0), make_results(generate_pose_toml=0.1)), [])
+
+    def test_run_case(self):
+        case = bench.run_case(20, 5, repeat=1)
+        self.assertEqual(set(case['timings']), set(bench.BENCHMARKS))
+        self.assertEqual(case['modules'], 20)
+
+
+class EquivalenceTest(unittest.TestCase):
+    def test_engines_match_reference(self):
+        for name, engine in equivalence.ENGINES.items():
+            with self.subTest(engine=name):
+                self.assertIsNone(equivalence.check_engine(name, engine, cases=100, seed=1)['failure'])
+
+    def test_difference_is_shrunk(self):
+        make_case, reference, select_profiles = equivalence.ENGINES['profile_select']
+        broken = (make_case, reference, lambda *case: select_profiles(*case)[1:])
+        failure = equivalence.check_engine('broken', broken, cases=100, seed=1)['failure']
+        modules, profiles = failure['inputs']
+        # 1つ目のプロファイルが一致するのに必要な最小限のモジュール・プロファイルまで取り除かれる
+        self.assertEqual((len(modules), len(profiles)), (1, 1))
+        self.assertEqual((failure['expected'], failure['actual']), (['TomlProfile_0'], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+import pstg_cache
+import pstg_config
+import pstg_main
+import pstg_util
+from benchmark import synth
+
+CONFIG = "[GeneralSettings]\nDefaultPoseFileName = pose_data\nTempLocation = system\nOverwriteExistingFiles = true\n"
+
+
+class ProcessArchiveTestCase(unittest.TestCase):
+    """アプリのフォルダ（Settings / Cache）を一時フォルダに作り、process_archiveを実行するテストの基底クラス"""
+
+    def setUp(self):
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        self.app_dir = work.name
+        cache_dir = os.path.join(self.app_dir, 'Cache')
+        for patcher in (mock.patch.object(pstg_config, 'get_app_dir', lambda: self.app_dir),
+                        mock.patch.object(pstg_cache, 'get_cache_dir', lambda: cache_dir),
+                        mock.patch.object(pstg_cache, '_settings_cache', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(pstg_util.wait_for_temp_cleanup)
+
+        self.modules = synth.make_modules(40)
+        self.write_config(CONFIG)
+        synth.write_pose_scale_ini(os.path.join(self.app_dir, 'Settings', 'PoseScaleData', 'PoseScaleData.ini'), synth.make_rules(10))
+        self.archive = self.write_archive(self.modules)
+
+    def write_config(self, text):
+        os.makedirs(os.path.join(self.app_dir, 'Settings'), exist_ok=True)
+        with open(os.path.join(self.app_dir, 'Settings', 'Config.ini'), 'w', encoding='utf-8') as config_file:
+            config_file.write(text)
+
+    def write_archive(self, modules):
+        data = synth.module_table_text(modules).encode('utf-8')
+        return support.write_farc(os.path.join(self.app_dir, 'mods', 'ModA', 'rom', 'mod_gm_module_tbl.farc'), {'mod_gm_module_tbl.bin': data}, 'FArC')
+
+    def process(self, path=None, **overrides):
+        app_config = pstg_config.load_app_config()
+        app_config.update(overrides)
+        return pstg_main.process_archive(path or self.archive, app_config, pstg_util.load_chara_mapping())
+
+
+class ResultCacheTest(ProcessArchiveTestCase):
+    def test_hit_miss_and_config_change(self):
+        first = self.process()
+        self.assertEqual((first['status'], first['result_cache']), ('ok', 'miss'))
+        second = self.process()
+        self.assertEqual((second['status'], second['result_cache']), ('ok', 'hit'))
+        self.assertEqual(second['pose_entries'], first['pose_entries'])
+
+        # Config.iniの変更は設定のフィンガープリントを変えるため、前回の出力を使わない
+        self.write_config(CONFIG + "BackupLimit = 3\n")
+        self.assertEqual(self.process()['result_cache'], 'miss')
+        self.assertEqual(self.process()['result_cache'], 'hit')
+
+    def test_archive_change_is_a_miss(self):
+        self.assertEqual(self.process()['result_cache'], 'miss')
+        self.write_archive(self.modules[:-1])
+        result = self.process()
+        self.assertEqual((result['result_cache'], result['modules']), ('miss', len(self.modules) - 1))
+
+
+class ExtractCacheTest(ProcessArchiveTestCase):
+    def test_hit_miss_and_invalidation(self):
+        first = self.process(UseResultCache=False)
+        self.assertEqual((first['status'], first['extract_cache']), ('ok', 'miss'))
+        self.assertEqual(self.process(UseResultCache=False)['extract_cache'], 'hit')
+
+        # Config.iniの変更は抽出結果に影響しないため、抽出キャッシュはそのまま使う
+        self.write_config(CONFIG + "BackupLimit = 3\n")
+        self.assertEqual(self.process(UseResultCache=False)['extract_cache'], 'hit')
+
+        # アーカイブの内容が変わった場合は抽出し直す
+        self.write_archive(self.modules[:-1])
+        result = self.process(UseResultCache=False)
+        self.assertEqual((result['extract_cache'], result['modules']), ('miss', len(self.modules) - 1))
+
+    def test_key_includes_archive_name(self):
+        self.process(UseResultCache=False)
+        # 同じ内容でも名前が異なれば抽出するエントリが変わり得るため、別のキャッシュになる
+        renamed = os.path.join(os.path.dirname(self.archive), 'other_gm_module_tbl.farc')
+        with open(self.archive, 'rb') as source, open(renamed, 'wb') as target:
+            target.write(source.read())
+        self.assertEqual(self.process(renamed, UseResultCache=False)['extract_cache'], 'miss')
+
+    def test_raw_folder_without_result_cache(self):
+        # 解凍済みのフォルダは抽出キャッシュを使わないため、アーカイブのハッシュも計算しない
+        mod_dir = os.path.join(self.app_dir, 'mods', 'ModB', 'rom')
+        synth.write_module_table(mod_dir, self.modules)
+        result = self.process(os.path.join(mod_dir, 'gm_module_tbl'), UseResultCache=False)
+        self.assertEqual((result['status'], result['modules'], result['extract_cache']), ('ok', len(self.modules), None))
+
+
+class UpdateExistingTest(ProcessArchiveTestCase):
+    def test_removed_modules_are_removed_from_existing_toml(self):
+        first = self.process(UpdateExistingFiles=True)
+        pose_path = [path for path in first['saved_files'] if not path.endswith('scale_db.toml')][0]
+        with open(pose_path, 'r+', encoding='utf-8') as toml_file:
+            removed_id = toml_file.readline().split('=')[0].strip()
+            toml_file.seek(0, os.SEEK_END)
+            toml_file.write('\n99999 = 1 # 手動で追加\n')
+
+        # アーカイブから削除されたモジュールの行は削除し、手動で追加した行は残す
+        self.write_archive([module for module in self.modules if module['id'] != removed_id])
+        second = self.process(UpdateExistingFiles=True)
+        with open(pose_path, encoding='utf-8') as toml_file:
+            keys = [line.split('=')[0].strip() for line in toml_file if '=' in line]
+        self.assertEqual(second['pose_entries'], first['pose_entries'] - 1)
+        self.assertEqual(len(keys), second['pose_entries'] + 1)
+        self.assertNotIn(removed_id, keys)
+        self.assertIn('99999', keys)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import support
+import pstg_coalesce
+import pstg_config
+import pstg_ipc
+
+
+class CoalescePathsTest(unittest.TestCase):
+    def setUp(self):
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        self.work = work.name
+        patcher = mock.patch.object(pstg_ipc, 'get_app_dir', lambda: self.work)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def path(self, name):
+        return os.path.join(self.work, name)
+
+    def test_zero_window_returns_paths(self):
+        self.assertEqual(pstg_coalesce.coalesce_paths(['{' + self.path('a.farc') + '}'], 0), [self.path('a.farc')])
+        self.assertFalse(os.path.exists(pstg_coalesce._lock_path())) # 無効の場合はロックも取得しない
+
+    def test_second_process_hands_off_to_coordinator(self):
+        result = {}
+        coordinator = threading.Thread(target=lambda: result.update(paths=pstg_coalesce.coalesce_paths([self.path('a.farc')], 0.5)))
+        coordinator.start()
+        self.addCleanup(coordinator.join, 15)
+        for _ in range(200): # 取りまとめ役が待ち受けを始めるまで待つ
+            if pstg_ipc.read_endpoint(pstg_coalesce.COORDINATOR_ENDPOINT):
+                break
+            time.sleep(0.01)
+
+        # ロックが取得されているため、後から起動したプロセスはパスを転送して終了する
+        self.assertIsNone(pstg_coalesce.coalesce_paths([self.path('b.farc'), self.path('a.farc')], 0.5))
+        coordinator.join(15)
+        self.assertEqual(result['paths'], [self.path('a.farc'), self.path('b.farc')])
+        # 取りまとめ役はロックと接続先ファイルを削除して終了する
+        self.assertFalse(os.path.exists(pstg_coalesce._lock_path()))
+        self.assertIsNone(pstg_ipc.read_endpoint(pstg_coalesce.COORDINATOR_ENDPOINT))
+
+    def test_stale_lock_is_replaced(self):
+        lock_path = pstg_coalesce._lock_path()
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            lock_file.write('0')
+        stale = time.time() - pstg_coalesce.STALE_LOCK_SECONDS - 1
+        os.utime(lock_path, (stale, stale))
+        self.assertEqual(pstg_coalesce.coalesce_paths([self.path('a.farc')], 0.1), [self.path('a.farc')])
+        self.assertFalse(os.path.exists(lock_path))
+
+    def test_unreachable_coordinator_processes_locally(self):
+        # ロックはあるが取りまとめ役が応答しない場合は、待ち時間の後このプロセスで処理する
+        self.assertTrue(pstg_coalesce._try_lock())
+        self.addCleanup(pstg_coalesce._release_lock)
+        with mock.patch.object(pstg_coalesce, 'LOCK_WAIT_SECONDS', 0.2):
+            self.assertEqual(pstg_coalesce.coalesce_paths([self.path('a.farc')], 0.5), [self.path('a.farc')])
+
+
+class CoalesceWindowTest(unittest.TestCase):
+    def setUp(self):
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        os.makedirs(os.path.join(work.name, 'Settings'))
+        self.ini_path = os.path.join(work.name, 'Settings', 'Config.ini')
+        patcher = mock.patch.object(pstg_config, 'get_app_dir', lambda: work.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def window(self, text):
+        with open(self.ini_path, 'w', encoding='utf-8') as config_file:
+            config_file.write(text)
+        return pstg_config.load_coalesce_window()
+
+    def test_window(self):
+        self.assertEqual(pstg_config.load_coalesce_window(), 0) # Config.iniがない場合は無効
+        self.assertEqual(self.window("[GeneralSettings]\nCoalesceWindowMs = 300\n"), 0.3)
+        self.assertEqual(self.window("[GeneralSettings]\nCoalesceWindowMs = abc\n"), 0)
+        # プロファイルを出力する場合はこのプロセスで計測するため、まとめない
+        debug = "[DebugSettings]\nShowDebugSettings = true\nOutputLog = true\nOutputProfile = true\n"
+        self.assertEqual(self.window("[GeneralSettings]\nCoalesceWindowMs = 300\n" + debug), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+import support
+import pstg_cache
+import pstg_diff
+import pstg_match
+import pstg_util
+from benchmark import synth
+
+ARCHIVE = os.path.join('mods', 'ModA', 'rom', 'mod_gm_module_tbl.farc')
+
+
+class ResolveModulesIncrementalTest(unittest.TestCase):
+    def setUp(self):
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        self.table_cache = pstg_cache.DirectoryCache(os.path.join(work.name, 'tables'), 16 * 1024 * 1024)
+        self.map_chara = pstg_util.load_chara_mapping()
+        self.rules = synth.make_rules(30)
+        self.matcher_calls = 0
+
+    def get_matcher(self, rules):
+        def get_matcher():
+            self.matcher_calls += 1
+            return pstg_match.RuleMatcher(rules)
+        return get_matcher
+
+    def resolve(self, modules, rules=None):
+        rules = rules or self.rules
+        assignments, table_diff = pstg_diff.resolve_modules_incremental(self.table_cache, ARCHIVE, modules, rules, self.get_matcher(rules), self.map_chara)
+        # 前回の状態の有無にかかわらず、全てのモジュールを決定し直した場合と同じ結果になる
+        self.assertEqual(assignments, pstg_match.resolve_modules(modules, pstg_match.RuleMatcher(rules), self.map_chara))
+        return table_diff
+
+    def test_matches_full_resolve(self):
+        modules = synth.make_modules(200)
+        self.assertIsNone(self.resolve(modules))
+        self.assertEqual(self.matcher_calls, 1)
+
+        # 変更がなければマッチャーを使わない
+        self.assertEqual(self.resolve(modules), {'added': 0, 'changed': 0, 'removed': 0, 'resolved': 0})
+        self.assertEqual(self.matcher_calls, 1)
+
+        # 追加・名前の変更・削除されたモジュールのみ設定を決定する
+        changed = [dict(module) for module in modules[5:]]
+        changed[0]['name'] = 'ミク 水着 Summer'
+        changed[1]['name'] = 'Unknown'
+        changed += synth.make_modules(10, seed=1)[:3]
+        for module, num in zip(changed[-3:], range(1000, 1003)):
+            module['module_num'] = str(num)
+        table_diff = self.resolve(changed)
+        self.assertEqual((table_diff['added'], table_diff['changed'], table_diff['removed']), (3, 2, 5))
+        self.assertLessEqual(table_diff['resolved'], 5)
+        self.assertEqual(self.matcher_calls, 2)
+
+    def test_rules_change_resolves_everything(self):
+        modules = synth.make_modules(100)
+        self.resolve(modules)
+        # PoseScale設定が変わった場合は前回の割り当て結果を使わない
+        self.assertIsNone(self.resolve(modules, synth.make_rules(30, seed=1)))
+        self.assertEqual(self.matcher_calls, 2)
+        self.assertEqual(self.resolve(modules, synth.make_rules(30, seed=1))['resolved'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import io
+import os
+import tempfile
+import unittest
+
+import support
+from pstg_aes import AESDecryptor
+import pstg_farc
+
+MODULE_TABLE = "module.0.chara=MIKU\nmodule.0.cos=COS_001\nmodule.0.id=0\nmodule.0.name=ミク\nmodule.data_list.length=1\n".encode('utf-8')
+
+FILES = {
+    'spr_other.bin': b'\x01\x02' * 300,
+    'gm_module_tbl.bin': MODULE_TABLE,
+    'str_array.bin': b'strings',
+}
+
+
+class AESTest(unittest.TestCase):
+    def test_fips197_vector(self):
+        # FIPS-197 Appendix C.1 (AES-128)
+        key = bytes(range(16))
+        plain = bytes.fromhex('00112233445566778899aabbccddeeff')
+        cipher = bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a')
+        self.assertEqual(support.encrypt_block(key, plain), cipher)
+        self.assertEqual(AESDecryptor(key).decrypt_block(cipher), plain)
+
+    def test_cbc_round_trip(self):
+        key, iv = bytes(range(16, 32)), bytes(range(16))
+        plain = bytes(range(256)) * 2
+        self.assertEqual(AESDecryptor(key).decrypt_cbc(support.encrypt_cbc(key, iv, plain), iv), plain)
+
+    def test_rejects_partial_block(self):
+        with self.assertRaises(ValueError):
+            AESDecryptor(bytes(16)).decrypt_ecb(b'\x00' * 15)
+
+
+class FarcReaderTest(unittest.TestCase):
+    def assert_round_trip(self, fmt, ft_flag=1):
+        with pstg_farc.FarcReader(io.BytesIO(support.build_farc(FILES, fmt, ft_flag))) as reader:
+            self.assertEqual(reader.format, fmt)
+            self.assertEqual([entry.name for entry in reader.entries], list(FILES))
+            for entry in reader.entries:
+                self.assertEqual(reader.read_entry(entry), FILES[entry.name])
+
+    def test_uncompressed(self):
+        self.assert_round_trip('FArc')
+
+    def test_compressed(self):
+        self.assert_round_trip('FArC')
+
+    def test_dt_encrypted(self):
+        self.assert_round_trip('FARC')
+
+    def test_ft_per_entry_flags(self):
+        self.assert_round_trip('FARC-FT', ft_flag=1)
+
+    def test_ft_header_flags(self):
+        # エントリが12バイトの場合も2件目以降のエントリがずれないこと
+        self.assert_round_trip('FARC-FT', ft_flag=0)
+
+    def test_not_farc(self):
+        with self.assertRaises(pstg_farc.FarcError):
+            pstg_farc.FarcReader(io.BytesIO(b'PK\x03\x04\x00\x00\x00\x00'))
+
+
+class ReadModuleTableTest(unittest.TestCase):
+    def test_selects_only_module_table(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            for fmt in ('FArc', 'FArC', 'FARC', 'FARC-FT'):
+                path = support.write_farc(os.path.join(work_dir, fmt, 'mod_pack.farc'), FILES, fmt)
+                self.assertEqual(pstg_farc.read_module_table(path), [('gm_module_tbl.bin', MODULE_TABLE)])
+
+    def test_nested_module_table_farc(self):
+        nested = support.build_farc({'mod_gm_module_id.bin': MODULE_TABLE}, 'FArC')
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = support.write_farc(os.path.join(work_dir, 'mod_pack.farc'), {'mod_gm_module_tbl.farc': nested, 'other.bin': b'x'})
+            self.assertEqual(pstg_farc.read_module_table(path), [('mod_gm_module_id.bin', MODULE_TABLE)])
+
+
+
+class GetDraggedFilesTest(unittest.TestCase):
+    def test_folder_with_module_table_farc(self):
+        # MyMod/romのように、gm_module_tbl*.farcを直接含むフォルダは解凍済みのフォルダとして扱わない
+        with tempfile.TemporaryDirectory() as work_dir:
+            rom_dir = os.path.join(work_dir, 'MyMod', 'rom')
+            farc_path = support.write_farc(os.path.join(rom_dir, 'mod_gm_module_tbl.farc'), {'mod_gm_module_tbl.bin': MODULE_TABLE}, 'FArC')
+            self.assertEqual(pstg_farc.list_module_table_bins(rom_dir), [])
+            self.assertEqual(pstg_farc.get_dragged_files([rom_dir]), [farc_path])
+            self.assertEqual(pstg_farc.get_dragged_files([os.path.join(work_dir, 'MyMod')]), [farc_path])
+            self.assertFalse(pstg_farc.is_raw_table_input(farc_path))
+
+    def test_extracted_folder_and_bins(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            table_dir = os.path.join(work_dir, 'mod_gm_module_tbl')
+            os.makedirs(table_dir)
+            for file_name in ('mod_gm_module_tbl.bin', 'other.bin'):
+                with open(os.path.join(table_dir, file_name), 'wb') as bin_file:
+                    bin_file.write(MODULE_TABLE)
+            loose_bin = os.path.join(work_dir, 'spr_mod.bin')
+            with open(loose_bin, 'wb') as bin_file:
+                bin_file.write(b'\x00')
+
+            self.assertEqual([name for name, _ in pstg_farc.list_module_table_bins(table_dir)], ['mod_gm_module_tbl.bin', 'other.bin'])
+            self.assertEqual(pstg_farc.get_dragged_files([table_dir]), [table_dir])
+            self.assertTrue(pstg_farc.is_raw_table_input(os.path.join(table_dir, 'other.bin')))
+            # モジュールテーブルではない.binは処理対象にしない
+            self.assertFalse(pstg_farc.is_raw_table_input(loose_bin))
+            self.assertEqual(pstg_farc.get_dragged_files([loose_bin]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+import support
+import pstg_cache
+import pstg_index
+
+MODULE_TABLE = b"module.0.chara=MIKU\nmodule.0.cos=COS_001\nmodule.0.id=500\nmodule.0.name=Miku\nmodule.data_list.length=1\n"
+
+
+class HashingReaderTest(unittest.TestCase):
+    def test_matches_hash_file_with_seeks(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, 'data.bin')
+            with open(path, 'wb') as data_file:
+                data_file.write(os.urandom(3 * pstg_cache.HASH_CHUNK_SIZE + 123))
+            reader = pstg_index.HashingReader(path)
+            try:
+                reader.read(10)
+                reader.seek(pstg_cache.HASH_CHUNK_SIZE + 5) # 前方へのシーク
+                reader.read(100)
+                reader.seek(3) # 後方へのシーク（ハッシュ済みの範囲）
+                self.assertEqual(len(reader.read(20)), 20)
+                self.assertEqual(reader.hexdigest(), pstg_cache.hash_file(path))
+            finally:
+                reader.close()
+
+
+class ScanLibraryTest(unittest.TestCase):
+    def test_archives_without_module_table_are_not_errors(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            mods = os.path.join(work_dir, 'mods')
+            table_path = support.write_farc(os.path.join(mods, 'ModA', 'rom', 'mod_gm_module_tbl.farc'), {'mod_gm_module_tbl.bin': MODULE_TABLE}, 'FArC')
+            support.write_farc(os.path.join(mods, 'ModA', 'rom', 'objset', 'mikitm500.farc'), {'mikitm500_obj.bin': b'\x00' * 64})
+
+            conn = pstg_index.open_index(os.path.join(work_dir, 'index.sqlite'))
+            try:
+                with self.assertNoLogs(level='ERROR'):
+                    stats = pstg_index.scan_library(conn, mods, max_workers=1)
+                self.assertEqual((stats['archives'], stats['scanned'], stats['errors'], stats['modules']), (2, 2, 0, 1))
+
+                # 更新日時だけが変わった場合は解析結果を置き換えない
+                os.utime(table_path, ns=(0, 0))
+                stats = pstg_index.scan_library(conn, mods, max_workers=1)
+                self.assertEqual((stats['scanned'], stats['unchanged'], stats['modules']), (0, 2, 1))
+                sha256 = conn.execute("SELECT sha256 FROM archives WHERE path = ?", (os.path.abspath(table_path),)).fetchone()[0]
+                self.assertEqual(sha256, pstg_cache.hash_file(table_path))
+            finally:
+                conn.close()
+
+    def test_extracted_folders_are_indexed(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            mods = os.path.join(work_dir, 'mods')
+            table_dir = os.path.join(mods, 'ModB', 'rom', 'gm_module_tbl')
+            os.makedirs(table_dir)
+            with open(os.path.join(table_dir, 'gm_module_tbl.bin'), 'wb') as table_file:
+                table_file.write(MODULE_TABLE)
+
+            conn = pstg_index.open_index(os.path.join(work_dir, 'index.sqlite'))
+            try:
+                stats = pstg_index.scan_library(conn, mods, max_workers=1)
+                self.assertEqual((stats['archives'], stats['scanned'], stats['errors'], stats['modules']), (1, 1, 0, 1))
+                stats = pstg_index.scan_library(conn, mods, max_workers=1)
+                self.assertEqual((stats['scanned'], stats['unchanged']), (0, 1))
+            finally:
+                conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import support
+import pstg_ipc
+import pstg_main
+
+ENDPOINT = 'test_service.json'
+
+
+class ServiceEndpointTest(unittest.TestCase):
+    def setUp(self):
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        patcher = mock.patch.object(pstg_ipc, 'get_app_dir', lambda: work.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.requests = []
+        self.endpoint = pstg_ipc.ServiceEndpoint(self.handle, ENDPOINT)
+        self.thread = threading.Thread(target=self.endpoint.serve_forever, kwargs={'idle_timeout': 10})
+        self.thread.start()
+        self.addCleanup(self.stop)
+        for _ in range(100): # 接続先ファイルが書き込まれるまで待つ
+            if pstg_ipc.read_endpoint(ENDPOINT):
+                break
+            threading.Event().wait(0.01)
+
+    def handle(self, request):
+        self.requests.append(request)
+        if request['command'] == 'stop':
+            return {'status': 'ok', 'stop': True}
+        return {'status': 'ok', 'echo': request.get('value')}
+
+    def stop(self):
+        if self.thread.is_alive():
+            pstg_ipc.send_request('stop', timeout=5, endpoint_name=ENDPOINT)
+            self.thread.join(5)
+
+    def test_request_and_ping(self):
+        self.assertEqual(pstg_ipc.send_request('run', timeout=5, endpoint_name=ENDPOINT, value=[1, 'a']), {'status': 'ok', 'echo': [1, 'a']})
+        self.assertEqual(pstg_ipc.ping(ENDPOINT)['status'], 'ok')
+        self.assertEqual([request['command'] for request in self.requests], ['run', 'ping'])
+
+    def test_invalid_token_is_rejected(self):
+        endpoint = pstg_ipc.read_endpoint(ENDPOINT)
+        pstg_ipc.write_endpoint(endpoint['port'], 'wrong-token', ENDPOINT)
+        self.assertEqual(pstg_ipc.send_request('run', timeout=5, endpoint_name=ENDPOINT), {'status': 'error', 'message': 'invalid token'})
+        self.assertIsNone(pstg_ipc.ping(ENDPOINT))
+        self.assertEqual(self.requests, []) # ハンドラーは呼び出されない
+        pstg_ipc.write_endpoint(endpoint['port'], endpoint['token'], ENDPOINT)
+
+    def test_stop_removes_endpoint(self):
+        self.assertEqual(pstg_ipc.send_request('stop', timeout=5, endpoint_name=ENDPOINT), {'status': 'ok'})
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertIsNone(pstg_ipc.read_endpoint(ENDPOINT))
+        self.assertIsNone(pstg_ipc.send_request('run', timeout=5, endpoint_name=ENDPOINT))
+
+
+class ServiceRequestTest(unittest.TestCase):
+    def test_commands(self):
+        self.assertEqual(pstg_main._handle_service_request({'command': 'ping'}), {'status': 'ok', 'pid': os.getpid()})
+        self.assertEqual(pstg_main._handle_service_request({'command': 'stop'}), {'status': 'ok', 'stop': True})
+        self.assertEqual(pstg_main._handle_service_request({'command': 'other'})['status'], 'error')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import configparser
+import unittest
+
+import support
+from pstg_match import KeywordAutomaton, RuleMatcher, resolve_modules, select_profiles, split_include_keywords
+
+
+def rule(chara, contains=None, exclude=None, pose='1'):
+    return {"Chara": chara, "ModuleNameContains": contains, "ModuleExclude": exclude, "PoseID": pose, "Scale": None}
+
+
+class KeywordAutomatonTest(unittest.TestCase):
+    def test_finds_overlapping_keywords(self):
+        automaton = KeywordAutomaton(["Swim", "Swimsuit", "suit", "imsu", "ミク"])
+        found = {automaton.keywords[keyword_id] for keyword_id in automaton.find("ミクSwimsuit")}
+        self.assertEqual(found, {"Swim", "Swimsuit", "suit", "imsu", "ミク"})
+
+    def test_failure_links(self):
+        automaton = KeywordAutomaton(["abcd", "bce"])
+        found = {automaton.keywords[keyword_id] for keyword_id in automaton.find("xabce")}
+        self.assertEqual(found, {"bce"})
+
+    def test_build_again_after_add(self):
+        automaton = KeywordAutomaton(["he", "she", "hers"])
+        automaton.add("his")
+        automaton.build()
+        automaton.build()
+        self.assertTrue(all(len(output) == len(set(output)) for output in automaton._output))
+        found = {automaton.keywords[keyword_id] for keyword_id in automaton.find("ushers his")}
+        self.assertEqual(found, {"he", "she", "hers", "his"})
+
+    def test_add_returns_existing_id(self):
+        automaton = KeywordAutomaton(["Miku"])
+        self.assertEqual(automaton.add("Miku"), automaton.keyword_id("Miku"))
+        self.assertIsNone(automaton.keyword_id("Rin"))
+
+
+class SplitKeywordsTest(unittest.TestCase):
+    def test_drops_legacy_exclude_and_replacement_char(self):
+        self.assertEqual(split_include_keywords(" Swim , |Big, �,, suit "), ["Swim", "suit"])
+
+
+class RuleMatcherTest(unittest.TestCase):
+    def resolve(self, settings, name, chara="MIK"):
+        setting, match_type = RuleMatcher(settings).resolve(name, chara)
+        return (settings.index(setting) if setting is not None else None), match_type
+
+    def test_specific_before_fallback(self):
+        # Fallbackが先に書かれていてもSpecificが優先される
+        settings = [rule("MIK"), rule("MIK", "Swim")]
+        self.assertEqual(self.resolve(settings, "Miku Swim"), (1, 'Specific'))
+        self.assertEqual(self.resolve(settings, "Miku Casual"), (0, 'Fallback'))
+
+    def test_first_specific_in_file_order(self):
+        # 一致するキーワードの出現位置ではなく、設定ファイルの順で選ばれる
+        settings = [rule("MIK", "suit"), rule("MIK", "Swim"), rule("MIK", "Swimsuit")]
+        self.assertEqual(self.resolve(settings, "Swimsuit"), (0, 'Specific'))
+        settings = [rule("MIK", "Casual, Swim"), rule("MIK", "Swimsuit, Miku")]
+        self.assertEqual(self.resolve(settings, "Miku Swimsuit"), (0, 'Specific'))
+
+    def test_excluded_specific_falls_through(self):
+        settings = [rule("MIK", "Swim", exclude="Big"), rule("MIK", "Swim"), rule("MIK")]
+        self.assertEqual(self.resolve(settings, "Big Swim"), (1, 'Specific'))
+        settings = [rule("MIK", "Swim", exclude="Big"), rule("MIK")]
+        self.assertEqual(self.resolve(settings, "Big Swim"), (1, 'Fallback'))
+
+    def test_legacy_exclude_keyword_is_ignored(self):
+        settings = [rule("MIK", "|Swim"), rule("MIK", "Miku, |Big")]
+        self.assertEqual(self.resolve(settings, "Swim |Swim"), (None, None))
+        self.assertEqual(self.resolve(settings, "Big Miku"), (1, 'Specific'))
+
+    def test_replacement_char_keyword_is_ignored(self):
+        settings = [rule("MIK", "�"), rule("MIK", "�, Miku")]
+        self.assertEqual(self.resolve(settings, "��"), (None, None))
+        self.assertEqual(self.resolve(settings, "�Miku"), (1, 'Specific'))
+
+    def test_fallback_excludes(self):
+        settings = [rule("MIK", exclude="Big, Small"), rule("MIK", exclude="Small"), rule("MIK")]
+        self.assertEqual(self.resolve(settings, "Normal"), (0, 'Fallback'))
+        self.assertEqual(self.resolve(settings, "Big"), (1, 'Fallback'))
+        self.assertEqual(self.resolve(settings, "Small"), (2, 'Fallback'))
+
+    def test_fallback_without_match(self):
+        settings = [rule("MIK", exclude="Big")]
+        self.assertEqual(self.resolve(settings, "Big"), (None, None))
+
+    def test_chara_must_match(self):
+        settings = [rule("RIN", "Swim"), rule("RIN")]
+        self.assertEqual(self.resolve(settings, "Swim", chara="MIK"), (None, None))
+        self.assertEqual(self.resolve(settings, "Swim", chara="RIN"), (0, 'Specific'))
+
+    def test_empty_keywords_are_fallback(self):
+        settings = [rule("MIK", ""), rule("MIK", " , ")]
+        # 空文字はFallback、空要素のみの指定はどのモジュールにも一致しないSpecific
+        self.assertEqual(self.resolve(settings, "Miku"), (0, 'Fallback'))
+
+    def test_resolve_modules_maps_chara(self):
+        settings = [rule("MIK", "Swim"), rule("LUK")]
+        modules = [{"chara": "MIKU", "name": "Swim"}, {"chara": "LUKA", "name": "Swim"}, {"chara": "RIN", "name": "Swim"}]
+        map_chara = {"MIKU": "MIK", "LUKA": "LUK"}.get
+        assignments = resolve_modules(modules, RuleMatcher(settings), lambda chara, _mapping: map_chara(chara))
+        self.assertEqual([(setting and settings.index(setting), match_type) for _, setting, match_type in assignments],
+                         [(0, 'Specific'), (1, 'Fallback'), (None, None)])
+
+
+class SelectProfilesTest(unittest.TestCase):
+    def test_selects_matching_profiles_in_file_order(self):
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'TomlProfile_B': {'ModuleMatch': 'Swim', 'ModuleExclude': 'Big'},
+            'TomlProfile_A': {'ModuleMatch': 'Miku, |Swim'},
+            'TomlProfile_C': {'ModuleMatch': 'Rin'},
+            'Other': {'ModuleMatch': 'Miku'},
+        })
+        modules = [{"name": "Big Swim"}, {"name": "Miku"}]
+        self.assertEqual(select_profiles(modules, config), ['TomlProfile_A'])
+        modules.append({"name": "Swim"})
+        self.assertEqual(select_profiles(modules, config), ['TomlProfile_B', 'TomlProfile_A'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+import pstg_cache
+from pstg_merge import OutputMerger, entry_keys, remove_pose_keys, remove_scale_keys, save_toml, update_pose_text, update_scale_text
+
+
+class OutputMergerTest(unittest.TestCase):
+    def merge(self, policy, values):
+        merger = OutputMerger(policy)
+        for archive, pose_id in values:
+            merger.add_pose('pose', [f'900 = {pose_id}'], archive)
+        return merger
+
+    def test_first_keeps_every_dropped_archive(self):
+        merger = self.merge('first', [('a', 1), ('b', 2), ('c', 3), ('d', 1)])
+        self.assertEqual(merger.pose_entries('pose'), ['900 = 1'])
+        self.assertEqual(merger.conflicts, [['Pose', '900', 'a', ['b', 'c']]])
+        self.assertEqual(merger.duplicates, 1)
+
+    def test_last_moves_previous_winners_to_dropped(self):
+        merger = self.merge('last', [('a', 1), ('b', 2), ('c', 3)])
+        self.assertEqual(merger.pose_entries('pose'), ['900 = 3'])
+        self.assertEqual(merger.conflicts, [['Pose', '900', 'c', ['a', 'b']]])
+
+    def test_skip_records_all_contributors(self):
+        merger = self.merge('skip', [('a', 1), ('b', 2), ('c', 3), ('d', 1)])
+        self.assertEqual(merger.pose_entries('pose'), [])
+        self.assertEqual(merger.conflicts, [['Pose', '900', None, ['a', 'b', 'c', 'd']]])
+
+    def test_scale_conflicts(self):
+        merger = OutputMerger('first')
+        for archive, scale in (('a', '1.0'), ('b', '1.1'), ('c', '1.2')):
+            merger.add_scale([f'[[cos_scale]]\nchara = MIK\ncos = 0\nscale = {scale}\n'], archive)
+        self.assertEqual(merger.conflicts, [['Scale', ('MIK', '0'), 'a', ['b', 'c']]])
+
+
+
+class UpdateTextTest(unittest.TestCase):
+    def test_pose_append_keeps_trailing_newline(self):
+        text, updated, appended = update_pose_text('900 = 1\n', ['900 = 2', '901 = 3'])
+        self.assertEqual((text, updated, appended), ('900 = 2\n901 = 3\n', 1, 1))
+        text, _, _ = update_pose_text('900 = 1', ['901 = 3'])
+        self.assertEqual(text, '900 = 1\n901 = 3')
+
+    def test_scale_matches_quoted_and_padded_keys(self):
+        existing = '[[cos_scale]]\nchara = "MIK"\ncos = "001"\nscale = 1.0 # 手動\n'
+        text, updated, appended = update_scale_text(existing, ['[[cos_scale]]\nchara = MIK\ncos = 1\nscale = 1.1\n'])
+        self.assertEqual((text, updated, appended), ('[[cos_scale]]\nchara = "MIK"\ncos = "001"\nscale = 1.1 # 手動\n', 1, 0))
+
+    def test_scale_append_keeps_single_trailing_newline(self):
+        existing = '[[cos_scale]]\nchara = MIK\ncos = 0\nscale = 1.0\n'
+        text, _, appended = update_scale_text(existing, ['[[cos_scale]]\nchara = LUK\ncos = 0\nscale = 1.2\n'])
+        self.assertEqual(appended, 1)
+        self.assertEqual(text, existing + '\n[[cos_scale]]\nchara = LUK\ncos = 0\nscale = 1.2\n')
+
+    def test_remove_pose_keys_keeps_other_lines(self):
+        text, removed = remove_pose_keys('# 手動\n900 = 1\n901 = 2 # memo\n902 = 3\n', {'901', '903'})
+        self.assertEqual((text, removed), ('# 手動\n900 = 1\n902 = 3\n', 1))
+
+    def test_remove_scale_keys_removes_whole_tables(self):
+        existing = ('[[cos_scale]]\nchara = MIK\ncos = 0\nscale = 1.0\n\n'
+                    '[[cos_scale]]\nchara = "LUK"\ncos = "002"\nscale = 1.1\n\n# RIN\n'
+                    '[[cos_scale]]\nchara = RIN\ncos = 0\nscale = 1.2\n')
+        text, removed = remove_scale_keys(existing, {('LUK', 2)})
+        self.assertEqual(removed, 1)
+        self.assertEqual(text, '[[cos_scale]]\nchara = MIK\ncos = 0\nscale = 1.0\n\n# RIN\n[[cos_scale]]\nchara = RIN\ncos = 0\nscale = 1.2\n')
+
+
+class SaveTomlTest(unittest.TestCase):
+    def setUp(self):
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        patcher = mock.patch.object(pstg_cache, 'get_cache_dir', lambda: os.path.join(work.name, 'Cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.work = work.name
+
+    def save(self, name, entries, kind, source):
+        save_path = os.path.join(self.work, name)
+        save_toml(save_path, entries, kind, overwrite=True, update_existing=True, sources={source: entry_keys(entries, kind)})
+        with open(save_path, encoding='utf-8') as toml_file:
+            return toml_file.read()
+
+    def test_pose_removes_missing_ids_of_the_same_archive(self):
+        self.save('pose.toml', ['900 = 1', '901 = 2', '902 = 3'], 'pose', 'a.farc')
+        with open(os.path.join(self.work, 'pose.toml'), 'a', encoding='utf-8') as toml_file:
+            toml_file.write('\n999 = 9 # 手動で追加\n')
+        self.save('pose.toml', ['902 = 3', '903 = 4'], 'pose', 'b.farc')
+
+        # a.farcの出力から消えた900と902のうち、b.farcも出力した902は残す
+        text = self.save('pose.toml', ['901 = 5'], 'pose', 'a.farc')
+        self.assertEqual(text, '901 = 5\n902 = 3\n999 = 9 # 手動で追加\n903 = 4\n')
+        # 出力が空になった場合も前回の出力を削除する
+        self.assertEqual(self.save('pose.toml', [], 'pose', 'a.farc'), '902 = 3\n999 = 9 # 手動で追加\n903 = 4\n')
+
+    def test_scale_removes_missing_tables(self):
+        entry = '[[cos_scale]]\nchara = {}\ncos = {}\nscale = 1.0\n'
+        self.save('scale_db.toml', [entry.format(0, 1), entry.format(3, 2)], 'scale', 'a.farc')
+        text = self.save('scale_db.toml', [entry.format(3, 2)], 'scale', 'a.farc')
+        self.assertEqual(text, entry.format(3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
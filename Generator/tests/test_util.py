@@ -0,0 +1,110 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import support
+import pstg_extract
+import pstg_util
+
+MODULE_TABLE = b"module.0.chara=MIKU\nmodule.0.cos=COS_001\nmodule.0.id=0\nmodule.0.name=Miku\nmodule.data_list.length=1\n"
+
+
+class TempWorkspaceTest(unittest.TestCase):
+    def tearDown(self):
+        pstg_util.wait_for_temp_cleanup()
+
+    def test_workspace_is_per_thread(self):
+        seen = {}
+        inside = threading.Barrier(2)
+
+        def run(name):
+            with pstg_util.temp_workspace('system') as workspace:
+                inside.wait(5) # 両方のスレッドがワークスペース内にいる状態で確認する
+                seen[name] = (workspace, pstg_util.get_temp_dir())
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(seen['a'][0], seen['a'][1])
+        self.assertEqual(seen['b'][0], seen['b'][1])
+        self.assertNotEqual(seen['a'][0], seen['b'][0])
+        self.assertIsNone(pstg_util.current_workspace())
+
+    def test_no_workspace_outside_context(self):
+        with self.assertRaises(RuntimeError):
+            pstg_util.get_temp_dir()
+        # Tempワークスペースの外ではmodule_data.jsonを保存せず、ワークスペースも作成しない
+        modules = pstg_extract.process_data([('gm_module_tbl.bin', MODULE_TABLE)])
+        self.assertEqual([module['name'] for module in modules], ['Miku'])
+        self.assertIsNone(pstg_util.current_workspace())
+
+    def test_module_data_json_only_when_requested(self):
+        sources = [('gm_module_tbl.bin', MODULE_TABLE)]
+        with pstg_util.temp_workspace('system') as workspace:
+            pstg_extract.process_data(sources)
+            self.assertFalse(os.path.exists(os.path.join(workspace, 'module_data.json')))
+            pstg_extract.process_data(sources, save_json=True) # Tempを残すデバッグ設定の場合
+            self.assertTrue(os.path.exists(os.path.join(workspace, 'module_data.json')))
+
+
+class SaveFileTest(unittest.TestCase):
+    def setUp(self):
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        self.work = work.name
+        self.path = os.path.join(self.work, 'pose.toml')
+
+    def read(self):
+        with open(self.path, encoding='utf-8') as saved_file:
+            return saved_file.read()
+
+    def test_identical_content_is_skipped(self):
+        self.assertTrue(pstg_util.save_file_with_timestamp(self.path, '1 = 2'))
+        os.utime(self.path, (0, 0))
+        # 内容が同じ場合は書き換えず、バックアップも作成しない
+        self.assertFalse(pstg_util.save_file_with_timestamp(self.path, '1 = 2'))
+        self.assertFalse(pstg_util.save_file_with_timestamp(self.path, '1 = 2', overwrite=True))
+        self.assertEqual(os.path.getmtime(self.path), 0)
+        self.assertEqual(pstg_util.list_backups(self.path), [])
+
+    def test_changed_content_is_backed_up(self):
+        pstg_util.save_file_with_timestamp(self.path, '1 = 2')
+        self.assertTrue(pstg_util.save_file_with_timestamp(self.path, '1 = 3'))
+        self.assertEqual(self.read(), '1 = 3')
+        backups = pstg_util.list_backups(self.path)
+        self.assertEqual(len(backups), 1)
+        with open(backups[0], encoding='utf-8') as backup_file:
+            self.assertEqual(backup_file.read(), '1 = 2')
+
+        # 上書きする場合はバックアップを作成しない
+        self.assertTrue(pstg_util.save_file_with_timestamp(self.path, '1 = 4', overwrite=True))
+        self.assertEqual((self.read(), len(pstg_util.list_backups(self.path))), ('1 = 4', 1))
+
+    def test_backup_limit_prunes_oldest(self):
+        pstg_util.save_file_with_timestamp(self.path, 'old')
+        old_backups = [os.path.join(self.work, f'pose_2020010100000{index}.toml') for index in range(5)]
+        for backup_path in old_backups + [os.path.join(self.work, 'pose_notes.toml')]:
+            with open(backup_path, 'w', encoding='utf-8') as backup_file:
+                backup_file.write('backup')
+
+        pstg_util.save_file_with_timestamp(self.path, 'new', backup_limit=3)
+        backups = pstg_util.list_backups(self.path)
+        # 今回のバックアップと、それより前の新しい2件だけが残る（バックアップ以外のファイルは削除しない）
+        self.assertEqual(backups[:2], old_backups[-2:])
+        self.assertEqual(len(backups), 3)
+        self.assertTrue(os.path.exists(os.path.join(self.work, 'pose_notes.toml')))
+
+        # 0は無制限
+        for backup_path in old_backups:
+            with open(backup_path, 'w', encoding='utf-8') as backup_file:
+                backup_file.write('backup')
+        pstg_util.save_file_with_timestamp(self.path, 'newer', backup_limit=0)
+        self.assertTrue(all(os.path.exists(backup_path) for backup_path in old_backups))
+
+
+if __name__ == '__main__':
+    unittest.main()